@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+#
+# bracket.py -- round-robin and elimination schedules as NumPy arrays
+#
+# A Schedule lists every game of a tournament up front, in an order where
+# each game comes after the games that feed it.  A game either names its
+# players or takes them from earlier games: the winner, or for the losers'
+# bracket of a double elimination the loser, of the source game.  Player id
+# NO_PLAYER is an empty slot: a game with one player is a bye, a game with
+# none is skipped.
+#
+#   schedule = bracket.doubleElimination(seeds)
+#   player1, player2, winner = bracket.resolve(schedule, results.get)
+#
+
+import collections
+
+import numpy
+from numpy.lib.stride_tricks import as_strided
+
+# Player id of an empty slot (the missing opponent of a bye)
+NO_PLAYER = 0
+
+# Player id of a slot whose source game has not been decided yet
+UNDECIDED = -1
+
+# Values of Schedule.bracket
+WINNERS, LOSERS, FINAL = 0, 1, 2
+
+# One array per column, one entry per game:
+#   round: the round the game is played in, from 1; every game of a player
+#     is in a later round than the games it depends on
+#   bracket: WINNERS (also every round-robin game), LOSERS or FINAL
+#   player1, player2: the players, NO_PLAYER when taken from a source game
+#     or empty; player1 is the higher seed (or white in a round robin)
+#   source1, source2: the game whose winner (or loser) takes the slot, -1
+#     when the player is given
+#   loser1, loser2: whether the slot takes the loser of its source game
+Schedule = collections.namedtuple(
+    'Schedule',
+    'round bracket player1 player2 source1 source2 loser1 loser2')
+
+
+def roundRobin(players):
+    """Schedules every player against every other with the circle method.
+
+    The first player stays put while the others rotate one place each
+    round.  With an odd number of players one player has a bye each round.
+
+    Args:
+      players: the player ids
+
+    Returns:
+      A Schedule of n - 1 rounds of n / 2 games (n rounded up to even).
+    """
+    players = numpy.asarray(players, dtype=numpy.int64)
+    n = len(players) + len(players) % 2
+    if n < 2:
+        return _schedule([])
+    seats = numpy.zeros(n, dtype=numpy.int64)
+    seats[:len(players)] = players
+    # Board k of round r (from 0) pairs seat 1 + (r + k - 1) % m against
+    # seat 1 + (r - k - 1) % m.  Both are diagonals of one rotation of the
+    # seats, read in place as strided views rather than built with modulo.
+    m = n - 1
+    rotation = seats[1 + numpy.arange(-m, 2 * m) % m]
+    step = rotation.strides[0]
+    home = as_strided(rotation[m - 1:], shape=(m, n // 2),
+                      strides=(step, step))
+    away = as_strided(rotation[m - 1:], shape=(m, n // 2),
+                      strides=(step, -step))
+    # Colors alternate between boards; the first board seats the fixed
+    # player, whose color alternates between rounds
+    swap = numpy.zeros((m, n // 2), dtype=bool)
+    swap[:, 1::2] = True
+    player1 = numpy.where(swap, away, home)
+    player2 = numpy.where(swap, home, away)
+    white = numpy.arange(m) % 2 == 0
+    player1[:, 0] = numpy.where(white, seats[0], away[:, 0])
+    player2[:, 0] = numpy.where(white, away[:, 0], seats[0])
+    # A bye is listed with the player first
+    bye = player1 == NO_PLAYER
+    player1, player2 = (numpy.where(bye, player2, player1),
+                        numpy.where(bye, NO_PLAYER, player2))
+    round = numpy.repeat(numpy.arange(1, n), n // 2)
+    return _schedule([_games(round, player1.ravel(), player2.ravel())])
+
+
+def seedOrder(size):
+    """Returns the bracket positions of seeds 0 .. size - 1.
+
+    size is a power of two.  Adjacent positions meet in the first round
+    (seed i against seed size - 1 - i) and the top seeds can only meet in
+    the last rounds.
+    """
+    order = numpy.zeros(1, dtype=numpy.int64)
+    while len(order) < size:
+        order = numpy.column_stack((order, 2 * len(order) - 1 - order)).ravel()
+    return order
+
+
+def singleElimination(seeds):
+    """Schedules a knock-out bracket.
+
+    The field is filled up to a power of two with byes, which go to the top
+    seeds.
+
+    Args:
+      seeds: the player ids, best seed first (e.g. from playerStandings())
+
+    Returns:
+      A Schedule whose last game is the final.
+    """
+    return _elimination(seeds, double=False)
+
+
+def doubleElimination(seeds):
+    """Schedules a double elimination bracket.
+
+    Losers of the winners' bracket drop into the losers' bracket, crossing
+    sides on alternate rounds to delay rematches.  The final is played once
+    between the two brackets' winners.
+
+    Args:
+      seeds: the player ids, best seed first
+
+    Returns:
+      A Schedule whose last game is the final.
+    """
+    return _elimination(seeds, double=True)
+
+
+def _elimination(seeds, double):
+    seeds = numpy.asarray(seeds, dtype=numpy.int64)
+    n = len(seeds)
+    if n < 2:
+        return _schedule([])
+    size = 1 << int(n - 1).bit_length()
+    order = seedOrder(size)
+    slots = numpy.where(order < n, seeds[numpy.minimum(order, n - 1)],
+                        NO_PLAYER)
+    groups = [_games(numpy.ones(size // 2, dtype=numpy.int64), slots[0::2],
+                     slots[1::2])]
+    rounds = [1]
+    ends = [size // 2]
+    winners = [(0, size // 2)]
+    while winners[-1][1] - winners[-1][0] > 1:
+        start, end = winners[-1]
+        winners.append(_feed(groups, rounds, ends, numpy.arange(start, end)))
+    if not double:
+        return _schedule(groups)
+
+    # Losers' bracket: the first round pairs the first round's losers, then
+    # each winners' round drops its losers in against the survivors
+    losers = []
+    if len(winners) > 1:
+        start, end = winners[0]
+        losers.append(_feed(groups, rounds, ends, numpy.arange(start, end),
+                            loser=(True, True)))
+    for i, (start, end) in enumerate(winners[1:]):
+        dropped = numpy.arange(start, end)
+        if i % 2:
+            dropped = dropped[::-1]
+        survivors = numpy.arange(*losers[-1])
+        losers.append(_feed(groups, rounds, ends,
+                            numpy.column_stack((survivors, dropped)).ravel(),
+                            loser=(False, True)))
+        if end - start > 1:
+            losers.append(_feed(groups, rounds, ends,
+                                numpy.arange(*losers[-1])))
+    final = numpy.array([winners[-1][0], losers[-1][0] if losers
+                         else winners[-1][0]])
+    _feed(groups, rounds, ends, final, loser=(False, not losers))
+    brackets = numpy.zeros(ends[-1], dtype=numpy.int8)
+    brackets[winners[-1][1]:ends[-2]] = LOSERS
+    brackets[-1] = FINAL
+    return _schedule(groups, brackets)
+
+
+def _feed(groups, rounds, ends, sources, loser=(False, False)):
+    """Adds the games fed by consecutive pairs of source games.
+
+    Returns the (start, end) game indexes of the new games.
+    """
+    start = ends[-1]
+    count = len(sources) // 2
+    # The first sources of a group are all played in one round, and so are
+    # the second ones
+    source_round = max(rounds[_group(ends, sources[0])],
+                       rounds[_group(ends, sources[1])])
+    groups.append(_games(
+        numpy.full(count, source_round + 1, dtype=numpy.int64),
+        source1=sources[0::2], source2=sources[1::2], loser=loser))
+    rounds.append(source_round + 1)
+    ends.append(start + count)
+    return start, start + count
+
+
+def _group(ends, game):
+    return numpy.searchsorted(ends, game, side='right')
+
+
+def _games(round, player1=None, player2=None, source1=None, source2=None,
+           loser=(False, False)):
+    """Returns the Schedule columns but bracket of a group of games."""
+    count = len(round)
+    none = numpy.full(count, NO_PLAYER, dtype=numpy.int64)
+    no_source = numpy.full(count, -1, dtype=numpy.int64)
+    return (round,
+            none if player1 is None else player1,
+            none if player2 is None else player2,
+            no_source if source1 is None else source1,
+            no_source if source2 is None else source2,
+            numpy.full(count, loser[0], dtype=bool),
+            numpy.full(count, loser[1], dtype=bool))
+
+
+def _schedule(groups, brackets=None):
+    """Concatenates _games() groups into a Schedule."""
+    if not groups:
+        groups = [_games(numpy.zeros(0, dtype=numpy.int64))]
+    columns = [numpy.concatenate(column) if len(column) > 1 else column[0]
+               for column in zip(*groups)]
+    if brackets is None:
+        brackets = numpy.zeros(len(columns[0]), dtype=numpy.int8)
+    return Schedule(columns[0], brackets, *columns[1:])
+
+
+def resolve(schedule, winners):
+    """Fills in the players of every game that can be decided so far.
+
+    Args:
+      schedule: a Schedule
+      winners: a function of (round, player1, player2) returning the winner
+        of a game between two players, or None if it has not been played
+
+    Returns:
+      A (player1, player2, winner) tuple of arrays, one entry per game:
+      UNDECIDED where a source game has not been decided yet, NO_PLAYER for
+      an empty slot.  A bye is won by its player.
+    """
+    games = len(schedule.round)
+    player1 = schedule.player1.copy()
+    player2 = schedule.player2.copy()
+    winner = numpy.full(games, UNDECIDED, dtype=numpy.int64)
+    loser = numpy.full(games, UNDECIDED, dtype=numpy.int64)
+    source1, source2 = schedule.source1.tolist(), schedule.source2.tolist()
+    loser1, loser2 = schedule.loser1.tolist(), schedule.loser2.tolist()
+    for game in range(games):
+        if source1[game] >= 0:
+            player1[game] = (loser if loser1[game] else winner)[source1[game]]
+        if source2[game] >= 0:
+            player2[game] = (loser if loser2[game] else winner)[source2[game]]
+        p1, p2 = int(player1[game]), int(player2[game])
+        if UNDECIDED in (p1, p2):
+            continue
+        if NO_PLAYER in (p1, p2):
+            winner[game], loser[game] = p1 or p2, NO_PLAYER
+            continue
+        won = winners(int(schedule.round[game]), p1, p2)
+        if won is not None:
+            winner[game], loser[game] = won, p2 if won == p1 else p1
+    return player1, player2, winner
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+# coordinator.py -- pairs and reports rounds of many tournaments at once
+#
+# Each tournament is played by one task of a thread pool: the task pairs the
+# tournament's next round with tournament.pairRound(), asks a decide
+# function for the results and records them with tournament.reportNextRound().
+# Both take the tournament's advisory lock and check the round number, so
+# coordinators in several processes (or a coordinator and a terminal) can
+# work on the same tournaments: a round that someone else reported first is
+# skipped, never recorded twice.
+#
+#   played = coordinator.playRounds(tournament_ids, 5, decide)
+#
+
+import multiprocessing.pool
+
+import tournament
+
+# Number of tournaments played at the same time by default; more threads
+# than pooled connections would only wait for a connection
+WORKERS = tournament.POOL_MAX_CONN
+
+
+def firstPlayerWins(t, round, pairings):
+    """A decide function: the first player of each pair wins."""
+    return [(id1, id2, id1) for (id1, name1, id2, name2) in pairings]
+
+
+def playTournament(t, rounds, decide=firstPlayerWins):
+    """Plays a tournament's rounds up to and including round `rounds`.
+
+    Args:
+      t: the id number of the tournament
+      rounds: the last round to play
+      decide: a function of (tournament, round, pairings) returning the
+        round's (player1, player2, winner) results
+
+    Returns:
+      The number of rounds this call reported; rounds reported meanwhile by
+      someone else are not counted.
+    """
+    played = 0
+    for round in range(tournament.lastRound(t) + 1, rounds + 1):
+        try:
+            pairings = tournament.pairRound(t, round)[1]
+            tournament.reportNextRound(t, round, decide(t, round, pairings))
+            played += 1
+        except tournament.RoundConflict:
+            continue
+    return played
+
+
+def playRounds(tournaments, rounds, decide=firstPlayerWins, workers=WORKERS):
+    """Plays many tournaments up to round `rounds`, several at a time.
+
+    Args:
+      tournaments: the id numbers of the tournaments
+      rounds: the last round to play in each tournament
+      decide: see playTournament()
+      workers: the number of tournaments played at the same time
+
+    Returns:
+      A dict mapping each tournament id to the number of rounds reported.
+    """
+    tournaments = list(tournaments)
+    threads = multiprocessing.pool.ThreadPool(workers)
+    try:
+        played = threads.map(
+            lambda t: playTournament(t, rounds, decide), tournaments)
+    finally:
+        threads.close()
+        threads.join()
+    return dict(zip(tournaments, played))
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+#
+# instrument.py -- query instrumentation for tournament.py
+#
+# Records every statement the tournament functions send to PostgreSQL: the
+# function that issued it, its SQL, the rows it returned and its latency.
+# Records go to sinks: MemorySink keeps them for inspection, LogSink logs
+# them and PrometheusSink writes counters per function to a text file.
+#
+#   with instrument.profile() as stats:
+#       pairings = tournament.swissPairings(t)
+#       tournament.reportRound(t, round, results)
+#   print(stats.calls())
+#
+
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2.extensions
+
+import tournament
+
+# One statement: the public tournament.py function that issued it (None
+# outside of one), its SQL, the rows it returned or affected (None when
+# unknown, e.g. for a server-side cursor) and its latency in seconds
+Query = collections.namedtuple('Query', 'call sql rows seconds')
+
+_sinks = []
+_sinks_lock = threading.Lock()
+
+# The profile() blocks running, and whether the first of them installed
+# InstrumentedCursor (and so the last one out uninstalls it)
+_profiles = 0
+_profile_installed = False
+
+
+def _caller():
+    """Returns the name of the outermost tournament.py function running.
+
+    Walks the whole stack, so it is called once per cursor rather than per
+    statement.
+    """
+    call = None
+    frame = sys._getframe(2)
+    while frame is not None:
+        name = frame.f_code.co_name
+        if frame.f_globals.get('__name__') == tournament.__name__ and \
+                not name.startswith('_') and name != 'connect':
+            call = name
+        frame = frame.f_back
+    return call
+
+
+def _record(call, sql, rows, seconds):
+    if not _sinks:
+        return
+    query = Query(call, sql if isinstance(sql, str) else str(sql),
+                  rows if rows >= 0 else None, seconds)
+    for sink in list(_sinks):
+        sink.record(query)
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor that reports each statement to the installed sinks.
+
+    The statements are attributed to the function that opened the cursor,
+    usually through tournament.connect().
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedCursor, self).__init__(*args, **kwargs)
+        self.call = _caller()
+
+    def execute(self, query, vars=None):
+        start = time.time()
+        try:
+            return super(InstrumentedCursor, self).execute(query, vars)
+        finally:
+            _record(self.call, query, self.rowcount, time.time() - start)
+
+    def executemany(self, query, vars_list):
+        start = time.time()
+        try:
+            return super(InstrumentedCursor, self).executemany(query,
+                                                               vars_list)
+        finally:
+            _record(self.call, query, self.rowcount, time.time() - start)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.time()
+        try:
+            return super(InstrumentedCursor, self).copy_expert(sql, file,
+                                                               size)
+        finally:
+            _record(self.call, sql, self.rowcount, time.time() - start)
+
+
+def install():
+    """Make tournament.connect() yield InstrumentedCursor cursors.
+
+    Connections checked out from then on use it; calls already running keep
+    their cursors and the pool is left alone.  Returns False if it was
+    already installed.
+    """
+    if tournament.CURSOR_FACTORY is InstrumentedCursor:
+        return False
+    tournament.CURSOR_FACTORY = InstrumentedCursor
+    return True
+
+
+def uninstall():
+    """Go back to plain psycopg2 cursors."""
+    if tournament.CURSOR_FACTORY is InstrumentedCursor:
+        tournament.CURSOR_FACTORY = None
+
+
+def addSink(sink):
+    """Start sending the recorded statements to sink."""
+    with _sinks_lock:
+        _sinks.append(sink)
+
+
+def removeSink(sink):
+    """Stop sending the recorded statements to sink."""
+    with _sinks_lock:
+        _sinks.remove(sink)
+
+
+class MemorySink(object):
+    """Keeps every recorded Query in memory.
+
+    Attributes:
+      queries: the Query records, in the order they finished
+    """
+
+    def __init__(self):
+        self.queries = []
+        self._lock = threading.Lock()
+
+    def record(self, query):
+        with self._lock:
+            self.queries.append(query)
+
+    def flush(self):
+        pass
+
+    def calls(self):
+        """Returns {call: (queries, rows, seconds)} totals per function."""
+        return self._totals(lambda query: query.call)
+
+    def statements(self):
+        """Returns {sql: (queries, rows, seconds)} totals per statement."""
+        return self._totals(lambda query: query.sql)
+
+    def _totals(self, key):
+        totals = {}
+        with self._lock:
+            for query in self.queries:
+                count, rows, seconds = totals.get(key(query), (0, 0, 0.0))
+                totals[key(query)] = (count + 1, rows + (query.rows or 0),
+                                      seconds + query.seconds)
+        return totals
+
+
+class LogSink(object):
+    """Logs every recorded Query.
+
+    Args:
+      logger: the logging.Logger to use (default the 'tournament.queries'
+        logger)
+      level: the logging level of the messages
+    """
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger('tournament.queries')
+        self.level = level
+
+    def record(self, query):
+        self.logger.log(self.level, "%s: %d rows in %.3fms: %s",
+                        query.call, query.rows or 0, query.seconds * 1000,
+                        ' '.join(query.sql.split()))
+
+    def flush(self):
+        pass
+
+
+class PrometheusSink(object):
+    """Counts statements per function, written as a Prometheus text file.
+
+    flush() (called at the end of profile()) rewrites the file with the
+    totals so far, e.g. for the node exporter's textfile collector:
+
+      tournament_queries_total{call="swissPairings"} 2
+      tournament_query_rows_total{call="swissPairings"} 64
+      tournament_query_seconds_total{call="swissPairings"} 0.0042
+
+    Args:
+      path: the file to write; it is replaced atomically
+    """
+
+    _METRICS = (
+        ('tournament_queries_total', 'Statements sent to the database.'),
+        ('tournament_query_rows_total', 'Rows returned or affected.'),
+        ('tournament_query_seconds_total', 'Time spent in statements.'),
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def record(self, query):
+        with self._lock:
+            count, rows, seconds = self._totals.get(query.call, (0, 0, 0.0))
+            self._totals[query.call] = (count + 1, rows + (query.rows or 0),
+                                        seconds + query.seconds)
+
+    def flush(self):
+        with self._lock:
+            totals = sorted(self._totals.items(),
+                            key=lambda item: item[0] or '')
+        lines = []
+        for i, (metric, description) in enumerate(self._METRICS):
+            lines.append("# HELP %s %s" % (metric, description))
+            lines.append("# TYPE %s counter" % metric)
+            for call, values in totals:
+                lines.append('%s{call="%s"} %r' % (metric, call or '',
+                                                   values[i]))
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as metrics:
+            metrics.write('\n'.join(lines) + '\n')
+        os.rename(temporary, self.path)
+
+
+@contextmanager
+def profile(*sinks):
+    """Record every statement issued while the block runs.
+
+    Installs InstrumentedCursor if it is not installed yet, until the last
+    of the profile() blocks running in any thread exits.  Statements from
+    every thread are recorded.
+
+    Args:
+      sinks: more sinks to send the statements to, flushed at the end
+
+    Yields:
+      A MemorySink holding the block's statements.
+    """
+    global _profiles, _profile_installed
+    stats = MemorySink()
+    with _sinks_lock:
+        if not _profiles:
+            _profile_installed = install()
+        _profiles += 1
+        _sinks.extend((stats,) + sinks)
+    try:
+        yield stats
+    finally:
+        for sink in (stats,) + sinks:
+            removeSink(sink)
+            sink.flush()
+        with _sinks_lock:
+            _profiles -= 1
+            if not _profiles and _profile_installed:
+                uninstall()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+# rating.py -- vectorized Elo ratings from the match history
+#
+
+import numpy
+
+# Rating of a player who has not played yet
+INITIAL_RATING = 1500.0
+
+# Most rating points a single match can move
+ELO_K = 32.0
+
+
+def expectedScore(rating1, rating2):
+    """Returns the Elo expected score of rating1 against rating2."""
+    return 1.0 / (1.0 + 10.0 ** ((numpy.asarray(rating2) -
+                                  numpy.asarray(rating1)) / 400.0))
+
+
+def _indexes(player_ids, ids):
+    """Returns the positions of ids in player_ids.
+
+    Database ids are small and dense, so they are looked up in a table
+    indexed by id; sparse ids fall back to a binary search.
+    """
+    n = len(player_ids)
+    if not n:
+        return numpy.zeros(len(ids), dtype=numpy.int64)
+    if 0 <= player_ids.min() and player_ids.max() < 4 * n + (1 << 16):
+        table = numpy.zeros(player_ids.max() + 1, dtype=numpy.int64)
+        table[player_ids] = numpy.arange(n)
+        return table[ids]
+    order = numpy.argsort(player_ids)
+    return order[numpy.searchsorted(player_ids[order], ids)]
+
+
+def _waves(i1, i2):
+    """Splits matches into consecutive runs with no player in common.
+
+    Returns the start of each run plus the end of the last one.  A run ends
+    just before the first match whose player already played in the run, so
+    rating the runs one after another, each all at once, gives the same
+    result as rating the matches one at a time.  A tournament reported round
+    by round gets one run per round.
+    """
+    m = len(i1)
+    if not m:
+        return numpy.zeros(1, dtype=numpy.int64)
+    # For each match, the last earlier match of either of its players.  The
+    # players' slots are interleaved so that slot // 2 is the match and
+    # sorted by player, then slot.  Sorting (player, slot) packed into one
+    # integer is much faster than an argsort, and both come back out of it.
+    slots = 2 * m
+    keys = numpy.column_stack((i1, i2)).ravel().astype(numpy.int64) * slots
+    keys += numpy.arange(slots)
+    keys.sort()
+    sorted_players, order = numpy.divmod(keys, slots)
+    previous = numpy.empty(2 * m, dtype=numpy.int64)
+    previous[order[0]] = -1
+    previous[order[1:]] = numpy.where(
+        sorted_players[1:] == sorted_players[:-1], order[:-1] // 2, -1)
+    conflict = numpy.maximum.accumulate(previous.reshape(m, 2).max(axis=1))
+
+    # The run starting at s ends at the first match conflicting with a
+    # match at or after s.  conflict is non-decreasing and below the match's
+    # own index, so searchsorted finds that match (or m) after s.
+    bounds = [0]
+    while bounds[-1] < m:
+        bounds.append(int(conflict.searchsorted(bounds[-1])))
+    return numpy.array(bounds, dtype=numpy.int64)
+
+
+def rateMatches(player_ids, player1, player2, winner, ratings=None):
+    """Applies Elo updates for a list of matches, in order.
+
+    The result is the same as updating the ratings one match at a time, but
+    each run of consecutive matches with no player in common (a round) is
+    updated at once with NumPy.  Byes (matches without a player 2) do not
+    change ratings.
+
+    Args:
+      player_ids: the ids of every player in the matches, in any order.
+      player1, player2, winner: the matches in the order they were played,
+        as three sequences of player ids, player2 being None for a bye.
+      ratings: the players' ratings before the first match, aligned with
+        player_ids (default INITIAL_RATING for everyone).
+
+    Returns:
+      A (ratings, games) tuple of arrays aligned with player_ids: the
+      ratings after the last match and the number of rated matches played.
+    """
+    player_ids = numpy.asarray(player_ids, dtype=numpy.int64)
+    n = len(player_ids)
+    if ratings is None:
+        ratings = numpy.full(n, INITIAL_RATING)
+    else:
+        ratings = numpy.array(ratings, dtype=numpy.float64)
+
+    p1 = numpy.asarray(player1, dtype=numpy.float64)
+    p2 = numpy.asarray(player2, dtype=numpy.float64)
+    won = numpy.asarray(winner, dtype=numpy.float64)
+    played = ~numpy.isnan(p2)
+    p1, p2, won = p1[played], p2[played], won[played]
+
+    i1 = _indexes(player_ids, p1.astype(numpy.int64))
+    i2 = _indexes(player_ids, p2.astype(numpy.int64))
+    score1 = (won == p1).astype(numpy.float64)
+    games = numpy.bincount(i1, minlength=n) + numpy.bincount(i2, minlength=n)
+
+    bounds = _waves(i1, i2).tolist()
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        a, b = i1[start:end], i2[start:end]
+        change = ELO_K * (score1[start:end] - expectedScore(ratings[a],
+                                                            ratings[b]))
+        ratings[a] += change
+        ratings[b] -= change
+    return ratings, games
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+#
+# simulate.py -- Monte Carlo simulation of Swiss-system tournament outcomes
+#
+# Plays many complete tournaments with the same pairing engine as
+# tournament.py, deciding each match at random from the players' ratings,
+# and reports how often each player finishes in the top places:
+#
+#   python simulate.py --ratings ratings.csv --tournaments 10000 --top 8
+#
+# ratings.csv holds one "name,rating" line per player.  Work is split into
+# fixed-size batches, each with its own seed, so results are reproducible
+# for a given --seed whatever the number of worker processes.
+#
+
+import argparse
+import csv
+import math
+import multiprocessing
+import time
+
+import numpy
+
+import swiss
+import tiebreak
+
+
+def winProbability(rating1, rating2):
+    """Returns the Elo expected score of rating1 against rating2."""
+    return 1.0 / (1.0 + 10.0 ** ((rating2 - rating1) / 400.0))
+
+
+def defaultRounds(num_players):
+    """Returns the usual number of Swiss rounds for a field: ceil(log2 n)."""
+    return max(1, int(math.ceil(math.log(max(num_players, 2), 2))))
+
+
+def roundOrder(ratings, wins, first, second):
+    """Returns the order in which the players are paired for the next round.
+
+    This is the order of tournament.swissPairings(): the first round by
+    rating, highest first, and later rounds by wins and then opponent wins
+    (tiebreak.opponentWins()), both descending; ties go to the lower player
+    number.
+
+    Args:
+      ratings: the players' ratings, indexed by player number.
+      wins: each player's wins so far.
+      first, second: the player numbers of the matches played so far, byes
+        excluded; both empty before the first round.
+    """
+    ids = numpy.arange(len(ratings))
+    if not len(first):
+        return numpy.lexsort((ids, -numpy.asarray(ratings)))
+    wins = numpy.asarray(wins)
+    buchholz = tiebreak.opponentWins(wins, numpy.asarray(first),
+                                     numpy.asarray(second))
+    return numpy.lexsort((ids, -buchholz, -wins))
+
+
+def playTournament(ratings, rounds, rng):
+    """Plays one tournament and returns the players' final places.
+
+    Players are numbered by their position in ratings.  Each round is paired
+    with swiss.pairRound() in the order of roundOrder() and every match is
+    decided at random with the Elo win probability.  The final standings are
+    ordered with the same tie-breaks as playerStandings(tiebreaks=True).
+
+    Returns:
+      An int array giving each player's final place, 0 being first.
+    """
+    n = len(ratings)
+    ids = numpy.arange(n)
+    wins = numpy.zeros(n, dtype=numpy.int64)
+    history = swiss.MatchHistory()
+    player1, player2, winner = [], [], []
+    played1 = played2 = numpy.zeros(0, dtype=numpy.int64)
+
+    for round in range(rounds):
+        order = roundOrder(ratings, wins, played1, played2)
+        pairs = swiss.pairRound(list(zip(order.tolist(),
+                                         wins[order].tolist())), history)
+        for a, b in pairs:
+            history.add(a, b)
+
+        played = numpy.array([(a, b) for a, b in pairs if b is not None],
+                             dtype=numpy.int64).reshape(-1, 2)
+        first, second = played[:, 0], played[:, 1]
+        played1 = numpy.concatenate((played1, first))
+        played2 = numpy.concatenate((played2, second))
+        first_won = rng.random_sample(len(played)) < winProbability(
+            ratings[first], ratings[second])
+        round_winners = numpy.where(first_won, first, second)
+        byes = [a for a, b in pairs if b is None]
+        wins += numpy.bincount(round_winners, minlength=n)
+        wins += numpy.bincount(byes, minlength=n) if byes else 0
+
+        player1.extend(first.tolist() + byes)
+        player2.extend(second.tolist() + [None] * len(byes))
+        winner.extend(round_winners.tolist() + byes)
+
+    matches = numpy.full(n, rounds, dtype=numpy.int64)
+    scores = tiebreak.tieBreaks(ids, wins, matches, player1, player2, winner)
+    places = numpy.empty(n, dtype=numpy.int64)
+    places[tiebreak.rankOrder(ids, wins, *scores)] = ids
+    return places
+
+
+def simulateBatch(args):
+    """Plays a batch of tournaments (runs in a worker process).
+
+    Args:
+      args: a (ratings, rounds, count, seed, batch) tuple; the batch's
+        random numbers are seeded from (seed, batch).
+
+    Returns:
+      A (count, number of players) array of final places.
+    """
+    ratings, rounds, count, seed, batch = args
+    rng = numpy.random.RandomState([seed, batch])
+    places = numpy.empty((count, len(ratings)), dtype=numpy.int64)
+    for i in range(count):
+        places[i] = playTournament(ratings, rounds, rng)
+    return places
+
+
+def simulate(ratings, tournaments, rounds=None, top=8, workers=None, seed=0,
+             batch_size=100):
+    """Simulates many tournaments and summarizes each player's results.
+
+    Args:
+      ratings: the players' ratings.
+      tournaments: the number of tournaments to play.
+      rounds: the number of rounds per tournament (default ceil(log2 n)).
+      top: the number of places counted as a top finish.
+      workers: the number of worker processes; 1 runs in this process,
+        None uses one per CPU.
+      seed: the base random seed.
+      batch_size: the number of tournaments per batch.
+
+    Returns:
+      A (top_probability, mean_place, elapsed) tuple: the probability of
+      each player finishing in the top places, each player's average final
+      place (1 being first) and the elapsed time in seconds.
+    """
+    ratings = numpy.asarray(ratings, dtype=numpy.float64)
+    if rounds is None:
+        rounds = defaultRounds(len(ratings))
+    batches = [(ratings, rounds, min(batch_size, tournaments - start), seed,
+                batch)
+               for batch, start in enumerate(range(0, tournaments, batch_size))]
+
+    start = time.time()
+    if workers == 1:
+        results = [simulateBatch(args) for args in batches]
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(simulateBatch, batches)
+        finally:
+            pool.close()
+            pool.join()
+    places = numpy.concatenate(results)
+    elapsed = time.time() - start
+
+    top_probability = (places < top).mean(axis=0)
+    mean_place = places.mean(axis=0) + 1
+    return top_probability, mean_place, elapsed
+
+
+def readRatings(path):
+    """Returns the (names, ratings) read from a "name,rating" CSV file."""
+    names, ratings = [], []
+    with open(path) as ratings_file:
+        for row in csv.reader(ratings_file):
+            if row:
+                names.append(row[0])
+                ratings.append(float(row[1]))
+    return names, ratings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Simulate Swiss tournaments and report each player's "
+                    "chance of a top finish.")
+    parser.add_argument("--ratings",
+                        help="CSV file of name,rating lines (default: "
+                             "random ratings for --players players)")
+    parser.add_argument("--players", type=int, default=64,
+                        help="number of random players without --ratings")
+    parser.add_argument("--tournaments", type=int, default=10000,
+                        help="number of tournaments to simulate")
+    parser.add_argument("--rounds", type=int,
+                        help="rounds per tournament (default: ceil(log2 n))")
+    parser.add_argument("--top", type=int, default=8,
+                        help="places counted as a top finish")
+    parser.add_argument("--workers", type=int,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--show", type=int, default=20,
+                        help="number of players to list")
+    args = parser.parse_args()
+
+    if args.ratings:
+        names, ratings = readRatings(args.ratings)
+    else:
+        rng = numpy.random.RandomState(args.seed)
+        ratings = numpy.sort(rng.normal(1500, 200, args.players))[::-1]
+        names = ["Player %d" % (i + 1) for i in range(args.players)]
+
+    top_probability, mean_place, elapsed = simulate(
+        ratings, args.tournaments, args.rounds, args.top, args.workers,
+        args.seed)
+
+    print("%-30s %8s %8s %10s" % ("player", "rating", "top %d" % args.top,
+                                  "avg place"))
+    for i in numpy.argsort(-top_probability, kind='mergesort')[:args.show]:
+        print("%-30s %8.0f %7.1f%% %10.2f" % (names[i], ratings[i],
+                                              100 * top_probability[i],
+                                              mean_place[i]))
+    print("%d tournaments in %.2fs: %.0f tournaments/second"
+          % (args.tournaments, elapsed, args.tournaments / elapsed))
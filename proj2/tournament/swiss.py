@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+#
+# swiss.py -- Swiss-system pairing engine used by tournament.py
+#
+
+from collections import defaultdict
+from itertools import chain, groupby
+
+try:
+    range = xrange
+except NameError:
+    pass
+
+# How many more candidates to try for a color-compatible opponent once a
+# clashing but otherwise valid one has been found
+COLOR_SEARCH_WINDOW = 8
+
+# How many pairs to try when searching the whole field for a round without
+# rematches, once pairing by score groups has had to allow one
+BACKTRACK_LIMIT = 10000
+
+
+class MatchHistory(object):
+    """Who has played whom in a tournament, built once per round.
+
+    Player 1 of a match is taken to have had the first move (white), so the
+    history also tracks each player's color balance.  A match with no
+    player 2 is a bye.
+    """
+
+    def __init__(self, matches=()):
+        """Build the history from an iterable of (player1, player2) tuples."""
+        self.opponents = defaultdict(set)
+        self.balance = defaultdict(int)
+        self.last_color = {}
+        self.byes = set()
+        for player1, player2 in matches:
+            self.add(player1, player2)
+
+    def add(self, player1, player2):
+        """Record one match, player1 playing white."""
+        if player2 is None:
+            self.byes.add(player1)
+            return
+        self.opponents[player1].add(player2)
+        self.opponents[player2].add(player1)
+        self.balance[player1] += 1
+        self.balance[player2] -= 1
+        self.last_color[player1] = 1
+        self.last_color[player2] = -1
+
+    def played(self, player1, player2):
+        """Returns True if the two players have already met."""
+        return player2 in self.opponents.get(player1, ())
+
+    def colorClash(self, player1, player2):
+        """Returns True if both players are due the same color."""
+        b1, b2 = self.balance.get(player1, 0), self.balance.get(player2, 0)
+        return (b1 >= 2 and b2 >= 2) or (b1 <= -2 and b2 <= -2)
+
+    def colors(self, player1, player2):
+        """Returns (white, black) for a pair, player1 being the higher ranked.
+
+        White goes to the player with more blacks so far, then to the player
+        who had black last, then to the higher ranked player.
+        """
+        key1 = (self.balance.get(player1, 0), self.last_color.get(player1, 0))
+        key2 = (self.balance.get(player2, 0), self.last_color.get(player2, 0))
+        if key2 < key1:
+            return player2, player1
+        return player1, player2
+
+
+def chooseBye(ranking, history):
+    """Returns the player to get the bye in an odd-sized round.
+
+    The lowest ranked player who has not yet had a bye is chosen, or the
+    lowest ranked player if everyone has had one.
+    """
+    for player, score in reversed(ranking):
+        if player not in history.byes:
+            return player
+    return ranking[-1][0]
+
+
+def _pairGroup(group, history):
+    """Pairs the players of one score group as far as possible.
+
+    The group (players floated down from above first, then the group in rank
+    order) is split into a top and a bottom half and each player of the top
+    half is offered the opponent in the same position in the bottom half,
+    moving on to the next player who is neither a rematch nor a color clash.
+    A color clash is accepted if no compatible opponent turns up within
+    COLOR_SEARCH_WINDOW candidates.  Returns (pairs, unpaired players).
+    """
+    size = len(group)
+    half = size // 2
+    paired = [False] * size
+    pairs = []
+    for i in range(size):
+        if paired[i]:
+            continue
+        fallback = None
+        window = COLOR_SEARCH_WINDOW
+        start = min(max(i + half, i + 1), size)
+        for j in chain(range(start, size), range(i + 1, start)):
+            if paired[j] or history.played(group[i], group[j]):
+                continue
+            if not history.colorClash(group[i], group[j]):
+                break
+            if fallback is None:
+                fallback = j
+            window -= 1
+            if not window:
+                j = fallback
+                break
+        else:
+            j = fallback
+        if j is not None:
+            paired[i] = paired[j] = True
+            pairs.append((group[i], group[j]))
+    return pairs, [p for p, done in zip(group, paired) if not done]
+
+
+def _repair(pairs, leftovers, history):
+    """Pairs the players left over at the bottom of the standings.
+
+    A leftover player who cannot meet another leftover without a rematch is
+    swapped into one of the lowest existing pairs instead.  If no swap works
+    the rematch is allowed, so every player is always paired.
+    """
+    while len(leftovers) > 1:
+        a = leftovers.pop(0)
+        for k, b in enumerate(leftovers):
+            if not history.played(a, b):
+                pairs.append((a, leftovers.pop(k)))
+                break
+        else:
+            for n in range(len(pairs) - 1, -1, -1):
+                c, d = pairs[n]
+                swap = None
+                for k, b in enumerate(leftovers):
+                    if not (history.played(a, c) or history.played(b, d)):
+                        swap = (a, c), (b, d)
+                    elif not (history.played(a, d) or history.played(b, c)):
+                        swap = (a, d), (b, c)
+                    if swap:
+                        leftovers.pop(k)
+                        break
+                if swap:
+                    pairs[n] = swap[0]
+                    pairs.append(swap[1])
+                    break
+            else:
+                pairs.append((a, leftovers.pop(0)))
+
+
+def _backtrack(players, history):
+    """Pairs players in rank order without any rematch, if it can.
+
+    Each unpaired player, highest ranked first, meets the next highest
+    ranked player they have not met; when the players left cannot all be
+    paired, the search backtracks to the previous pair.  Returns the pairs,
+    or None if BACKTRACK_LIMIT pairs have been tried or every pairing has a
+    rematch.
+    """
+    size = len(players)
+    paired = [False] * size
+    stack = []
+    i, j = 0, None
+    tries = BACKTRACK_LIMIT
+    while True:
+        while i < size and paired[i]:
+            i += 1
+        if i == size:
+            return [(players[a], players[b]) for a, b in stack]
+        if j is None:
+            j = i + 1
+        while j < size and (paired[j] or
+                            history.played(players[i], players[j])):
+            j += 1
+        if j < size:
+            tries -= 1
+            if not tries:
+                return None
+            paired[i] = paired[j] = True
+            stack.append((i, j))
+            i, j = i + 1, None
+        elif stack:
+            i, j = stack.pop()
+            paired[i] = paired[j] = False
+            j += 1
+        else:
+            return None
+
+
+def pairRound(ranking, history):
+    """Pairs the players for the next round of a Swiss-system tournament.
+
+    Players are paired within score groups, top group first.  Players who
+    cannot be paired within their group without a rematch float down to the
+    next group.  If that still leaves a rematch, the whole field is paired
+    again by backtracking (see _backtrack()), and the rematch is only kept
+    when no pairing without one is found.  In an odd-sized field the bye
+    goes to the lowest ranked player who has not had one.
+
+    Args:
+      ranking: a list of (id, score) tuples in standings order.
+      history: the tournament's MatchHistory.
+
+    Returns:
+      A list of (white, black) player id tuples, highest score group first.
+      The player with the bye is returned as (id, None).
+    """
+    bye = None
+    if len(ranking) % 2:
+        bye = chooseBye(ranking, history)
+
+    pairs = []
+    floaters = []
+    for score, members in groupby(ranking, key=lambda entry: entry[1]):
+        group = floaters + [player for player, s in members if player != bye]
+        group_pairs, floaters = _pairGroup(group, history)
+        pairs.extend(group_pairs)
+    _repair(pairs, floaters, history)
+    if any(history.played(a, b) for a, b in pairs):
+        pairs = _backtrack([player for player, score in ranking
+                            if player != bye], history) or pairs
+
+    pairs = [history.colors(a, b) for a, b in pairs]
+    if bye is not None:
+        pairs.append((bye, None))
+    return pairs
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+# tiebreak.py -- vectorized Swiss-system tie-break scores
+#
+
+import numpy
+
+# Floor applied to each opponent's match-win percentage in OMW%
+OMW_FLOOR = 1.0 / 3
+
+# OMW% is rounded so that equal percentages summed in a different order
+# still compare equal when ranking
+OMW_DECIMALS = 6
+
+
+def tieBreaks(player_ids, wins, matches, player1, player2, winner):
+    """Computes the tie-break scores of every player in a tournament at once.
+
+    Byes (matches without a player 2) count towards a player's own score but
+    add nothing to the opponent based scores.
+
+    Args:
+      player_ids: the ids of the players, in any order.
+      wins: the number of wins of each player in player_ids.
+      matches: the number of matches played by each player in player_ids.
+      player1, player2, winner: the tournament's matches as three sequences
+        of player ids, player2 being None for a bye.
+
+    Returns:
+      A (buchholz, sonneborn_berger, omw) tuple of float arrays aligned with
+      player_ids:
+        buchholz: the sum of the opponents' wins
+        sonneborn_berger: the sum of the wins of the opponents beaten
+        omw: the opponents' average match-win percentage, each opponent's
+          percentage being at least OMW_FLOOR, rounded to OMW_DECIMALS
+    """
+    player_ids = numpy.asarray(player_ids, dtype=numpy.int64)
+    wins = numpy.asarray(wins, dtype=numpy.float64)
+    matches = numpy.asarray(matches, dtype=numpy.float64)
+    n = len(player_ids)
+
+    p1 = numpy.asarray(player1, dtype=numpy.float64)
+    p2 = numpy.asarray(player2, dtype=numpy.float64)
+    won = numpy.asarray(winner, dtype=numpy.float64)
+    played = ~numpy.isnan(p2)
+    p1, p2, won = p1[played], p2[played], won[played]
+
+    # Translate player ids into positions in player_ids
+    order = numpy.argsort(player_ids)
+    sorted_ids = player_ids[order]
+    i1 = order[numpy.searchsorted(sorted_ids, p1.astype(numpy.int64))]
+    i2 = order[numpy.searchsorted(sorted_ids, p2.astype(numpy.int64))]
+    first_won = won == p1
+    iw = numpy.where(first_won, i1, i2)
+    il = numpy.where(first_won, i2, i1)
+
+    buchholz = opponentWins(wins, i1, i2)
+    sonneborn_berger = numpy.bincount(iw, weights=wins[il], minlength=n)
+
+    win_pct = numpy.maximum(wins / numpy.maximum(matches, 1), OMW_FLOOR)
+    opponents = (numpy.bincount(i1, minlength=n) +
+                 numpy.bincount(i2, minlength=n))
+    omw_sum = (numpy.bincount(i1, weights=win_pct[i2], minlength=n) +
+               numpy.bincount(i2, weights=win_pct[i1], minlength=n))
+    omw = numpy.round(omw_sum / numpy.maximum(opponents, 1), OMW_DECIMALS)
+
+    return buchholz, sonneborn_berger, omw
+
+
+def opponentWins(wins, first, second):
+    """Returns the Buchholz score of every player: their opponents' wins.
+
+    Args:
+      wins: the number of wins of each player, indexed by position.
+      first, second: int arrays of the positions of the two players of
+        each match played, byes excluded.
+    """
+    wins = numpy.asarray(wins, dtype=numpy.float64)
+    return (numpy.bincount(first, weights=wins[second], minlength=len(wins)) +
+            numpy.bincount(second, weights=wins[first], minlength=len(wins)))
+
+
+def rankOrder(player_ids, wins, buchholz, sonneborn_berger, omw):
+    """Returns the positions of the players sorted into standings order.
+
+    Players are ranked by wins, then Buchholz, Sonneborn-Berger and OMW%,
+    all descending, and finally by id.
+    """
+    return numpy.lexsort((numpy.asarray(player_ids),
+                          -numpy.asarray(omw),
+                          -numpy.asarray(sonneborn_berger),
+                          -numpy.asarray(buchholz),
+                          -numpy.asarray(wins)))
@@ -3,51 +3,287 @@
 # tournament.py -- implementation of a Swiss-system tournament
 #
 
-import psycopg2
+import collections
+import csv
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import numpy
+
+import bracket
+import rating
+import swiss
+import tiebreak
+
+# Connection pool settings
+DSN = "dbname=tournament"
+POOL_MIN_CONN = 1
+POOL_MAX_CONN = 8
+
+# Cursor class of the cursors connect() yields (None for the psycopg2
+# default); read at each checkout, so it can be changed at any time
+CURSOR_FACTORY = None
+
+# Number of names sent per COPY by registerPlayers()
+REGISTER_BATCH_SIZE = 10000
+
+# Rounds with at least this many matches refresh the planner statistics of
+# Match and Standing first: a new tournament's rows are missing from stale
+# statistics, which turns the round's joins into nested loops
+ANALYZE_ROUND_SIZE = 1000
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# psycopg2 is imported when the pool is first opened, so that
+# tournament_sqlite and tournament_memory can reuse the SQL and helpers of
+# this module without it
+_psycopg2 = None
+
+
+class _Pool(object):
+    """The connection pool, with the bookkeeping of connect() and closePool().
+
+    getconn(), putconn() and closeall() are the ones of the psycopg2
+    ThreadedConnectionPool it wraps.
+
+    Attributes:
+      slots: a semaphore of maxconn permits, one per checked-out connection
+      users: the number of connect() calls using the pool, waiting or not
+      retired: whether closePool() has been called; the pool is closed when
+        its last user is done
+    """
+
+    def __init__(self, minconn, maxconn, dsn):
+        self.connections = _psycopg2.pool.ThreadedConnectionPool(
+            minconn, maxconn, dsn)
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.users = 0
+        self.retired = False
+
+    def getconn(self):
+        return self.connections.getconn()
+
+    def putconn(self, db, close=False):
+        self.connections.putconn(db, close=close)
+
+    def closeall(self):
+        self.connections.closeall()
+
 
 ##
+def getPool():
+    """Returns the module connection pool, opening it on first use."""
+    with _pool_lock:
+        return _openPool()
+
+
+def _openPool():
+    """getPool() for callers holding _pool_lock."""
+    global _pool, _psycopg2
+    if _pool is None:
+        import psycopg2.extensions
+        import psycopg2.pool
+        _psycopg2 = psycopg2
+        _pool = _Pool(POOL_MIN_CONN, POOL_MAX_CONN, DSN)
+    return _pool
+
+
+def closePool():
+    """Close every pooled connection.
+
+    Connections checked out by calls still running are closed when they are
+    returned, so those calls finish normally.  The next call to connect()
+    opens a fresh pool, so this can also be used to pick up a changed DSN or
+    pool size.
+    """
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+        if pool is None:
+            return
+        pool.retired = True
+        idle = not pool.users
+    if idle:
+        pool.closeall()
+
+
+def _release(pool):
+    """Ends a connect() call's use of pool, closing it if it was the last."""
+    with _pool_lock:
+        pool.users -= 1
+        idle = pool.retired and not pool.users
+    if idle:
+        pool.closeall()
+
+
+def _isHealthy(db):
+    """Returns True if a pooled connection can safely be handed out."""
+    if db.closed:
+        return False
+    status = db.get_transaction_status()
+    if status == _psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if status != _psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        db.rollback()
+    return True
+
+
+@contextmanager
 def connect():
-    """Connect to the PostgreSQL database.  Returns a database connection."""
-    db = psycopg2.connect("dbname=tournament")
-    cursor = db.cursor()
-    return db, cursor
+    """Check out a connection from the PostgreSQL connection pool.
+
+    Yields a (db, cursor) pair.  The transaction is committed when the block
+    exits normally and rolled back if it raises; either way the connection
+    goes back to the pool.  At most POOL_MAX_CONN connections are checked out
+    at once, further callers wait for one to be returned.  A call keeps the
+    pool it started with, even if closePool() is called meanwhile.
+    """
+    with _pool_lock:
+        pool = _openPool()
+        pool.users += 1
+    try:
+        pool.slots.acquire()
+        try:
+            db = pool.getconn()
+            while not _isHealthy(db):
+                pool.putconn(db, close=True)
+                db = pool.getconn()
+
+            broken = False
+            cursor = db.cursor(cursor_factory=CURSOR_FACTORY)
+            try:
+                yield db, cursor
+                db.commit()
+            except (_psycopg2.OperationalError, _psycopg2.InterfaceError):
+                # The connection must not be reused
+                broken = True
+                raise
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                if not db.closed:
+                    cursor.close()
+                pool.putconn(db, close=broken or db.closed)
+        finally:
+            pool.slots.release()
+    finally:
+        _release(pool)
+
+
+# Removes every match and what is derived from them; the event log only
+# records the deletion
+_DELETE_MATCHES_SQL = """
+TRUNCATE Match, Standing, Rating, PlayerTotal, Snapshot, SnapshotStanding;
+
+INSERT INTO Event (kind) VALUES ('delete');
+"""
 
 
 def deleteMatches():
-    """Remove all the matches from the database."""
-    db, cursor = connect()
-    cursor.execute("TRUNCATE Match")
-    db.commit()
+    """Remove all the matches from the database.
+
+    The event log keeps them, see tournamentEvents().
+    """
+    with connect() as (db, cursor):
+        cursor.execute(_DELETE_MATCHES_SQL)
+    invalidatePairings()
+
+# Takes a tournament's matches out of the players' lifetime records
+_DELETE_TOUR_TOTALS_SQL = """
+UPDATE PlayerTotal AS t
+   SET wins = t.wins - r.wins, matches = t.matches - r.matches
+  FROM (SELECT player, wins, matches FROM PlayerRecord
+         WHERE tournament = %s ORDER BY player) r
+ WHERE t.player = r.player
+"""
+
+# Removes a tournament's matches, standings and snapshots and logs it
+_DELETE_TOUR_MATCHES_SQL = """
+DELETE FROM Standing WHERE tournament = %(tournament)s;
+
+DELETE FROM Match WHERE tournament = %(tournament)s;
+
+DELETE FROM Snapshot WHERE tournament = %(tournament)s;
+
+INSERT INTO Event (kind, tournament) VALUES ('delete', %(tournament)s);
+"""
+
 
 def deleteTourMatches(tournament):
-    """Remove all the match records in a tournament from the database."""
-    db, cursor = connect()
-    cursor.execute("DELETE FROM Match WHERE tournament = %s", (tournament,))
-    db.commit()
+    """Remove all the match records in a tournament from the database.
+
+    The players' lifetime records (see leaderboard()) lose the tournament's
+    matches too; ratings are kept until recomputeRatings().  The event log
+    keeps the matches, see tournamentEvents().
+    """
+    with connect() as (db, cursor):
+        cursor.execute(_DELETE_TOUR_TOTALS_SQL, (tournament,))
+        cursor.execute(_DELETE_TOUR_MATCHES_SQL, {'tournament': tournament})
+    invalidatePairings(tournament)
+
+
+# Removes every player, and with them every entry, standing and rating.
+# Matches reference players, so there can be none left: the deletion is
+# logged like deleteMatches(), which also gives every tournament a new
+# pairings version (see swissPairings()).
+_DELETE_PLAYERS_SQL = """
+DELETE FROM Player;
+
+INSERT INTO Event (kind) VALUES ('delete');
+"""
+
+# Removes every tournament and its entrants, logged as for players
+_DELETE_TOURNAMENTS_SQL = """
+DELETE FROM Tournament;
+
+INSERT INTO Event (kind) VALUES ('delete');
+"""
 
 
 def deletePlayers():
     """Remove all the player records from the database."""
-    db, cursor = connect()
-    cursor.execute("DELETE FROM Player")
-    db.commit()
+    with connect() as (db, cursor):
+        cursor.execute(_DELETE_PLAYERS_SQL)
+    invalidatePairings()
 
 
 def deleteTournaments():
-    """Remove all the player records from the database."""
-    db, cursor = connect()
-    cursor.execute("DELETE FROM Tournament")
-    db.commit()
+    """Remove all the tournament records from the database."""
+    with connect() as (db, cursor):
+        cursor.execute(_DELETE_TOURNAMENTS_SQL)
+    invalidatePairings()
 
 
 def countPlayers():
     """Returns the number of players currently registered."""
-    db, cursor = connect()
-    cursor.execute("SELECT COUNT(*) FROM Player")
-    return cursor.fetchall()[0][0]
+    with connect() as (db, cursor):
+        cursor.execute("SELECT COUNT(*) FROM Player")
+        return cursor.fetchall()[0][0]
+
 
+# Adds a player and logs the registration
+_REGISTER_PLAYER_SQL = """
+WITH p AS (INSERT INTO Player (full_name) VALUES (%s) RETURNING id)
+INSERT INTO Event (kind, player1) SELECT 'register', id FROM p
+RETURNING player1
+"""
 
-def registerPlayer(name):
+# Logs the registration of players added with COPY
+_LOG_REGISTER_SQL = """
+INSERT INTO Event (kind, player1) SELECT 'register', unnest(%s::integer[])
+"""
+
+
+def registerPlayer(name, tournament=None):
     """Adds a player to the tournament database.
 
     The database assigns a unique serial id number for the player.  (This
@@ -55,10 +291,92 @@ def registerPlayer(name):
 
     Args:
       name: the player's full name (need not be unique).
+      tournament: if given, also enter the player in this tournament
+
+    Returns:
+      The id assigned to the player.
     """
-    db, cursor = connect()
-    cursor.execute("insert into Player (full_name) values (%s)", (name,))
-    db.commit()
+    with connect() as (db, cursor):
+        cursor.execute(_REGISTER_PLAYER_SQL, (name,))
+        player = cursor.fetchone()[0]
+        if tournament is not None:
+            _enter(cursor, tournament, [player])
+        return player
+
+
+def registerPlayers(names, tournament=None):
+    """Adds many players to the tournament database in one transaction.
+
+    Names are read from the iterable in batches of REGISTER_BATCH_SIZE, so a
+    generator or an open file (one name per line) can be passed without
+    loading the whole list into memory.  Each batch reserves its ids from the
+    Player sequence and is streamed into the table with COPY.
+
+    Args:
+      names: an iterable of the players' full names.
+      tournament: if given, also enter the players in this tournament
+
+    Returns:
+      A list of the ids assigned to the players, in input order.
+    """
+    with connect() as (db, cursor):
+        return _registerPlayers(cursor, names, tournament)
+
+
+def _registerPlayers(cursor, names, tournament):
+    ids = []
+    names = iter(names)
+    while True:
+        batch = [name.rstrip('\r\n')
+                 for name in itertools.islice(names, REGISTER_BATCH_SIZE)]
+        if not batch:
+            break
+        cursor.execute("SELECT nextval(pg_get_serial_sequence('player', 'id')) "
+                       "FROM generate_series(1, %s)", (len(batch),))
+        batch_ids = sorted(row[0] for row in cursor.fetchall())
+
+        rows = StringIO()
+        csv.writer(rows).writerows(zip(batch_ids, batch))
+        rows.seek(0)
+        cursor.copy_expert("COPY Player (id, full_name) FROM STDIN "
+                           "WITH (FORMAT csv)", rows)
+        cursor.execute(_LOG_REGISTER_SQL, (batch_ids,))
+        if tournament is not None:
+            _enter(cursor, tournament, batch_ids)
+        ids.extend(batch_ids)
+    return ids
+
+
+# Enters players in a tournament, logging the ones not entered yet
+_ENTER_SQL = """
+WITH entered AS (
+  INSERT INTO TournamentPlayer (tournament, player)
+  SELECT %s, unnest(%s::integer[])
+  ON CONFLICT DO NOTHING
+  RETURNING tournament, player)
+INSERT INTO Event (kind, tournament, player1)
+SELECT 'enter', tournament, player FROM entered ORDER BY player
+"""
+
+
+def _enter(cursor, tournament, players):
+    cursor.execute(_ENTER_SQL, (tournament, list(players)))
+
+
+def enterTournament(tournament, players):
+    """Enters registered players in a tournament.
+
+    A tournament with entrants only ranks and pairs its entrants; a
+    tournament nobody has entered is open to every registered player.
+
+    Args:
+      tournament: the id number of the tournament
+      players: an iterable of player ids; players already entered are
+        ignored
+    """
+    with connect() as (db, cursor):
+        _enter(cursor, tournament, players)
+    invalidatePairings(tournament)
 
 
 def registerTournament(description):
@@ -70,21 +388,46 @@ def registerTournament(description):
     Args:
       description: the tournament description
     """
-    db, cursor = connect()
-    query = "insert into Tournament (description) values (%s)"
+    with connect() as (db, cursor):
+        return _registerTournament(cursor, description)
+
+
+def _registerTournament(cursor, description):
+    query = "insert into Tournament (description) values (%s) RETURNING id"
     param = (description,)
     cursor.execute(query, param)
-    db.commit()
-
-    cursor.execute("SELECT MAX(id) FROM Tournament")
     return cursor.fetchall()[0][0]
 
 
-def playerStandings(tournament):
+# Standings of the tournament's entrants, or of every registered player when
+# nobody has entered the tournament, from the playerStandings() database
+# function (inlined into this query by the planner)
+_STANDINGS_SQL = """
+SELECT id, full_name, wins, matches, opponent_wins
+  FROM playerStandings(%(tournament)s)
+"""
+
+# Adjacent pairing of the next round by the swissPairings() database function
+_SERVER_PAIRINGS_SQL = "SELECT id1, name1, id2, name2 FROM swissPairings(%s)"
+
+# A tournament's matches in the order they were played
+_MATCHES_SQL = """
+SELECT player1, player2, winner FROM Match
+ WHERE tournament = %s ORDER BY round, id
+"""
+
+
+def playerStandings(tournament, tiebreaks=False):
     """Returns a list of the players and their win records, sorted by wins.
 
     The first entry in the list should be the player in first place, or a player
-    tied for first place if there is currently a tie.
+    tied for first place if there is currently a tie.  Players with equal wins
+    are ordered by the sum of their opponents' wins (Buchholz).
+
+    Args:
+      tournament: the id number of the tournament
+      tiebreaks: also compute and return the tie-break scores, and use all
+        of them to order players with equal wins
 
     Returns:
       A list of tuples, each of which contains (id, name, wins, matches):
@@ -92,67 +435,1285 @@ def playerStandings(tournament):
         name: the player's full name (as registered)
         wins: the number of matches the player has won
         matches: the number of matches the player has played
+      With tiebreaks, each tuple also contains (buchholz, sonneborn_berger,
+      omw), see tiebreak.tieBreaks().
+    """
+    with connect() as (db, cursor):
+        cursor.execute(_STANDINGS_SQL, {'tournament': tournament})
+        standings = cursor.fetchall()
+        if not tiebreaks:
+            return [row[:4] for row in standings]
+        cursor.execute(_MATCHES_SQL, (tournament,))
+        history = cursor.fetchall()
+    return _rankWithTieBreaks(standings, history)
+
+
+def _rankWithTieBreaks(standings, history):
+    """Adds the tie-break scores to _STANDINGS_SQL rows and reorders them.
+
+    history holds the tournament's _MATCHES_SQL rows.
+    """
+    ids, names, wins, matches, opponent_wins = \
+        zip(*standings) or ((), (), (), (), ())
+    player1, player2, winner = zip(*history) or ((), (), ())
+    scores = tiebreak.tieBreaks(ids, wins, matches, player1, player2, winner)
+    order = tiebreak.rankOrder(ids, wins, *scores)
+    buchholz, sonneborn_berger, omw = [score.tolist() for score in scores]
+    return [standings[i][:4] + (buchholz[i], sonneborn_berger[i], omw[i])
+            for i in order]
+
+
+# Number of rows standingsPage() returns by default
+STANDINGS_PAGE_SIZE = 100
+
+# The ranking key (wins, opponent_wins) of a player who has played in a
+# tournament
+_STANDING_KEY_SQL = """
+SELECT wins, opponent_wins FROM Standing
+ WHERE tournament = %(tournament)s AND player = %(after)s
+"""
+
+# The next players who have played, in playerStandings() order, read
+# backwards along standingRankIdx from the ranking key of the player the
+# page starts after (from the top without one).  A tournament with entrants
+# skips the players who did not enter it, looking each row up rather than
+# reading every entrant.
+_STANDINGS_PAGE_SQL = """
+SELECT p.id, p.full_name, s.wins, s.matches
+  FROM Standing s
+  JOIN Player p ON p.id = s.player
+  LEFT JOIN TournamentPlayer tp
+    ON tp.tournament = s.tournament AND tp.player = s.player
+ WHERE s.tournament = %(tournament)s
+   AND (%(after)s IS NULL OR
+        (s.wins, s.opponent_wins, -s.player) <
+        (%(wins)s, %(opponent_wins)s, -CAST(%(after)s AS INTEGER)))
+   AND (tp.player IS NOT NULL OR
+        NOT EXISTS (SELECT 1 FROM TournamentPlayer
+                     WHERE tournament = %(tournament)s))
+ ORDER BY s.wins DESC, s.opponent_wins DESC, -s.player DESC
+ LIMIT %(limit)s
+"""
+
+# The next players who have not played yet, by id: they rank below every
+# player who has, as anyone who played has a win or an opponent with one
+_UNPLAYED_PAGE_SQL = """
+SELECT p.id, p.full_name, 0, 0
+  FROM TournamentPlayer tp
+  JOIN Player p ON p.id = tp.player
+ WHERE tp.tournament = %(tournament)s
+   AND (%(after)s IS NULL OR tp.player > %(after)s)
+   AND NOT EXISTS (SELECT 1 FROM Standing s
+                    WHERE s.tournament = %(tournament)s
+                      AND s.player = tp.player)
+UNION ALL
+SELECT p.id, p.full_name, 0, 0
+  FROM Player p
+ WHERE NOT EXISTS (SELECT 1 FROM TournamentPlayer
+                    WHERE tournament = %(tournament)s)
+   AND (%(after)s IS NULL OR p.id > %(after)s)
+   AND NOT EXISTS (SELECT 1 FROM Standing s
+                    WHERE s.tournament = %(tournament)s AND s.player = p.id)
+ ORDER BY 1
+ LIMIT %(limit)s
+"""
+
+
+def standingsPage(tournament, after=None, limit=STANDINGS_PAGE_SIZE):
+    """Returns one page of a tournament's standings.
+
+    Pages are read with an index on the ranking (keyset pagination), so a
+    page costs the same whatever its position and the size of the field.
+    Only a page that reaches the players who have not played yet also scans
+    those players.
+
+    Args:
+      tournament: the id number of the tournament
+      after: the id of the last player of the previous page, or None for
+        the first page
+      limit: the most rows to return
+
+    Returns:
+      The rows of playerStandings() that follow the player after, at most
+      limit of them; fewer at the end of the standings.
     """
-    num_matches = {}
+    with connect() as (db, cursor):
+        return _standingsPage(cursor, tournament, after, limit)
+
+
+def topStandings(tournament, n):
+    """Returns the first n rows of playerStandings(), see standingsPage()."""
+    return standingsPage(tournament, limit=n)
+
 
-    db, cursor = connect()
-    sql = "SELECT p.id, p.full_name, COUNT(m.id) AS matches FROM player p LEFT JOIN match m ON p.id = player1 OR p.id = player2 "
-    sql += " LEFT JOIN tournament t ON m.tournament = t.id AND m.tournament = %s GROUP BY p.id"
-    cursor.execute(sql, (tournament,))
-    for row in cursor.fetchall():
-        num_matches[row[0]] = row[2]
+def _standingsPage(cursor, tournament, after, limit):
+    params = {'tournament': tournament, 'after': after, 'wins': None,
+              'opponent_wins': None, 'limit': limit}
+    key = None
+    if after is not None:
+        cursor.execute(_STANDING_KEY_SQL, params)
+        key = cursor.fetchone()
+    rows = []
+    if after is None or key is not None:
+        if key is not None:
+            params['wins'], params['opponent_wins'] = key
+        cursor.execute(_STANDINGS_PAGE_SQL, params)
+        rows = cursor.fetchall()
+        # Every player who has not played ranks below the ones who have
+        params['after'] = None
+    if len(rows) < limit:
+        params['limit'] = limit - len(rows)
+        cursor.execute(_UNPLAYED_PAGE_SQL, params)
+        rows.extend(cursor.fetchall())
+    return rows
 
-    sql = "SELECT p.id, p.full_name, COUNT(winner) AS wins FROM player p LEFT JOIN match m ON p.id = winner "
-    sql += " LEFT JOIN tournament t ON m.tournament = t.id AND m.tournament = %s GROUP BY p.id, winner ORDER BY wins DESC"
-    cursor.execute(sql, (tournament,))
-    standings = [(row[0], row[1], row[2], num_matches[row[0]]) for row in cursor]
-    return standings
+
+# Serializes the Standing updates of one tournament: concurrent reports
+# touch overlapping opponent rows in different orders and would deadlock.
+# The lock is keyed on (Standing's oid, tournament) and held until commit.
+_LOCK_STANDING_SQL = """
+SELECT pg_advisory_xact_lock('standing'::regclass::oid::integer,
+                             %(tournament)s);
+"""
+
+# Applies one match to Match, Standing and Rating.  Opponents of the winner
+# gain an opponent win before the match is added, then both players' rows
+# are bumped and each is credited with the other's (updated) win count.
+# Both players' Elo ratings move by the same amount in opposite directions,
+# each update reading the other player's rating from before the match, and
+# the match is added to both players' lifetime records in PlayerTotal.  A
+# bye has no player 2, only counts as a win for player 1 and is not rated.
+# The match is logged and the snapshots of its round and later are dropped.
+# Rating and PlayerTotal are shared by every tournament, so the advisory
+# lock does not cover them: their rows are created and locked in player
+# order, which keeps reports of different tournaments from deadlocking.
+_REPORT_MATCH_SQL = _LOCK_STANDING_SQL + """
+UPDATE Standing s SET opponent_wins = s.opponent_wins + pm.games
+  FROM (SELECT opponent, COUNT(*) AS games FROM PlayerMatch
+         WHERE tournament = %(tournament)s AND player = %(winner)s
+         GROUP BY opponent) pm
+ WHERE s.tournament = %(tournament)s AND s.player = pm.opponent;
+
+WITH m AS (
+  INSERT INTO Match (player1, player2, winner, round, tournament)
+  VALUES (%(player1)s, %(player2)s, %(winner)s, %(round)s, %(tournament)s)
+  RETURNING *)
+INSERT INTO Event (kind, tournament, round, match, player1, player2, winner)
+SELECT 'report', tournament, round, id, player1, player2, winner FROM m;
+
+DELETE FROM Snapshot
+ WHERE tournament = %(tournament)s AND round >= %(round)s;
+
+INSERT INTO Standing (tournament, player, wins, matches)
+SELECT %(tournament)s, player,
+       CASE WHEN player = %(winner)s THEN 1 ELSE 0 END, 1
+  FROM (VALUES (%(player1)s), (%(player2)s)) AS v(player)
+ WHERE player IS NOT NULL
+ON CONFLICT (tournament, player) DO UPDATE
+   SET wins = Standing.wins + EXCLUDED.wins,
+       matches = Standing.matches + 1;
+
+UPDATE Standing s SET opponent_wins = s.opponent_wins + o.wins
+  FROM Standing o
+ WHERE s.tournament = %(tournament)s AND o.tournament = %(tournament)s
+   AND ((s.player = %(player1)s AND o.player = %(player2)s)
+     OR (s.player = %(player2)s AND o.player = %(player1)s));
+
+INSERT INTO Rating (player, rating)
+SELECT player, %(initial_rating)s
+  FROM (VALUES (%(player1)s), (%(player2)s)) AS v(player)
+ WHERE %(player2)s IS NOT NULL
+ ORDER BY player
+ON CONFLICT (player) DO NOTHING;
+
+SELECT player FROM Rating
+ WHERE player IN (%(player1)s, %(player2)s) AND %(player2)s IS NOT NULL
+ ORDER BY player
+   FOR UPDATE;
+
+UPDATE Rating r
+   SET rating = r.rating + %(elo_k)s *
+                (CASE WHEN r.player = %(winner)s THEN 1 ELSE 0 END -
+                 1 / (1 + 10 ^ ((o.rating - r.rating) / 400))),
+       games = r.games + 1
+  FROM Rating o
+ WHERE (r.player = %(player1)s AND o.player = %(player2)s)
+    OR (r.player = %(player2)s AND o.player = %(player1)s);
+
+INSERT INTO PlayerTotal (player, wins, matches)
+SELECT player, CASE WHEN player = %(winner)s THEN 1 ELSE 0 END, 1
+  FROM (VALUES (%(player1)s), (%(player2)s)) AS v(player)
+ WHERE player IS NOT NULL
+ ORDER BY player
+ON CONFLICT (player) DO UPDATE
+   SET wins = PlayerTotal.wins + EXCLUDED.wins,
+       matches = PlayerTotal.matches + 1;
+"""
+
+
+def _matchParams(player1, player2, winner, round, tournament):
+    """Returns the _REPORT_MATCH_SQL params of a match."""
+    return {'player1': player1, 'player2': player2, 'winner': winner,
+            'round': round, 'tournament': tournament,
+            'elo_k': rating.ELO_K, 'initial_rating': rating.INITIAL_RATING}
 
 
 def reportMatch(player1, player2, winner, round, tournament):
     """Report a single match between two players.
 
+    The match and the updated standings of both players (and of the
+    winner's earlier opponents) are written in one transaction.  The round
+    is not checked against lastRound(), so matches of a round can be
+    reported one by one and late; use reportNextRound() to refuse a round
+    that has already been reported.
+
     Args:
       player1: the id number of the first player
-      player2: the id number of the second player
+      player2: the id number of the second player, or None for a bye
       winner:  the id number of the player who won
       round:   the id number of the tournament round
       tournament:  the id number of the tournament
     """
-    db, cursor = connect()
-    sql = "INSERT INTO Match (player1, player2, winner, round, tournament) VALUES (%s, %s, %s, %s, %s)"
-    cursor.execute(sql, (player1, player2, winner, round, tournament))
-    db.commit()
+    params = _matchParams(player1, player2, winner, round, tournament)
+    with connect() as (db, cursor):
+        cursor.execute(_REPORT_MATCH_SQL, params)
+    invalidatePairings(tournament)
+
+
+# Applies a whole round in one statement batch, the set-based version of
+# _REPORT_MATCH_SQL (including its lock order).  The round is passed as
+# parallel arrays with one entry per player: player, opponent, won (1 or 0)
+# and whether the player is the match's player1.
+_REPORT_ROUND_SQL = _LOCK_STANDING_SQL + """
+UPDATE Standing s SET opponent_wins = s.opponent_wins + pm.games
+  FROM (SELECT pm.opponent, COUNT(*) AS games
+          FROM PlayerMatch pm
+          JOIN unnest(%(winners)s::integer[]) AS w(player)
+            ON w.player = pm.player
+         WHERE pm.tournament = %(tournament)s
+         GROUP BY pm.opponent) pm
+ WHERE s.tournament = %(tournament)s AND s.player = pm.opponent;
+
+WITH m AS (
+  INSERT INTO Match (player1, player2, winner, round, tournament)
+  SELECT player, opponent,
+         CASE WHEN won = 1 THEN player ELSE opponent END,
+         %(round)s, %(tournament)s
+    FROM unnest(%(players)s::integer[], %(opponents)s::integer[],
+                %(won)s::integer[], %(first)s::boolean[])
+         AS r(player, opponent, won, first)
+   WHERE first
+  RETURNING *)
+INSERT INTO Event (kind, tournament, round, match, player1, player2, winner)
+SELECT 'report', tournament, round, id, player1, player2, winner
+  FROM m ORDER BY id;
+
+DELETE FROM Snapshot
+ WHERE tournament = %(tournament)s AND round >= %(round)s;
+
+INSERT INTO Standing (tournament, player, wins, matches)
+SELECT %(tournament)s, player, won, 1
+  FROM unnest(%(players)s::integer[], %(won)s::integer[]) AS r(player, won)
+ON CONFLICT (tournament, player) DO UPDATE
+   SET wins = Standing.wins + EXCLUDED.wins,
+       matches = Standing.matches + 1;
+
+UPDATE Standing s SET opponent_wins = s.opponent_wins + o.wins
+  FROM unnest(%(players)s::integer[], %(opponents)s::integer[])
+       AS r(player, opponent),
+       Standing o
+ WHERE s.tournament = %(tournament)s AND s.player = r.player
+   AND o.tournament = %(tournament)s AND o.player = r.opponent;
+
+INSERT INTO Rating (player, rating)
+SELECT player, %(initial_rating)s
+  FROM unnest(%(players)s::integer[], %(opponents)s::integer[])
+       AS r(player, opponent)
+ WHERE opponent IS NOT NULL
+ ORDER BY player
+ON CONFLICT (player) DO NOTHING;
+
+SELECT player FROM Rating
+ WHERE player = ANY(%(players)s::integer[])
+ ORDER BY player
+   FOR UPDATE;
+
+UPDATE Rating s
+   SET rating = s.rating + %(elo_k)s *
+                (r.won - 1 / (1 + 10 ^ ((o.rating - s.rating) / 400))),
+       games = s.games + 1
+  FROM unnest(%(players)s::integer[], %(opponents)s::integer[],
+              %(won)s::integer[]) AS r(player, opponent, won),
+       Rating o
+ WHERE s.player = r.player AND o.player = r.opponent;
+
+INSERT INTO PlayerTotal (player, wins, matches)
+SELECT player, won, 1
+  FROM unnest(%(players)s::integer[], %(won)s::integer[]) AS r(player, won)
+ ORDER BY player
+ON CONFLICT (player) DO UPDATE
+   SET wins = PlayerTotal.wins + EXCLUDED.wins,
+       matches = PlayerTotal.matches + 1;
+"""
+
+
+def reportRound(tournament, round, results):
+    """Report every match of a tournament round at once.
+
+    All matches and the resulting standings are written in one transaction
+    with a single batch of statements, so the number of database round trips
+    does not depend on the number of matches.  Unlike reportNextRound(), it
+    does not raise RoundConflict: the round may already have matches, or be
+    an earlier one.
+
+    Args:
+      tournament:  the id number of the tournament
+      round:   the id number of the tournament round
+      results: an iterable of (player1, player2, winner) tuples, player2
+        being None for a bye
+
+    Returns:
+      The elapsed wall-clock time of the round, in seconds.
+
+    Raises:
+      ValueError: a winner did not play in the match, or a player appears in
+        more than one match of the round.
+    """
+    start = time.time()
+    params = _roundParams(tournament, round, results)
+    with connect() as (db, cursor):
+        if len(params['winners']) >= ANALYZE_ROUND_SIZE:
+            cursor.execute("ANALYZE Match, Standing")
+        cursor.execute(_REPORT_ROUND_SQL, params)
+    invalidatePairings(tournament)
+    return time.time() - start
+
+
+def _roundParams(tournament, round, results):
+    """Validates a round's results and returns the _REPORT_ROUND_SQL params."""
+    seen = set()
+    players, opponents, won, first, winners = [], [], [], [], []
+    for player1, player2, winner in results:
+        if winner is None or winner not in (player1, player2):
+            raise ValueError("Winner %r did not play in match %r vs %r."
+                             % (winner, player1, player2))
+        for player, opponent in ((player1, player2), (player2, player1)):
+            if player is None:
+                continue
+            if player in seen:
+                raise ValueError("Player %r appears more than once in "
+                                 "round %r." % (player, round))
+            seen.add(player)
+            players.append(player)
+            opponents.append(opponent)
+            won.append(int(winner == player))
+            first.append(player == player1)
+        winners.append(winner)
+
+    return {'tournament': tournament, 'round': round, 'players': players,
+            'opponents': opponents, 'won': won, 'first': first,
+            'winners': winners, 'elo_k': rating.ELO_K,
+            'initial_rating': rating.INITIAL_RATING}
+
 
+# Replaces a tournament's standings with the ones recomputed from its matches
+_REBUILD_STANDINGS_SQL = _LOCK_STANDING_SQL + """
+DELETE FROM Standing WHERE tournament = %(tournament)s;
 
-def swissPairings(tournament):
+INSERT INTO Standing (tournament, player, wins, matches, opponent_wins)
+SELECT tournament, player, wins, matches, opponent_wins
+  FROM ComputedStanding WHERE tournament = %(tournament)s;
+"""
+
+# Players whose stored standing differs from the recomputed one
+_CHECK_STANDINGS_SQL = """
+SELECT COALESCE(s.player, c.player),
+       s.wins, s.matches, s.opponent_wins,
+       c.wins, c.matches, c.opponent_wins
+  FROM (SELECT * FROM Standing WHERE tournament = %(tournament)s) s
+  FULL JOIN (SELECT * FROM ComputedStanding
+              WHERE tournament = %(tournament)s) c
+    ON c.player = s.player
+ WHERE (s.wins, s.matches, s.opponent_wins)
+       IS DISTINCT FROM (c.wins, c.matches, c.opponent_wins)
+ ORDER BY 1
+"""
+
+
+def rebuildStandings(tournament):
+    """Recompute a tournament's standings from its match history.
+
+    Use this to repair the Standing table, e.g. after matches were edited
+    directly in the database.
+    """
+    with connect() as (db, cursor):
+        cursor.execute(_REBUILD_STANDINGS_SQL, {'tournament': tournament})
+
+
+def checkStandings(tournament):
+    """Compare a tournament's stored standings with its match history.
+
+    Returns:
+      A list of tuples for every player whose stored standing is wrong, each
+      of which contains (id, stored, expected):
+        id: the player's unique id
+        stored: the stored (wins, matches, opponent_wins), or None
+        expected: the (wins, matches, opponent_wins) recomputed from the
+          match history, or None
+      The list is empty when the standings are consistent.
+    """
+    with connect() as (db, cursor):
+        cursor.execute(_CHECK_STANDINGS_SQL, {'tournament': tournament})
+        return _standingErrors(cursor.fetchall())
+
+
+def _standingErrors(rows):
+    """Returns checkStandings() tuples for _CHECK_STANDINGS_SQL rows."""
+    def record(values):
+        if values[0] is None:
+            return None
+        return tuple(int(v) for v in values)
+
+    return [(row[0], record(row[1:4]), record(row[4:7])) for row in rows]
+
+
+# The match correctMatch() changes, locked against concurrent corrections
+_CORRECTED_MATCH_SQL = """
+SELECT tournament, round, player1, player2, winner FROM Match
+ WHERE id = %s FOR UPDATE
+"""
+
+# Moves a match's win from the old winner to the new one.  The opponents of
+# both players gain or lose an opponent win per game played against them,
+# the match and the lifetime records are updated, the correction is logged
+# and the snapshots it invalidates are dropped.
+_CORRECT_MATCH_SQL = _LOCK_STANDING_SQL + """
+UPDATE Standing s SET opponent_wins = s.opponent_wins + pm.games
+  FROM (SELECT opponent,
+               SUM(CASE WHEN player = %(winner)s THEN 1 ELSE -1 END) AS games
+          FROM PlayerMatch
+         WHERE tournament = %(tournament)s
+           AND player IN (%(winner)s, %(loser)s)
+         GROUP BY opponent) pm
+ WHERE s.tournament = %(tournament)s AND s.player = pm.opponent;
+
+UPDATE Standing
+   SET wins = wins + CASE WHEN player = %(winner)s THEN 1 ELSE -1 END
+ WHERE tournament = %(tournament)s AND player IN (%(winner)s, %(loser)s);
+
+UPDATE Match SET winner = %(winner)s WHERE id = %(match)s;
+
+UPDATE PlayerTotal
+   SET wins = wins + CASE WHEN player = %(winner)s THEN 1 ELSE -1 END
+ WHERE player IN (%(winner)s, %(loser)s);
+
+INSERT INTO Event (kind, tournament, round, match, player1, player2, winner)
+VALUES ('correct', %(tournament)s, %(round)s, %(match)s, %(player1)s,
+        %(player2)s, %(winner)s);
+
+DELETE FROM Snapshot
+ WHERE tournament = %(tournament)s AND round >= %(round)s;
+"""
+
+
+def correctMatch(match, winner):
+    """Changes the winner of a reported match.
+
+    The standings of both players and of their opponents are adjusted in
+    place, so a correction costs about as much as reporting the match.  The
+    correction is logged (see tournamentEvents()); ratings keep the old
+    result until recomputeRatings().
+
+    Args:
+      match: the id number of the match
+      winner: the id number of the player who won
+
+    Raises:
+      ValueError: there is no such match, or winner did not play in it.
+    """
+    with connect() as (db, cursor):
+        cursor.execute(_CORRECTED_MATCH_SQL, (match,))
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError("No match %r." % (match,))
+        tournament, round, player1, player2, old_winner = row
+        if winner == old_winner:
+            return
+        if winner is None or winner not in (player1, player2) or \
+                player2 is None:
+            raise ValueError("Winner %r did not play in match %r vs %r."
+                             % (winner, player1, player2))
+        cursor.execute(_CORRECT_MATCH_SQL, {
+            'match': match, 'tournament': tournament, 'round': round,
+            'player1': player1, 'player2': player2, 'winner': winner,
+            'loser': old_winner})
+    invalidatePairings(tournament)
+
+
+# Standings are snapshotted by standingsAt() after every round that is a
+# multiple of this
+SNAPSHOT_INTERVAL = 4
+
+# A tournament's log, with the deletions of every tournament's matches
+_EVENTS_SQL = """
+SELECT id, kind, round, match, player1, player2, winner, created FROM Event
+ WHERE tournament = %(tournament)s
+    OR (tournament IS NULL AND kind = 'delete')
+ ORDER BY id
+"""
+
+# The last event, and the last deletion of the tournament's matches up to
+# an event (the log of the matches starts after it)
+_EVENT_BOUNDS_SQL = """
+SELECT COALESCE(%(event)s, (SELECT MAX(id) FROM Event), 0),
+       COALESCE((SELECT MAX(id) FROM Event
+                  WHERE kind = 'delete'
+                    AND (tournament = %(tournament)s OR tournament IS NULL)
+                    AND id <= COALESCE(%(event)s, id)), 0)
+"""
+
+# The latest snapshot after the last deletion, up to a round and an event
+_SNAPSHOT_SQL = """
+SELECT round FROM Snapshot
+ WHERE tournament = %(tournament)s AND round <= %(round)s
+   AND event > %(start)s AND event <= %(until)s
+ ORDER BY round DESC
+ LIMIT 1
+"""
+
+_SNAPSHOT_STANDINGS_SQL = """
+SELECT player, wins, matches, opponent_wins, opponents FROM SnapshotStanding
+ WHERE tournament = %(tournament)s AND round = %(snapshot)s
+"""
+
+# The matches reported after a snapshot, and their corrections
+_TAIL_SQL = """
+SELECT kind, round, match, player1, player2, winner FROM Event
+ WHERE tournament = %(tournament)s
+   AND (%(snapshot)s IS NULL OR round > %(snapshot)s)
+   AND round <= %(round)s
+   AND id > %(start)s AND id <= %(until)s
+   AND kind IN ('report', 'correct')
+ ORDER BY round, id
+"""
+
+# The tournament's entrants at an event, or every player registered by then
+# when nobody had entered it
+_ROSTER_SQL = """
+WITH entered AS (
+  SELECT DISTINCT player1 AS player FROM Event
+   WHERE tournament = %(tournament)s AND kind = 'enter'
+     AND id <= %(until)s)
+SELECT p.id, p.full_name FROM entered e JOIN Player p ON p.id = e.player
+UNION ALL
+SELECT p.id, p.full_name FROM Event e JOIN Player p ON p.id = e.player1
+ WHERE e.kind = 'register' AND e.id <= %(until)s
+   AND NOT EXISTS (SELECT 1 FROM entered)
+"""
+
+# Logs a tournament's matches added with COPY
+_LOG_MATCHES_SQL = """
+INSERT INTO Event (kind, tournament, round, match, player1, player2, winner)
+SELECT 'report', tournament, round, id, player1, player2, winner FROM Match
+ WHERE tournament = %s ORDER BY round, id
+"""
+
+_SAVE_SNAPSHOT_SQL = """
+INSERT INTO Snapshot (tournament, round, event)
+VALUES (%(tournament)s, %(snapshot)s, %(until)s)
+"""
+
+_COPY_SNAPSHOT_SQL = """
+COPY SnapshotStanding (tournament, round, player, wins, matches,
+                       opponent_wins, opponents) FROM STDIN WITH (FORMAT csv)
+"""
+
+
+def tournamentEvents(tournament):
+    """Returns a tournament's event log, oldest first.
+
+    Returns:
+      A list of tuples, each of which contains
+      (id, kind, round, match, player1, player2, winner, created):
+        kind: 'enter' (player1 entered the tournament), 'report' (a match
+          was reported), 'correct' (the match's winner was changed, see
+          correctMatch()) or 'delete' (the tournament's matches were
+          deleted; round and the players are None)
+        created: when the event was logged
+      The ids increase with every event and can be passed to standingsAt().
+      Deletions of every tournament's matches (deleteMatches()) are listed
+      too.
+    """
+    with connect() as (db, cursor):
+        cursor.execute(_EVENTS_SQL, {'tournament': tournament})
+        return cursor.fetchall()
+
+
+def standingsAt(tournament, round, event=None):
+    """Returns a tournament's standings after a round, replayed from the log.
+
+    Replay starts from the nearest snapshot at or before the round, so only
+    the rounds since then are read.  Snapshots are taken every
+    SNAPSHOT_INTERVAL rounds on the way and dropped when a report or a
+    correction changes their rounds.
+
+    Args:
+      tournament: the id number of the tournament
+      round: the last round to include
+      event: the id of the last event to include (see tournamentEvents()),
+        or None for the current log; e.g. the event before a 'delete' gives
+        the standings of the deleted matches
+
+    Returns:
+      The same (id, name, wins, matches) tuples as playerStandings(), for the
+      players entered (or registered) at that point.
+    """
+    params = {'tournament': tournament, 'round': round, 'event': event}
+    with connect() as (db, cursor):
+        if event is None:
+            cursor.execute(_LOCK_STANDING_SQL, params)
+        cursor.execute(_EVENT_BOUNDS_SQL, params)
+        params['until'], params['start'] = cursor.fetchone()
+        cursor.execute(_SNAPSHOT_SQL, params)
+        row = cursor.fetchone()
+        params['snapshot'] = row[0] if row else None
+        state = {}
+        if row:
+            cursor.execute(_SNAPSHOT_STANDINGS_SQL, params)
+            for player, wins, matches, opponent_wins, opponents in cursor:
+                state[player] = [wins, matches, opponent_wins, opponents]
+
+        cursor.execute(_TAIL_SQL, params)
+        for match_round, round_matches in _tailRounds(cursor.fetchall()):
+            _replay(state, round_matches)
+            if event is None and match_round % SNAPSHOT_INTERVAL == 0:
+                _saveSnapshot(cursor, tournament, match_round,
+                              params['until'], state)
+
+        cursor.execute(_ROSTER_SQL, params)
+        return _rosterStandings(state, cursor.fetchall())
+
+
+def _rosterStandings(state, roster):
+    """Returns the standings of the (id, name) roster from a replayed state."""
+    empty = (0, 0, 0)
+    standings = [(player, name) + tuple(state.get(player, empty)[:3])
+                 for player, name in roster]
+    standings.sort(key=lambda row: (-row[2], -row[4], row[0]))
+    return [row[:4] for row in standings]
+
+
+def _tailRounds(events):
+    """Groups the _TAIL_SQL events by round, with the corrections applied.
+
+    Yields (round, matches) pairs, matches being (round, player1, player2,
+    winner) lists in the order they were reported.
+    """
+    matches = collections.OrderedDict()
+    for kind, match_round, match, player1, player2, winner in events:
+        if kind == 'report':
+            matches[match] = [match_round, player1, player2, winner]
+        elif match in matches:
+            matches[match][3] = winner
+    return itertools.groupby(matches.values(), key=lambda match: match[0])
+
+
+def _replay(state, matches):
+    """Applies (round, player1, player2, winner) matches to a standings state.
+
+    state maps each player to [wins, matches, opponent_wins, opponents], and
+    is updated the way _REPORT_MATCH_SQL updates Standing.
+    """
+    for _, player1, player2, winner in matches:
+        for opponent in state.get(winner, (0, 0, 0, ()))[3]:
+            state[opponent][2] += 1
+        for player in (player1, player2):
+            if player is not None:
+                record = state.setdefault(player, [0, 0, 0, []])
+                record[0] += int(player == winner)
+                record[1] += 1
+        if player2 is not None:
+            state[player1][2] += state[player2][0]
+            state[player2][2] += state[player1][0]
+            state[player1][3].append(player2)
+            state[player2][3].append(player1)
+
+
+def _saveSnapshot(cursor, tournament, round, event, state):
+    params = {'tournament': tournament, 'snapshot': round, 'until': event}
+    cursor.execute(_SAVE_SNAPSHOT_SQL, params)
+    cursor.copy_expert(_COPY_SNAPSHOT_SQL,
+                       StringIO(_snapshotCSV(tournament, round, state)))
+
+
+def _snapshotCSV(tournament, round, state):
+    """Returns the COPY rows of a snapshot of a replayed state, as CSV."""
+    rows = StringIO()
+    csv.writer(rows).writerows(
+        (tournament, round, player, wins, matches, opponent_wins,
+         '{%s}' % ','.join(str(opponent) for opponent in opponents))
+        for player, (wins, matches, opponent_wins, opponents)
+        in state.items())
+    return rows.getvalue()
+
+
+# Every player's rating, highest first
+_PLAYER_RATINGS_SQL = """
+SELECT p.id, p.full_name, COALESCE(r.rating, %(initial_rating)s),
+       COALESCE(r.games, 0)
+  FROM Player p LEFT JOIN Rating r ON r.player = p.id
+ ORDER BY 3 DESC, p.id
+"""
+
+# Replaces every rating with the recomputed ones, passed as parallel arrays
+_WRITE_RATINGS_SQL = """
+TRUNCATE Rating;
+
+INSERT INTO Rating (player, rating, games)
+SELECT * FROM unnest(%(players)s::integer[], %(ratings)s::double precision[],
+                     %(games)s::integer[]);
+"""
+
+
+def playerRatings():
+    """Returns every player's Elo rating, highest first.
+
+    Returns:
+      A list of tuples, each of which contains (id, name, rating, games):
+        id: the player's unique id
+        name: the player's full name
+        rating: the player's rating (rating.INITIAL_RATING before any match)
+        games: the number of rated matches the player has played (byes
+          are not rated)
+    """
+    with connect() as (db, cursor):
+        cursor.execute(_PLAYER_RATINGS_SQL,
+                       {'initial_rating': rating.INITIAL_RATING})
+        return cursor.fetchall()
+
+
+def recomputeRatings():
+    """Recompute every player's Elo rating from the whole match history.
+
+    Matches are replayed in the order they were reported with
+    rating.rateMatches(), so the result is the one reportMatch and
+    reportRound would have produced.  New matches wait until the ratings
+    are written.  Use this after matches were deleted or edited, or to
+    apply a changed rating.ELO_K.
+    """
+    with connect() as (db, cursor):
+        _recomputeRatings(cursor)
+    invalidatePairings()
+
+
+def _recomputeRatings(cursor):
+    cursor.execute("LOCK TABLE Match IN SHARE MODE")
+    cursor.execute("SELECT player1, player2, winner FROM Match ORDER BY id")
+    cursor.execute(_WRITE_RATINGS_SQL, _ratingParams(cursor.fetchall()))
+
+
+def _ratingParams(history):
+    """Returns the _WRITE_RATINGS_SQL params for a list of match rows."""
+    player1, player2, winner = zip(*history) or ((), (), ())
+    players = numpy.array(sorted((set(player1) | set(player2)) - set([None])),
+                          dtype=numpy.int64)
+    ratings, games = rating.rateMatches(players, player1, player2, winner)
+    rated = games > 0
+    return {'players': players[rated].tolist(),
+            'ratings': ratings[rated].tolist(),
+            'games': games[rated].tolist()}
+
+
+# Number of rows leaderboard() returns by default
+LEADERBOARD_PAGE_SIZE = 100
+
+# The lifetime wins of the player a leaderboard page starts after
+_LEADERBOARD_KEY_SQL = """
+SELECT wins FROM PlayerTotal WHERE player = %(after)s
+"""
+
+# The next players by lifetime wins (then id), read backwards along
+# playerTotalRankIdx from the wins of the player the page starts after
+_LEADERBOARD_SQL = """
+SELECT p.id, p.full_name, t.wins, t.matches,
+       CAST(t.wins AS DOUBLE PRECISION) / t.matches,
+       COALESCE(r.rating, %(initial_rating)s)
+  FROM PlayerTotal t
+  JOIN Player p ON p.id = t.player
+  LEFT JOIN Rating r ON r.player = t.player
+ WHERE t.matches > 0
+   AND (%(after)s IS NULL OR
+        (t.wins, -t.player) < (%(wins)s, -CAST(%(after)s AS INTEGER)))
+ ORDER BY t.wins DESC, -t.player DESC
+ LIMIT %(limit)s
+"""
+
+# Replaces the lifetime records with the ones recomputed from every match
+_REBUILD_TOTALS_SQL = """
+DELETE FROM PlayerTotal;
+
+INSERT INTO PlayerTotal (player, wins, matches)
+SELECT player, SUM(wins), SUM(matches) FROM PlayerRecord GROUP BY player
+"""
+
+
+def leaderboard(after=None, limit=LEADERBOARD_PAGE_SIZE):
+    """Returns one page of the lifetime leaderboard across all tournaments.
+
+    Players are ranked by their wins in every tournament, then by id.  The
+    records are kept in the PlayerTotal table by reportMatch, reportRound
+    and deleteTourMatches, and pages are read along an index on it, so a
+    page costs the same however many matches have been played.
+
+    Args:
+      after: the id of the last player of the previous page, or None for
+        the first page
+      limit: the most rows to return
+
+    Returns:
+      A list of tuples, each of which contains
+      (id, name, wins, matches, win_rate, rating):
+        id: the player's unique id
+        name: the player's full name
+        wins: the matches the player has won in all tournaments
+        matches: the matches the player has played in all tournaments
+        win_rate: wins / matches
+        rating: the player's Elo rating, see playerRatings()
+      Players who have not played are not listed.
+    """
+    with connect() as (db, cursor):
+        return _leaderboard(cursor, after, limit)
+
+
+def _leaderboard(cursor, after, limit):
+    params = {'after': after, 'wins': None, 'limit': limit,
+              'initial_rating': rating.INITIAL_RATING}
+    if after is not None:
+        cursor.execute(_LEADERBOARD_KEY_SQL, params)
+        key = cursor.fetchone()
+        if key is None:
+            return []
+        params['wins'] = key[0]
+    cursor.execute(_LEADERBOARD_SQL, params)
+    return cursor.fetchall()
+
+
+def rebuildLeaderboard():
+    """Recompute every player's lifetime record from the match history.
+
+    Use this after matches were added, deleted or edited directly in the
+    database.
+    """
+    with connect() as (db, cursor):
+        _rebuildLeaderboard(cursor)
+
+
+def _rebuildLeaderboard(cursor):
+    cursor.execute("LOCK TABLE Match IN SHARE MODE")
+    cursor.execute(_REBUILD_TOTALS_SQL)
+
+
+def matchHistory(tournament):
+    """Returns the MatchHistory (opponents, colors and byes) of a tournament."""
+    with connect() as (db, cursor):
+        cursor.execute(_MATCHES_SQL, (tournament,))
+        return swiss.MatchHistory((player1, player2)
+                                  for player1, player2, winner in cursor)
+
+
+# Number of swissPairings() results kept, least recently used first out
+# (0 disables the cache)
+PAIRINGS_CACHE_SIZE = 256
+
+# {(tournament, round, tournament event, global event): pairings}, in least
+# recently used order
+_pairings_cache = collections.OrderedDict()
+_pairings_cache_lock = threading.Lock()
+
+# The version of a tournament's pairings: its last round, its last logged
+# event and the last event logged for every tournament (a registration or
+# a deletion of matches, players or tournaments).  Each is one probe of an
+# index; the global event is ordered like eventVersionIdx so that it is not
+# looked for along the primary key.
+_PAIRINGS_VERSION_SQL = """
+SELECT (SELECT COALESCE(MAX(round), 0) FROM Match
+         WHERE tournament = %(tournament)s),
+       (SELECT MAX(id) FROM Event WHERE tournament = %(tournament)s),
+       (SELECT id FROM Event WHERE tournament IS NULL
+         ORDER BY tournament DESC, id DESC LIMIT 1)
+"""
+
+
+def swissPairings(tournament, server=False):
     """Returns a list of pairs of players for the next round of a match.
 
-    Assuming that there are an even number of players registered, each player
-    appears exactly once in the pairings.  Each player is paired with another
-    player with an equal or nearly-equal win record, that is, a player adjacent
-    to him or her in the standings.
+    Each player appears exactly once in the pairings.  Players are paired
+    within their score group, top group first; players who cannot be paired
+    in their group without a rematch float down to the next one.  When that
+    leaves a rematch, the field is searched for a round without one, which
+    is used if found within swiss.BACKTRACK_LIMIT tries.  With an odd
+    number of players the lowest ranked player without a bye gets one.  The
+    first player of each pair is the one due white.  In the first round
+    players are seeded by their Elo rating (see playerRatings()).
+
+    Results are cached for the tournament's current round (see
+    PAIRINGS_CACHE_SIZE): a repeated call costs one indexed version query.
+    Every report, correction, entry, registration and deletion made with
+    this module (or tournament_async) logs an event, so any of them since
+    the last call, in any process, gives a new version.  Changes made with
+    plain SQL do not, and neither do ratings changed by other tournaments,
+    so a cached first round keeps its seeding.
+
+    Args:
+      tournament: the id number of the tournament
+      server: pair with the swissPairings() database function instead, in a
+        single round trip: the standings are paired in order (1st against
+        2nd, 3rd against 4th...) without avoiding rematches or balancing
+        colors; the bye rule is the same
 
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
         id1: the first player's unique id
         name1: the first player's name
-        id2: the second player's unique id
-        name2: the second player's name
+        id2: the second player's unique id, or None for a bye
+        name2: the second player's name, or None for a bye
+    """
+    with connect() as (db, cursor):
+        if server:
+            cursor.execute(_SERVER_PAIRINGS_SQL, (tournament,))
+            return cursor.fetchall()
+        if not PAIRINGS_CACHE_SIZE:
+            return _swissPairings(cursor, tournament)
+        cursor.execute(_PAIRINGS_VERSION_SQL, {'tournament': tournament})
+        key = (tournament,) + cursor.fetchone()
+        with _pairings_cache_lock:
+            pairings = _pairings_cache.pop(key, None)
+            if pairings is not None:
+                _pairings_cache[key] = pairings
+                return list(pairings)
+        pairings = _swissPairings(cursor, tournament)
+    with _pairings_cache_lock:
+        _pairings_cache[key] = tuple(pairings)
+        while len(_pairings_cache) > PAIRINGS_CACHE_SIZE:
+            _pairings_cache.popitem(last=False)
+    return pairings
+
+
+def invalidatePairings(tournament=None):
+    """Drop the cached swissPairings() of a tournament, or of all of them.
+
+    The functions of this module that change a tournament call this
+    themselves; changes made by other processes are caught by the version
+    check of swissPairings() instead.
+    """
+    with _pairings_cache_lock:
+        if tournament is None:
+            _pairings_cache.clear()
+            return
+        for key in [key for key in _pairings_cache if key[0] == tournament]:
+            del _pairings_cache[key]
+
+
+def _swissPairings(cursor, tournament):
+    cursor.execute(_STANDINGS_SQL, {'tournament': tournament})
+    standings = [row[:4] for row in cursor.fetchall()]
+    cursor.execute(_MATCHES_SQL, (tournament,))
+    history = swiss.MatchHistory((player1, player2)
+                                 for player1, player2, winner in cursor)
+    ratings = None
+    if not (history.opponents or history.byes):
+        cursor.execute(_SEED_RATINGS_SQL, ([row[0] for row in standings],))
+        ratings = dict(cursor.fetchall())
+    return _pairings(standings, history, ratings)
+
+
+# Ratings used to seed the first round of a tournament
+_SEED_RATINGS_SQL = "SELECT player, rating FROM Rating WHERE player = ANY(%s)"
+
+
+def _pairings(standings, history, ratings=None):
+    """Pairs the next round from playerStandings() rows and a MatchHistory.
+
+    With ratings, a {player id: rating} dict, players are seeded by rating
+    first (highest first, unrated players at rating.INITIAL_RATING), as for
+    the first round of a tournament.
+    """
+    if ratings is not None:
+        standings = sorted(standings, key=lambda row: (
+            -row[2], -ratings.get(row[0], rating.INITIAL_RATING), row[0]))
+    names = dict((row[0], row[1]) for row in standings)
+    pairs = swiss.pairRound([(row[0], row[2]) for row in standings], history)
+    return [(id1, names[id1], id2, names.get(id2)) for id1, id2 in pairs]
+
+
+class RoundConflict(ValueError):
+    """A round was paired or reported when it was not the next round."""
+
+
+# The last round reported in a tournament, 0 before the first
+_LAST_ROUND_SQL = """
+SELECT COALESCE(MAX(round), 0) FROM Match WHERE tournament = %(tournament)s
+"""
+
+
+def lastRound(tournament):
+    """Returns the last round reported in a tournament, 0 before any."""
+    with connect() as (db, cursor):
+        cursor.execute(_LAST_ROUND_SQL, {'tournament': tournament})
+        return cursor.fetchone()[0]
+
+
+def pairRound(tournament, round=None):
+    """Pairs a tournament's next round, see swissPairings().
+
+    The standings and match history are read while holding the
+    tournament's advisory lock, so no report lands half-way through the
+    pairing.  Together with reportNextRound() this lets many processes
+    (see coordinator.py) play the same tournaments without ever recording
+    a round twice.
+
+    Args:
+      tournament: the id number of the tournament
+      round: the round expected to be next (the version the caller last
+        saw), or None for whichever round is next
+
+    Returns:
+      A (round, pairings) tuple: the number of the round paired and the
+      swissPairings() rows.
+
+    Raises:
+      RoundConflict: round is not the tournament's next round.
+    """
+    params = {'tournament': tournament}
+    with connect() as (db, cursor):
+        cursor.execute(_LOCK_STANDING_SQL, params)
+        round = _nextRound(cursor, tournament, round)
+        return round, _swissPairings(cursor, tournament)
+
+
+def reportNextRound(tournament, round, results):
+    """Report a tournament's round, unless it has already been reported.
+
+    Works like reportRound(), except that the round must be the one after
+    the last round reported.  The check and the report are made under the
+    tournament's advisory lock, so of two processes reporting the same
+    round only the first one records it.
+
+    Raises:
+      RoundConflict: round is not the tournament's next round, e.g. another
+        process has reported it.
+      ValueError: see reportRound().
+    """
+    params = _roundParams(tournament, round, results)
+    with connect() as (db, cursor):
+        cursor.execute(_LOCK_STANDING_SQL, params)
+        _nextRound(cursor, tournament, round)
+        if len(params['winners']) >= ANALYZE_ROUND_SIZE:
+            cursor.execute("ANALYZE Match, Standing")
+        cursor.execute(_REPORT_ROUND_SQL, params)
+    invalidatePairings(tournament)
+
+
+def _nextRound(cursor, tournament, round):
+    """Returns the tournament's next round, checking that it is round."""
+    cursor.execute(_LAST_ROUND_SQL, {'tournament': tournament})
+    next_round = cursor.fetchone()[0] + 1
+    if round is not None and round != next_round:
+        raise RoundConflict("Round %r of tournament %r is not the next round "
+                            "(%r)." % (round, tournament, next_round))
+    return next_round
+
+
+# Scheduled games of round-robin and elimination tournaments, from bracket.py
+_DELETE_FIXTURES_SQL = "DELETE FROM Fixture WHERE tournament = %s"
+
+_COPY_FIXTURES_SQL = """
+COPY Fixture (tournament, game, round, bracket, player1, player2, source1,
+              source2, loser1, loser2) FROM STDIN
+"""
+
+# Games of one round, with the names of the players they are given
+_ROUND_FIXTURES_SQL = """
+SELECT f.game, f.player1, p1.full_name, f.player2, p2.full_name,
+       f.source1 IS NOT NULL OR f.source2 IS NOT NULL
+  FROM Fixture f
+  LEFT JOIN Player p1 ON p1.id = f.player1
+  LEFT JOIN Player p2 ON p2.id = f.player2
+ WHERE f.tournament = %(tournament)s AND f.round = %(round)s
+ ORDER BY f.game
+"""
+
+# A whole bracket, to fill in the games fed by earlier ones
+_FIXTURES_SQL = """
+SELECT round, bracket, COALESCE(player1, 0), COALESCE(player2, 0),
+       COALESCE(source1, -1), COALESCE(source2, -1), loser1, loser2
+  FROM Fixture WHERE tournament = %s ORDER BY game
+"""
+
+_RESULTS_SQL = """
+SELECT round, player1, player2, winner FROM Match WHERE tournament = %s
+"""
+
+_PLAYER_NAMES_SQL = "SELECT id, full_name FROM Player WHERE id = ANY(%s)"
+
+# Number of games sent to the server per chunk of a schedule's COPY
+SCHEDULE_CHUNK_SIZE = 10000
+
+
+def scheduleRoundRobin(tournament):
+    """Schedules every player of a tournament against every other.
+
+    The games are generated with bracket.roundRobin() and written to the
+    Fixture table with COPY, replacing any earlier schedule.  Rounds are
+    numbered on from the last round reported, see roundFixtures().
+
+    Returns:
+      The number of games scheduled, byes included.
     """
-    pairings = []
-    standings = playerStandings(tournament)
-    c = 0
-    for s in standings:
-        ranked_player = (s[0], s[1])
+    with connect() as (db, cursor):
+        players = _seeds(cursor, tournament)
+        return _writeSchedule(cursor, tournament, bracket.roundRobin(players))
+
+
+def scheduleElimination(tournament, double=False, top=None):
+    """Schedules a knock-out bracket seeded by the tournament's standings.
 
-        if c % 2 == 0:
-            pairings.append(ranked_player)
+    Args:
+      tournament: the id number of the tournament
+      double: schedule a double elimination bracket, see
+        bracket.doubleElimination()
+      top: only seed this many players from the top of playerStandings(),
+        e.g. for a knock-out stage after Swiss rounds
+
+    Returns:
+      The number of games scheduled, byes included.
+    """
+    with connect() as (db, cursor):
+        seeds = _seeds(cursor, tournament)[:top]
+        if double:
+            schedule = bracket.doubleElimination(seeds)
         else:
-            curr_entry = len(pairings)-1
-            pairings[curr_entry] = pairings[curr_entry] + ranked_player
+            schedule = bracket.singleElimination(seeds)
+        return _writeSchedule(cursor, tournament, schedule)
 
-        c += 1
 
-    return pairings
+def _seeds(cursor, tournament):
+    cursor.execute(_STANDINGS_SQL, {'tournament': tournament})
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _writeSchedule(cursor, tournament, schedule):
+    cursor.execute(_LAST_ROUND_SQL, {'tournament': tournament})
+    first_round = cursor.fetchone()[0]
+    cursor.execute(_DELETE_FIXTURES_SQL, (tournament,))
+    cursor.copy_expert(_COPY_FIXTURES_SQL,
+                       _LineReader(_fixtureLines(tournament, schedule,
+                                                 first_round)),
+                       size=65536)
+    return len(schedule.round)
+
 
+def _fixtureLines(tournament, schedule, first_round):
+    """Yields the COPY text of a Schedule, SCHEDULE_CHUNK_SIZE games at a
+    time."""
+    def column(values, missing):
+        return ['\\N' if value == missing else str(value)
+                for value in values.tolist()]
+
+    for start in range(0, len(schedule.round), SCHEDULE_CHUNK_SIZE):
+        chunk = slice(start, start + SCHEDULE_CHUNK_SIZE)
+        rows = zip(range(start, start + len(schedule.round[chunk])),
+                   (schedule.round[chunk] + first_round).tolist(),
+                   schedule.bracket[chunk].tolist(),
+                   column(schedule.player1[chunk], bracket.NO_PLAYER),
+                   column(schedule.player2[chunk], bracket.NO_PLAYER),
+                   column(schedule.source1[chunk], -1),
+                   column(schedule.source2[chunk], -1),
+                   schedule.loser1[chunk].tolist(),
+                   schedule.loser2[chunk].tolist())
+        yield ''.join('%d\t%d\t%d\t%d\t%s\t%s\t%s\t%s\t%s\t%s\n'
+                      % ((tournament,) + row[:7] + ('ft'[row[7]],
+                                                    'ft'[row[8]]))
+                      for row in rows)
+
+
+class _LineReader(object):
+    """A file-like object reading the strings of an iterator, for COPY."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def roundFixtures(tournament, round=None):
+    """Returns the scheduled games of a round ready to be played.
+
+    A game fed by earlier games of an elimination bracket is listed once
+    their results have been reported; its players are then the winners (or
+    losers) of those games.  Report the games with reportMatch() or
+    reportRound() like the rows of swissPairings().
+
+    Args:
+      tournament: the id number of the tournament
+      round: the round, by default the one after the last round reported
+
+    Returns:
+      A list of (id1, name1, id2, name2) tuples like swissPairings(), id2
+      being None for a bye.
+    """
+    with connect() as (db, cursor):
+        if round is None:
+            cursor.execute(_LAST_ROUND_SQL, {'tournament': tournament})
+            round = cursor.fetchone()[0] + 1
+        cursor.execute(_ROUND_FIXTURES_SQL,
+                       {'tournament': tournament, 'round': round})
+        games = cursor.fetchall()
+        if not any(fed for (game, id1, name1, id2, name2, fed) in games):
+            return [(id1, name1, id2, name2)
+                    for (game, id1, name1, id2, name2, fed) in games]
+
+        cursor.execute(_FIXTURES_SQL, (tournament,))
+        fixtures = cursor.fetchall()
+        cursor.execute(_RESULTS_SQL, (tournament,))
+        pairs = _fixturePairs(games, fixtures, cursor.fetchall())
+        cursor.execute(_PLAYER_NAMES_SQL,
+                       ([player for pair in pairs for player in pair],))
+        names = dict(cursor.fetchall())
+    return [(id1, names[id1], id2 or None, names.get(id2))
+            for id1, id2 in pairs]
+
+
+def _fixturePairs(games, fixtures, results):
+    """Resolves the players of a round's games from a bracket's results.
+
+    Args:
+      games: the _ROUND_FIXTURES_SQL rows of the round
+      fixtures: the _FIXTURES_SQL rows of the whole schedule
+      results: the _RESULTS_SQL rows of the reported matches
+
+    Returns:
+      A list of (id1, id2) pairs for the games whose players are known, id2
+      being 0 for a bye.
+    """
+    schedule = bracket.Schedule(*[numpy.array(column)
+                                  for column in zip(*fixtures)])
+    results = dict(((r, min(p1, p2), max(p1, p2)), winner)
+                   for (r, p1, p2, winner) in results if p2 is not None)
+    player1, player2, winner = bracket.resolve(
+        schedule, lambda r, p1, p2: results.get((r, min(p1, p2),
+                                                 max(p1, p2))))
+    pairs = [(int(player1[game]), int(player2[game]))
+             for (game, id1, name1, id2, name2, fed) in games]
+    return [(id1, id2) if id1 else (id2, id1) for id1, id2 in pairs
+            if bracket.UNDECIDED not in (id1, id2) and (id1 or id2)]
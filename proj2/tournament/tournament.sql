@@ -7,6 +7,19 @@
 -- these lines here.
 
 -- Drop tables
+DROP FUNCTION IF EXISTS swissPairings(INTEGER);
+DROP FUNCTION IF EXISTS playerStandings(INTEGER);
+DROP VIEW IF EXISTS ComputedStanding;
+DROP VIEW IF EXISTS PlayerRecord;
+DROP VIEW IF EXISTS PlayerMatch;
+DROP TABLE IF EXISTS Fixture;
+DROP TABLE IF EXISTS SnapshotStanding;
+DROP TABLE IF EXISTS Snapshot;
+DROP TABLE IF EXISTS Event;
+DROP TABLE IF EXISTS Standing;
+DROP TABLE IF EXISTS Rating;
+DROP TABLE IF EXISTS PlayerTotal;
+DROP TABLE IF EXISTS TournamentPlayer;
 DROP TABLE IF EXISTS Match;
 DROP TABLE IF EXISTS Tournament;
 DROP TABLE IF EXISTS Player;
@@ -19,4 +32,125 @@ CREATE TABLE Tournament (id SERIAL, description VARCHAR(200), CONSTRAINT tournam
 
 --Matches
 CREATE TABLE Match (id SERIAL, player1 INTEGER, player2 INTEGER, winner INTEGER, round INTEGER, tournament INTEGER, CONSTRAINT player1FK FOREIGN KEY (player1) REFERENCES Player (id), CONSTRAINT player2FK FOREIGN KEY (player2) REFERENCES Player (id), CONSTRAINT tournamentFK FOREIGN KEY (tournament) REFERENCES Tournament (id));
+CREATE INDEX matchPlayer1Idx ON Match (tournament, player1) INCLUDE (player2, winner);
+CREATE INDEX matchPlayer2Idx ON Match (tournament, player2) INCLUDE (player1, winner);
+CREATE INDEX matchRoundIdx ON Match (tournament, round, id) INCLUDE (player1, player2, winner);
 
+--Tournament entrants (a tournament without entrants is open to every registered player)
+CREATE TABLE TournamentPlayer (tournament INTEGER, player INTEGER, CONSTRAINT tournamentPlayerPK PRIMARY KEY (tournament, player), CONSTRAINT tournamentPlayerTournamentFK FOREIGN KEY (tournament) REFERENCES Tournament (id) ON DELETE CASCADE, CONSTRAINT tournamentPlayerPlayerFK FOREIGN KEY (player) REFERENCES Player (id) ON DELETE CASCADE);
+CREATE INDEX tournamentPlayerPlayerIdx ON TournamentPlayer (player);
+
+--Matches from each player's point of view, one row per player per match (a bye has no player2)
+CREATE VIEW PlayerMatch AS
+  SELECT id AS match, tournament, round, player1 AS player, player2 AS opponent, winner FROM Match
+  UNION ALL
+  SELECT id AS match, tournament, round, player2 AS player, player1 AS opponent, winner FROM Match WHERE player2 IS NOT NULL;
+
+--Standings, maintained by reportMatch (opponent_wins is the sum of the wins of every opponent played)
+CREATE TABLE Standing (tournament INTEGER, player INTEGER, wins INTEGER NOT NULL DEFAULT 0, matches INTEGER NOT NULL DEFAULT 0, opponent_wins INTEGER NOT NULL DEFAULT 0, CONSTRAINT standingPK PRIMARY KEY (tournament, player), CONSTRAINT standingTournamentFK FOREIGN KEY (tournament) REFERENCES Tournament (id) ON DELETE CASCADE, CONSTRAINT standingPlayerFK FOREIGN KEY (player) REFERENCES Player (id) ON DELETE CASCADE);
+--Ranking order (wins, then opponent wins, descending; then player), read backwards by standingsPage
+CREATE INDEX standingRankIdx ON Standing (tournament, wins, opponent_wins, (-player)) INCLUDE (player, matches);
+CREATE INDEX standingPlayerIdx ON Standing (player);
+
+--Elo ratings across all tournaments, updated by reportMatch (players without a row have the initial rating)
+CREATE TABLE Rating (player INTEGER, rating DOUBLE PRECISION NOT NULL, games INTEGER NOT NULL DEFAULT 0, CONSTRAINT ratingPK PRIMARY KEY (player), CONSTRAINT ratingPlayerFK FOREIGN KEY (player) REFERENCES Player (id) ON DELETE CASCADE);
+
+--Lifetime records across all tournaments, maintained by reportMatch for the leaderboard
+CREATE TABLE PlayerTotal (player INTEGER, wins INTEGER NOT NULL DEFAULT 0, matches INTEGER NOT NULL DEFAULT 0, CONSTRAINT playerTotalPK PRIMARY KEY (player), CONSTRAINT playerTotalPlayerFK FOREIGN KEY (player) REFERENCES Player (id) ON DELETE CASCADE);
+CREATE INDEX playerTotalRankIdx ON PlayerTotal (wins, (-player)) INCLUDE (player, matches);
+
+--Scheduled games of round-robin and elimination tournaments (see bracket.py): a slot with a source takes the
+--winner, or with loser set the loser, of that earlier game of the tournament.  The players have no foreign keys so
+--that a round robin of thousands of players loads quickly.
+CREATE TABLE Fixture (tournament INTEGER, game INTEGER, round INTEGER NOT NULL, bracket SMALLINT NOT NULL DEFAULT 0, player1 INTEGER, player2 INTEGER, source1 INTEGER, source2 INTEGER, loser1 BOOLEAN NOT NULL DEFAULT false, loser2 BOOLEAN NOT NULL DEFAULT false, CONSTRAINT fixturePK PRIMARY KEY (tournament, game), CONSTRAINT fixtureTournamentFK FOREIGN KEY (tournament) REFERENCES Tournament (id) ON DELETE CASCADE);
+CREATE INDEX fixtureRoundIdx ON Fixture (tournament, round, game) INCLUDE (player1, player2, source1, source2);
+
+--Append-only log of tournament actions: 'register' (player1 registered), 'enter' (player1 entered the
+--tournament), 'report' (a match), 'correct' (a match's new winner) and 'delete' (the tournament's matches, or
+--every tournament's when tournament is NULL, were deleted; deleting every player or tournament, which needs every
+--match gone, is logged the same way).  No foreign keys, so the log outlives what it describes.
+CREATE TABLE Event (id BIGSERIAL, kind VARCHAR(10) NOT NULL, tournament INTEGER, round INTEGER, match INTEGER, player1 INTEGER, player2 INTEGER, winner INTEGER, created TIMESTAMP NOT NULL DEFAULT now(), CONSTRAINT eventPK PRIMARY KEY (id), CONSTRAINT eventKindCheck CHECK (kind IN ('register', 'enter', 'report', 'correct', 'delete')));
+CREATE INDEX eventTournamentIdx ON Event (tournament, round, id);
+CREATE INDEX eventVersionIdx ON Event (tournament, id);
+CREATE INDEX eventDeleteIdx ON Event (id) WHERE kind = 'delete';
+
+--Standings of a tournament after a round, as of an event, replayed from the log by standingsAt
+--(each player's opponents are kept to carry opponent wins forward)
+CREATE TABLE Snapshot (tournament INTEGER, round INTEGER, event BIGINT NOT NULL, CONSTRAINT snapshotPK PRIMARY KEY (tournament, round), CONSTRAINT snapshotTournamentFK FOREIGN KEY (tournament) REFERENCES Tournament (id) ON DELETE CASCADE);
+CREATE TABLE SnapshotStanding (tournament INTEGER, round INTEGER, player INTEGER, wins INTEGER NOT NULL, matches INTEGER NOT NULL, opponent_wins INTEGER NOT NULL, opponents INTEGER[] NOT NULL, CONSTRAINT snapshotStandingPK PRIMARY KEY (tournament, round, player), CONSTRAINT snapshotStandingSnapshotFK FOREIGN KEY (tournament, round) REFERENCES Snapshot (tournament, round) ON DELETE CASCADE);
+
+--Standings recomputed from the match history, used to rebuild and check Standing
+CREATE VIEW PlayerRecord AS
+  SELECT tournament, player, COUNT(*) AS matches, COUNT(*) FILTER (WHERE winner = player) AS wins
+    FROM PlayerMatch GROUP BY tournament, player;
+
+CREATE VIEW ComputedStanding AS
+  SELECT r.tournament, r.player, r.wins, r.matches, COALESCE(SUM(o.wins), 0) AS opponent_wins
+    FROM PlayerRecord r
+    JOIN PlayerMatch pm ON pm.tournament = r.tournament AND pm.player = r.player
+    LEFT JOIN PlayerRecord o ON o.tournament = pm.tournament AND o.player = pm.opponent
+   GROUP BY r.tournament, r.player, r.wins, r.matches;
+
+--Standings of a tournament's entrants, or of every registered player when nobody has entered it,
+--in ranking order.  A plain SQL function, so the planner inlines it into the calling query.
+CREATE FUNCTION playerStandings(INTEGER)
+  RETURNS TABLE (id INTEGER, full_name VARCHAR, wins INTEGER, matches INTEGER, opponent_wins INTEGER)
+  LANGUAGE sql STABLE AS $$
+  SELECT p.id, p.full_name, COALESCE(s.wins, 0), COALESCE(s.matches, 0), COALESCE(s.opponent_wins, 0)
+    FROM TournamentPlayer tp
+    JOIN Player p ON p.id = tp.player
+    LEFT JOIN Standing s ON s.tournament = tp.tournament AND s.player = tp.player
+   WHERE tp.tournament = $1
+  UNION ALL
+  SELECT p.id, p.full_name, COALESCE(s.wins, 0), COALESCE(s.matches, 0), COALESCE(s.opponent_wins, 0)
+    FROM Player p
+    LEFT JOIN Standing s ON s.tournament = $1 AND s.player = p.id
+   WHERE NOT EXISTS (SELECT 1 FROM TournamentPlayer WHERE tournament = $1)
+   ORDER BY 3 DESC, 5 DESC, 1
+$$;
+
+--Adjacent pairing of a tournament's next round: 1st against 2nd, 3rd against 4th and so on.
+--In an odd field the lowest ranked player without a bye gets one, returned last with no id2.
+--Rematches are not avoided and colors are not balanced, see swiss.py for the full rules.
+CREATE FUNCTION swissPairings(t INTEGER)
+  RETURNS TABLE (id1 INTEGER, name1 VARCHAR, id2 INTEGER, name2 VARCHAR)
+  LANGUAGE plpgsql STABLE AS $$
+DECLARE
+  ids INTEGER[];
+  names VARCHAR[];
+  bye INTEGER;
+  bye_name VARCHAR;
+  i INTEGER := 1;
+BEGIN
+  SELECT array_agg(s.id ORDER BY s.rank), array_agg(s.full_name ORDER BY s.rank)
+    INTO ids, names
+    FROM playerStandings(t) WITH ORDINALITY AS s(id, full_name, wins, matches, opponent_wins, rank);
+  IF ids IS NULL THEN
+    RETURN;
+  END IF;
+
+  IF array_length(ids, 1) % 2 = 1 THEN
+    SELECT r.id INTO bye
+      FROM unnest(ids) WITH ORDINALITY AS r(id, rank)
+     WHERE NOT EXISTS (SELECT 1 FROM Match m
+                        WHERE m.tournament = t AND m.player1 = r.id AND m.player2 IS NULL)
+     ORDER BY r.rank DESC LIMIT 1;
+    bye := COALESCE(bye, ids[array_length(ids, 1)]);
+    bye_name := names[array_position(ids, bye)];
+    names := names[1:array_position(ids, bye) - 1] || names[array_position(ids, bye) + 1:];
+    ids := array_remove(ids, bye);
+  END IF;
+
+  WHILE i < COALESCE(array_length(ids, 1), 0) LOOP
+    id1 := ids[i]; name1 := names[i];
+    id2 := ids[i + 1]; name2 := names[i + 1];
+    RETURN NEXT;
+    i := i + 2;
+  END LOOP;
+
+  IF bye IS NOT NULL THEN
+    id1 := bye; name1 := bye_name; id2 := NULL; name2 := NULL;
+    RETURN NEXT;
+  END IF;
+END;
+$$;
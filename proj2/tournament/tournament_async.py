@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+#
+# tournament_async.py -- asyncio version of the tournament.py API
+#
+# Every public function of tournament.py is a coroutine here, so many
+# tournaments can register players, report matches and pair rounds
+# concurrently on one event loop:
+#
+#   import tournament_async as tournament
+#   pairings = await tournament.swissPairings(t)
+#
+# Queries run on psycopg 3 ('pip install "psycopg[binary]" psycopg_pool')
+# through the module's own asyncio connection pool.  The SQL, the
+# validation and the pairing rules are the ones of tournament.py.  Requires
+# Python 3.
+#
+
+import asyncio
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+import psycopg
+import psycopg_pool
+
+import bracket
+import rating
+import swiss
+import tournament as database
+
+# Connection pool settings
+DSN = database.DSN
+POOL_MIN_CONN = 1
+POOL_MAX_CONN = 8
+
+_pool = None
+_pool_lock = None
+
+
+async def getPool():
+    """Returns the module connection pool, opening it on first use.
+
+    The pool belongs to the event loop it was opened on; call closePool()
+    before using the module from another loop.
+    """
+    global _pool, _pool_lock
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    async with _pool_lock:
+        if _pool is None:
+            # Client-side binding, like psycopg2, so that one execute() can
+            # run a batch of several statements.  A UTF8 client encoding
+            # returns names as str even from an SQL_ASCII database.
+            pool = psycopg_pool.AsyncConnectionPool(
+                DSN, min_size=POOL_MIN_CONN, max_size=POOL_MAX_CONN,
+                kwargs={'cursor_factory': psycopg.AsyncClientCursor,
+                        'client_encoding': 'utf8'},
+                open=False)
+            await pool.open()
+            _pool = pool
+        return _pool
+
+
+async def closePool():
+    """Close every pooled connection.
+
+    The next call to connect() opens a fresh pool, so this can also be used to
+    pick up a changed DSN or pool size.
+    """
+    global _pool, _pool_lock
+    if _pool is not None:
+        await _pool.close()
+    _pool = None
+    _pool_lock = None
+
+
+@asynccontextmanager
+async def connect():
+    """Check out a connection from the asyncio connection pool.
+
+    Yields a (db, cursor) pair, like tournament.connect().  The transaction
+    is committed when the block exits normally and rolled back if it raises;
+    either way the connection goes back to the pool, which discards it if it
+    is broken.  At most POOL_MAX_CONN connections are checked out at once,
+    further callers wait for one to be returned.
+    """
+    pool = await getPool()
+    async with pool.connection() as db:
+        async with db.cursor() as cursor:
+            yield db, cursor
+
+
+async def deleteMatches():
+    """Remove all the matches from the database."""
+    async with connect() as (db, cursor):
+        await cursor.execute(database._DELETE_MATCHES_SQL)
+
+
+async def deleteTourMatches(tournament):
+    """Remove all the match records in a tournament from the database.
+
+    See tournament.deleteTourMatches().
+    """
+    async with connect() as (db, cursor):
+        await cursor.execute(database._DELETE_TOUR_TOTALS_SQL, (tournament,))
+        await cursor.execute(database._DELETE_TOUR_MATCHES_SQL,
+                             {'tournament': tournament})
+
+
+async def deletePlayers():
+    """Remove all the player records from the database."""
+    async with connect() as (db, cursor):
+        await cursor.execute(database._DELETE_PLAYERS_SQL)
+
+
+async def deleteTournaments():
+    """Remove all the tournament records from the database."""
+    async with connect() as (db, cursor):
+        await cursor.execute(database._DELETE_TOURNAMENTS_SQL)
+
+
+async def countPlayers():
+    """Returns the number of players currently registered."""
+    async with connect() as (db, cursor):
+        await cursor.execute("SELECT COUNT(*) FROM Player")
+        return (await cursor.fetchone())[0]
+
+
+async def _enter(cursor, tournament, players):
+    await cursor.execute(database._ENTER_SQL, (tournament, list(players)))
+
+
+async def registerPlayer(name, tournament=None):
+    """Adds a player and returns the id assigned to the player.
+
+    See tournament.registerPlayer().
+    """
+    async with connect() as (db, cursor):
+        await cursor.execute(database._REGISTER_PLAYER_SQL, (name,))
+        player = (await cursor.fetchone())[0]
+        if tournament is not None:
+            await _enter(cursor, tournament, [player])
+        return player
+
+
+async def registerPlayers(names, tournament=None):
+    """Adds many players in one transaction, returns their ids in input order.
+
+    Names are sent with COPY in batches of tournament.REGISTER_BATCH_SIZE,
+    see tournament.registerPlayers().
+    """
+    ids = []
+    names = iter(names)
+    async with connect() as (db, cursor):
+        while True:
+            batch = [name.rstrip('\r\n') for name in
+                     itertools.islice(names, database.REGISTER_BATCH_SIZE)]
+            if not batch:
+                break
+            await cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence('player', 'id')) "
+                "FROM generate_series(1, %s)", (len(batch),))
+            batch_ids = sorted(row[0] for row in await cursor.fetchall())
+            async with cursor.copy("COPY Player (id, full_name) "
+                                   "FROM STDIN") as copy:
+                for row in zip(batch_ids, batch):
+                    await copy.write_row(row)
+            await cursor.execute(database._LOG_REGISTER_SQL, (batch_ids,))
+            if tournament is not None:
+                await _enter(cursor, tournament, batch_ids)
+            ids.extend(batch_ids)
+    return ids
+
+
+async def enterTournament(tournament, players):
+    """Enters registered players in a tournament.
+
+    See tournament.enterTournament().
+    """
+    async with connect() as (db, cursor):
+        await _enter(cursor, tournament, players)
+
+
+async def registerTournament(description):
+    """Adds a tournament and returns the id assigned to it."""
+    async with connect() as (db, cursor):
+        await cursor.execute("INSERT INTO Tournament (description) "
+                             "VALUES (%s) RETURNING id", (description,))
+        return (await cursor.fetchone())[0]
+
+
+async def _standings(cursor, tournament, tiebreaks):
+    await cursor.execute(database._STANDINGS_SQL, {'tournament': tournament})
+    standings = await cursor.fetchall()
+    if not tiebreaks:
+        return [row[:4] for row in standings]
+    await cursor.execute(database._MATCHES_SQL, (tournament,))
+    history = await cursor.fetchall()
+    return database._rankWithTieBreaks(standings, history)
+
+
+async def playerStandings(tournament, tiebreaks=False):
+    """Returns a list of the players and their win records, sorted by wins.
+
+    Same rows and order as tournament.playerStandings().
+    """
+    async with connect() as (db, cursor):
+        return await _standings(cursor, tournament, tiebreaks)
+
+
+async def standingsPage(tournament, after=None,
+                        limit=database.STANDINGS_PAGE_SIZE):
+    """Returns one page of a tournament's standings.
+
+    Same rows as tournament.standingsPage().
+    """
+    params = {'tournament': tournament, 'after': after, 'wins': None,
+              'opponent_wins': None, 'limit': limit}
+    async with connect() as (db, cursor):
+        key = None
+        if after is not None:
+            await cursor.execute(database._STANDING_KEY_SQL, params)
+            key = await cursor.fetchone()
+        rows = []
+        if after is None or key is not None:
+            if key is not None:
+                params['wins'], params['opponent_wins'] = key
+            await cursor.execute(database._STANDINGS_PAGE_SQL, params)
+            rows = await cursor.fetchall()
+            params['after'] = None
+        if len(rows) < limit:
+            params['limit'] = limit - len(rows)
+            await cursor.execute(database._UNPLAYED_PAGE_SQL, params)
+            rows.extend(await cursor.fetchall())
+    return rows
+
+
+async def topStandings(tournament, n):
+    """Returns the first n rows of playerStandings()."""
+    return await standingsPage(tournament, limit=n)
+
+
+async def reportMatch(player1, player2, winner, round, tournament):
+    """Report a single match between two players (player2 None for a bye).
+
+    See tournament.reportMatch().
+    """
+    params = database._matchParams(player1, player2, winner, round,
+                                   tournament)
+    async with connect() as (db, cursor):
+        await cursor.execute(database._REPORT_MATCH_SQL, params)
+
+
+async def reportRound(tournament, round, results):
+    """Report every match of a tournament round at once.
+
+    Validates the whole round before recording any of it and writes it with
+    one batch of statements, like tournament.reportRound().  Returns the
+    elapsed time in seconds.
+    """
+    start = time.time()
+    params = database._roundParams(tournament, round, results)
+    async with connect() as (db, cursor):
+        if len(params['winners']) >= database.ANALYZE_ROUND_SIZE:
+            await cursor.execute("ANALYZE Match, Standing")
+        await cursor.execute(database._REPORT_ROUND_SQL, params)
+    return time.time() - start
+
+
+async def rebuildStandings(tournament):
+    """Recompute a tournament's standings from its match history."""
+    async with connect() as (db, cursor):
+        await cursor.execute(database._REBUILD_STANDINGS_SQL,
+                             {'tournament': tournament})
+
+
+async def checkStandings(tournament):
+    """Compare a tournament's stored standings with its match history.
+
+    Returns the same (id, stored, expected) tuples as
+    tournament.checkStandings().
+    """
+    async with connect() as (db, cursor):
+        await cursor.execute(database._CHECK_STANDINGS_SQL,
+                             {'tournament': tournament})
+        return database._standingErrors(await cursor.fetchall())
+
+
+async def correctMatch(match, winner):
+    """Changes the winner of a reported match.
+
+    See tournament.correctMatch().
+    """
+    async with connect() as (db, cursor):
+        await cursor.execute(database._CORRECTED_MATCH_SQL, (match,))
+        row = await cursor.fetchone()
+        if row is None:
+            raise ValueError("No match %r." % (match,))
+        tournament, round, player1, player2, old_winner = row
+        if winner == old_winner:
+            return
+        if winner is None or winner not in (player1, player2) or \
+                player2 is None:
+            raise ValueError("Winner %r did not play in match %r vs %r."
+                             % (winner, player1, player2))
+        await cursor.execute(database._CORRECT_MATCH_SQL, {
+            'match': match, 'tournament': tournament, 'round': round,
+            'player1': player1, 'player2': player2, 'winner': winner,
+            'loser': old_winner})
+
+
+async def tournamentEvents(tournament):
+    """Returns a tournament's event log, see tournament.tournamentEvents()."""
+    async with connect() as (db, cursor):
+        await cursor.execute(database._EVENTS_SQL, {'tournament': tournament})
+        return await cursor.fetchall()
+
+
+async def standingsAt(tournament, round, event=None):
+    """Returns a tournament's standings after a round, replayed from the log.
+
+    Same rows and snapshots as tournament.standingsAt().
+    """
+    params = {'tournament': tournament, 'round': round, 'event': event}
+    async with connect() as (db, cursor):
+        if event is None:
+            await cursor.execute(database._LOCK_STANDING_SQL, params)
+        await cursor.execute(database._EVENT_BOUNDS_SQL, params)
+        params['until'], params['start'] = await cursor.fetchone()
+        await cursor.execute(database._SNAPSHOT_SQL, params)
+        row = await cursor.fetchone()
+        params['snapshot'] = row[0] if row else None
+        state = {}
+        if row:
+            await cursor.execute(database._SNAPSHOT_STANDINGS_SQL, params)
+            for player, wins, matches, opponent_wins, opponents \
+                    in await cursor.fetchall():
+                state[player] = [wins, matches, opponent_wins, opponents]
+
+        await cursor.execute(database._TAIL_SQL, params)
+        for match_round, round_matches in database._tailRounds(
+                await cursor.fetchall()):
+            database._replay(state, round_matches)
+            if event is None and \
+                    match_round % database.SNAPSHOT_INTERVAL == 0:
+                await _saveSnapshot(cursor, tournament, match_round,
+                                    params['until'], state)
+
+        await cursor.execute(database._ROSTER_SQL, params)
+        return database._rosterStandings(state, await cursor.fetchall())
+
+
+async def _saveSnapshot(cursor, tournament, round, event, state):
+    params = {'tournament': tournament, 'snapshot': round, 'until': event}
+    await cursor.execute(database._SAVE_SNAPSHOT_SQL, params)
+    async with cursor.copy(database._COPY_SNAPSHOT_SQL) as copy:
+        await copy.write(database._snapshotCSV(tournament, round, state))
+
+
+async def playerRatings():
+    """Returns every player's Elo rating, highest first.
+
+    Same rows as tournament.playerRatings().
+    """
+    async with connect() as (db, cursor):
+        await cursor.execute(database._PLAYER_RATINGS_SQL,
+                             {'initial_rating': rating.INITIAL_RATING})
+        return await cursor.fetchall()
+
+
+async def recomputeRatings():
+    """Recompute every player's Elo rating from the whole match history.
+
+    See tournament.recomputeRatings().
+    """
+    async with connect() as (db, cursor):
+        await cursor.execute("LOCK TABLE Match IN SHARE MODE")
+        await cursor.execute("SELECT player1, player2, winner FROM Match "
+                             "ORDER BY id")
+        params = database._ratingParams(await cursor.fetchall())
+        await cursor.execute(database._WRITE_RATINGS_SQL, params)
+
+
+async def leaderboard(after=None, limit=database.LEADERBOARD_PAGE_SIZE):
+    """Returns one page of the lifetime leaderboard across all tournaments.
+
+    Same rows as tournament.leaderboard().
+    """
+    params = {'after': after, 'wins': None, 'limit': limit,
+              'initial_rating': rating.INITIAL_RATING}
+    async with connect() as (db, cursor):
+        if after is not None:
+            await cursor.execute(database._LEADERBOARD_KEY_SQL, params)
+            key = await cursor.fetchone()
+            if key is None:
+                return []
+            params['wins'] = key[0]
+        await cursor.execute(database._LEADERBOARD_SQL, params)
+        return await cursor.fetchall()
+
+
+async def rebuildLeaderboard():
+    """Recompute every player's lifetime record from the match history."""
+    async with connect() as (db, cursor):
+        await cursor.execute("LOCK TABLE Match IN SHARE MODE")
+        await cursor.execute(database._REBUILD_TOTALS_SQL)
+
+
+async def _history(cursor, tournament):
+    await cursor.execute(database._MATCHES_SQL, (tournament,))
+    return swiss.MatchHistory(
+        (player1, player2) for player1, player2, winner
+        in await cursor.fetchall())
+
+
+async def matchHistory(tournament):
+    """Returns the MatchHistory (opponents, colors and byes) of a tournament."""
+    async with connect() as (db, cursor):
+        return await _history(cursor, tournament)
+
+
+async def swissPairings(tournament, server=False):
+    """Returns a list of pairs of players for the next round of a match.
+
+    Same pairing rules and rows as tournament.swissPairings(); standings and
+    history are read on a single pooled connection.  With server, pairs with
+    the swissPairings() database function like tournament.swissPairings().
+    """
+    async with connect() as (db, cursor):
+        if server:
+            await cursor.execute(database._SERVER_PAIRINGS_SQL, (tournament,))
+            return await cursor.fetchall()
+        return await _swissPairings(cursor, tournament)
+
+
+async def invalidatePairings(tournament=None):
+    """Drop tournament.py's cached swissPairings() of a tournament, or of all.
+
+    The coroutines of this module do not cache pairings; see
+    tournament.invalidatePairings().
+    """
+    database.invalidatePairings(tournament)
+
+
+async def _swissPairings(cursor, tournament):
+    standings = await _standings(cursor, tournament, False)
+    history = await _history(cursor, tournament)
+    ratings = None
+    if not (history.opponents or history.byes):
+        await cursor.execute(database._SEED_RATINGS_SQL,
+                             ([row[0] for row in standings],))
+        ratings = dict(await cursor.fetchall())
+    return database._pairings(standings, history, ratings)
+
+
+async def lastRound(tournament):
+    """Returns the last round reported in a tournament, 0 before any."""
+    async with connect() as (db, cursor):
+        await cursor.execute(database._LAST_ROUND_SQL,
+                             {'tournament': tournament})
+        return (await cursor.fetchone())[0]
+
+
+async def pairRound(tournament, round=None):
+    """Pairs a tournament's next round under its advisory lock.
+
+    Returns (round, pairings), see tournament.pairRound().
+    """
+    params = {'tournament': tournament}
+    async with connect() as (db, cursor):
+        await cursor.execute(database._LOCK_STANDING_SQL, params)
+        round = await _nextRound(cursor, tournament, round)
+        return round, await _swissPairings(cursor, tournament)
+
+
+async def reportNextRound(tournament, round, results):
+    """Report a tournament's round, unless it has already been reported.
+
+    See tournament.reportNextRound().
+    """
+    params = database._roundParams(tournament, round, results)
+    async with connect() as (db, cursor):
+        await cursor.execute(database._LOCK_STANDING_SQL, params)
+        await _nextRound(cursor, tournament, round)
+        if len(params['winners']) >= database.ANALYZE_ROUND_SIZE:
+            await cursor.execute("ANALYZE Match, Standing")
+        await cursor.execute(database._REPORT_ROUND_SQL, params)
+
+
+async def _nextRound(cursor, tournament, round):
+    await cursor.execute(database._LAST_ROUND_SQL, {'tournament': tournament})
+    next_round = (await cursor.fetchone())[0] + 1
+    if round is not None and round != next_round:
+        raise database.RoundConflict(
+            "Round %r of tournament %r is not the next round (%r)."
+            % (round, tournament, next_round))
+    return next_round
+
+
+async def scheduleRoundRobin(tournament):
+    """Schedules every player of a tournament against every other.
+
+    Returns the number of games scheduled, see tournament.scheduleRoundRobin().
+    """
+    async with connect() as (db, cursor):
+        players = await _seeds(cursor, tournament)
+        return await _writeSchedule(cursor, tournament,
+                                    bracket.roundRobin(players))
+
+
+async def scheduleElimination(tournament, double=False, top=None):
+    """Schedules a knock-out bracket seeded by the tournament's standings.
+
+    Returns the number of games scheduled, see
+    tournament.scheduleElimination().
+    """
+    async with connect() as (db, cursor):
+        seeds = (await _seeds(cursor, tournament))[:top]
+        if double:
+            schedule = bracket.doubleElimination(seeds)
+        else:
+            schedule = bracket.singleElimination(seeds)
+        return await _writeSchedule(cursor, tournament, schedule)
+
+
+async def _seeds(cursor, tournament):
+    await cursor.execute(database._STANDINGS_SQL, {'tournament': tournament})
+    return [row[0] for row in await cursor.fetchall()]
+
+
+async def _writeSchedule(cursor, tournament, schedule):
+    await cursor.execute(database._LAST_ROUND_SQL, {'tournament': tournament})
+    first_round = (await cursor.fetchone())[0]
+    await cursor.execute(database._DELETE_FIXTURES_SQL, (tournament,))
+    async with cursor.copy(database._COPY_FIXTURES_SQL) as copy:
+        for chunk in database._fixtureLines(tournament, schedule,
+                                            first_round):
+            await copy.write(chunk)
+    return len(schedule.round)
+
+
+async def roundFixtures(tournament, round=None):
+    """Returns the scheduled games of a round ready to be played.
+
+    Same rows as tournament.roundFixtures().
+    """
+    async with connect() as (db, cursor):
+        if round is None:
+            await cursor.execute(database._LAST_ROUND_SQL,
+                                 {'tournament': tournament})
+            round = (await cursor.fetchone())[0] + 1
+        await cursor.execute(database._ROUND_FIXTURES_SQL,
+                             {'tournament': tournament, 'round': round})
+        games = await cursor.fetchall()
+        if not any(fed for (game, id1, name1, id2, name2, fed) in games):
+            return [(id1, name1, id2, name2)
+                    for (game, id1, name1, id2, name2, fed) in games]
+
+        await cursor.execute(database._FIXTURES_SQL, (tournament,))
+        fixtures = await cursor.fetchall()
+        await cursor.execute(database._RESULTS_SQL, (tournament,))
+        pairs = database._fixturePairs(games, fixtures,
+                                       await cursor.fetchall())
+        await cursor.execute(database._PLAYER_NAMES_SQL,
+                             ([player for pair in pairs for player in pair],))
+        names = dict(await cursor.fetchall())
+    return [(id1, names[id1], id2 or None, names.get(id2))
+            for id1, id2 in pairs]
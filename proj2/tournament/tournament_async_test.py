@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+#
+# Test cases for tournament_async.py (Python 3)
+
+import asyncio
+
+import psycopg
+
+import tournament
+import tournament_async
+
+
+async def testAsyncMatchesSync():
+    await tournament_async.deleteMatches()
+    await tournament_async.deletePlayers()
+    await tournament_async.deleteTournaments()
+    t = await tournament_async.registerTournament("U.S. Open")
+    await tournament_async.registerPlayers(["Ann", "Bob", "Cid", "Dee"], t)
+    await tournament_async.registerPlayer("Eve", t)
+    if await tournament_async.countPlayers() != 5:
+        raise ValueError("Async registration should commit every player.")
+    for round in range(1, 4):
+        pairings = await tournament_async.swissPairings(t)
+        if pairings != tournament.swissPairings(t):
+            raise ValueError("Async pairings should match the sync ones.")
+        await tournament_async.reportRound(t, round, [
+            (id1, id2, id1 if id2 is None or id1 < id2 else id2)
+            for (id1, n1, id2, n2) in pairings])
+    standings = await tournament_async.playerStandings(t, tiebreaks=True)
+    if standings != tournament.playerStandings(t, tiebreaks=True):
+        raise ValueError("Async standings should match the sync ones.")
+    if await tournament_async.checkStandings(t):
+        raise ValueError("Async reports should keep Standing consistent.")
+    print("1. Async functions return the same results as tournament.py.")
+
+
+async def testConcurrentTournaments(count=50):
+    await tournament_async.deleteMatches()
+    await tournament_async.deletePlayers()
+    await tournament_async.deleteTournaments()
+
+    async def play(number):
+        t = await tournament_async.registerTournament("Open %d" % number)
+        await tournament_async.registerPlayers(
+            ["Player %d.%d" % (number, i) for i in range(8)], t)
+        for round in range(1, 4):
+            pairings = await tournament_async.swissPairings(t)
+            await asyncio.gather(*[
+                tournament_async.reportMatch(id1, id2, id1, round, t)
+                for (id1, n1, id2, n2) in pairings])
+        return t
+
+    tournaments = await asyncio.gather(*[play(i) for i in range(count)])
+    for t in tournaments:
+        standings = await tournament_async.playerStandings(t)
+        if len(standings) != 8 or any(row[3] != 3 for row in standings):
+            raise ValueError("Every entrant should have played 3 matches.")
+        if await tournament_async.checkStandings(t):
+            raise ValueError("Concurrent reports should keep Standing "
+                             "consistent.")
+    print("2. Many tournaments can report and pair concurrently.")
+
+
+async def testFailedQuery():
+    try:
+        async with tournament_async.connect() as (db, cursor):
+            await cursor.execute("SELECT no_such_column FROM Player")
+    except psycopg.errors.UndefinedColumn:
+        pass
+    if await tournament_async.countPlayers() != 400:
+        raise ValueError("A failed call should not poison the next checkout.")
+    await tournament_async.closePool()
+    if await tournament_async.countPlayers() != 400:
+        raise ValueError("connect() should reopen the pool after closePool().")
+    print("3. Pooled async connections survive failed queries.")
+
+
+async def testStandingsAt():
+    await tournament_async.deleteMatches()
+    await tournament_async.deletePlayers()
+    await tournament_async.deleteTournaments()
+    t = await tournament_async.registerTournament("Replay Open")
+    await tournament_async.registerPlayers(
+        ["Player %d" % i for i in range(8)], t)
+    history = []
+    for round in range(1, 9):
+        pairings = await tournament_async.swissPairings(t)
+        await tournament_async.reportRound(t, round, [
+            (id1, id2, min(id1, id2)) for (id1, n1, id2, n2) in pairings])
+        history.append(await tournament_async.playerStandings(t))
+    for round in range(1, 9):
+        if await tournament_async.standingsAt(t, round) != \
+                history[round - 1]:
+            raise ValueError("standingsAt() should replay round %d." % round)
+    async with tournament_async.connect() as (db, cursor):
+        await cursor.execute("SELECT round FROM Snapshot "
+                             "WHERE tournament = %s ORDER BY round", (t,))
+        if await cursor.fetchall() != [(4,), (8,)]:
+            raise ValueError("standingsAt() should snapshot every 4 rounds.")
+    if tournament.standingsAt(t, 6) != history[5]:
+        raise ValueError("Async snapshots should be readable by "
+                         "tournament.py.")
+    print("4. Async standingsAt() replays the log from its snapshots.")
+
+
+async def testSchedules():
+    await tournament_async.deleteMatches()
+    await tournament_async.deletePlayers()
+    await tournament_async.deleteTournaments()
+    t = await tournament_async.registerTournament("Round Robin")
+    await tournament_async.registerPlayers(
+        ["Player %d" % i for i in range(7)], t)
+    if await tournament_async.scheduleRoundRobin(t) != 28:
+        raise ValueError("A round robin of 7 should have 7 rounds of 4.")
+    for round in range(1, 8):
+        fixtures = await tournament_async.roundFixtures(t)
+        if fixtures != tournament.roundFixtures(t):
+            raise ValueError("Async fixtures should match the sync ones.")
+        await tournament_async.reportRound(t, round, [
+            (id1, id2, id1) for (id1, n1, id2, n2) in fixtures])
+    if await tournament_async.roundFixtures(t):
+        raise ValueError("A finished round robin should have no fixtures.")
+
+    t = await tournament_async.registerTournament("Knock-out")
+    await tournament_async.registerPlayers(
+        ["Player %d" % i for i in range(6)], t)
+    if await tournament_async.scheduleElimination(t, double=True) != 14:
+        raise ValueError("A double elimination of 6 should have 14 games.")
+    round = 0
+    while True:
+        fixtures = await tournament_async.roundFixtures(t)
+        if fixtures != tournament.roundFixtures(t):
+            raise ValueError("Async bracket fixtures should match the sync "
+                             "ones.")
+        if not fixtures:
+            break
+        round += 1
+        await tournament_async.reportRound(t, round, [
+            (id1, id2, id1 if id2 is None else min(id1, id2))
+            for (id1, n1, id2, n2) in fixtures])
+    if round < 5:
+        raise ValueError("A double elimination of 6 should take 5 rounds.")
+    print("5. Async schedules and fixtures match tournament.py.")
+
+
+async def testInvalidatePairings():
+    t = await tournament_async.registerTournament("Cached Open")
+    await tournament_async.registerPlayers(["Ann", "Bob"], t)
+    tournament.swissPairings(t)
+    if t not in [key[0] for key in tournament._pairings_cache]:
+        raise ValueError("tournament.swissPairings() should cache pairings.")
+    await tournament_async.invalidatePairings(t)
+    if t in [key[0] for key in tournament._pairings_cache]:
+        raise ValueError("invalidatePairings() should drop the cached "
+                         "pairings.")
+    print("6. Async invalidatePairings() drops tournament.py's cache.")
+
+
+async def main():
+    try:
+        await testAsyncMatchesSync()
+        await testConcurrentTournaments()
+        await testFailedQuery()
+        await testStandingsAt()
+        await testSchedules()
+        await testInvalidatePairings()
+    finally:
+        await tournament_async.closePool()
+        tournament.closePool()
+    print("Success!  All tests pass!")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
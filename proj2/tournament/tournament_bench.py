@@ -0,0 +1,624 @@
+#!/usr/bin/env python
+#
+# tournament_bench.py -- timing benchmarks for tournament.py
+#
+# Run against a scratch database, every benchmark wipes the tournament tables.
+#
+# The 'suite' benchmark plays synthetic tournaments of each --sizes, records
+# wall time and query counts per call to a JSON history file and flags
+# regressions against the previous run:
+#
+#   python tournament_bench.py suite --sizes 1000 10000 100000
+#
+
+import argparse
+import json
+import multiprocessing.pool
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+import numpy
+import psycopg2
+import psycopg2.extensions
+
+import bracket
+import coordinator
+import rating
+import tiebreak
+import tournament
+import tournament_memory
+
+
+def setupTournament(num_players):
+    """Wipe the database and register num_players players in a new tournament.
+
+    Returns the (tournament id, list of player ids) of the new tournament.
+    """
+    tournament.deleteMatches()
+    tournament.deletePlayers()
+    tournament.deleteTournaments()
+    t = tournament.registerTournament("Benchmark Open")
+    with tournament.connect() as (db, cursor):
+        cursor.execute("INSERT INTO Player (full_name) "
+                       "SELECT 'Player ' || g FROM generate_series(1, %s) g "
+                       "RETURNING id", (num_players,))
+        player_ids = [row[0] for row in cursor.fetchall()]
+    return t, player_ids
+
+
+def timed(fn, calls):
+    """Run fn() for each of the given argument tuples, return elapsed seconds."""
+    start = time.time()
+    for args in calls:
+        fn(*args)
+    return time.time() - start
+
+
+def unpooledReportMatch(player1, player2, winner, round, t):
+    """reportMatch() without the pool: the same SQL on a new connection."""
+    db = psycopg2.connect(tournament.DSN)
+    try:
+        cursor = db.cursor()
+        cursor.execute(tournament._REPORT_MATCH_SQL, tournament._matchParams(
+            player1, player2, winner, round, t))
+        db.commit()
+    finally:
+        db.close()
+
+
+def benchmarkPool(num_players):
+    """Time one full round of reportMatch() with and without the pool.
+
+    Both run the same statements from the same state (no matches played),
+    so the difference is the cost of opening a connection per call.
+    """
+    t, player_ids = setupTournament(num_players)
+    calls = [(p1, p2, p1, 1, t)
+             for p1, p2 in zip(player_ids[0::2], player_ids[1::2])]
+
+    tournament.closePool()
+    before = timed(unpooledReportMatch, calls)
+    tournament.deleteMatches()
+    after = timed(tournament.reportMatch, calls)
+
+    print("%d players, %d matches reported" % (num_players, len(calls)))
+    print("  connection per call: %8.3fs  %6.3f ms/match"
+          % (before, 1000.0 * before / len(calls)))
+    print("  pooled connections:  %8.3fs  %6.3f ms/match"
+          % (after, 1000.0 * after / len(calls)))
+    print("  speedup:             %8.1fx" % (before / after))
+
+
+def benchmarkReportRound(num_players):
+    """Time reporting a round match by match against one reportRound()."""
+    t, player_ids = setupTournament(num_players)
+    results = [(p1, p2, p1)
+               for p1, p2 in zip(player_ids[0::2], player_ids[1::2])]
+
+    per_match = timed(tournament.reportMatch,
+                      [(p1, p2, w, 1, t) for p1, p2, w in results])
+    tournament.deleteTourMatches(t)
+    per_round = tournament.reportRound(t, 1, results)
+
+    print("%d players, %d matches reported" % (num_players, len(results)))
+    print("  reportMatch per match: %8.3fs" % per_match)
+    print("  reportRound:           %8.3fs" % per_round)
+    print("  speedup:               %8.1fx" % (per_match / per_round))
+
+
+def benchmarkPairing(num_players, rounds=5):
+    """Time swissPairings() over several rounds with random results."""
+    t, player_ids = setupTournament(num_players)
+    rng = random.Random(num_players)
+
+    print("%d players, swissPairings() per round, Python and database "
+          "function" % num_players)
+    for round in range(1, rounds + 1):
+        start = time.time()
+        pairings = tournament.swissPairings(t)
+        elapsed = time.time() - start
+        start = time.time()
+        tournament.swissPairings(t, server=True)
+        server = time.time() - start
+        print("  round %d: %8.3fs  %8.3fs" % (round, elapsed, server))
+        tournament.reportRound(t, round, [
+            (id1, id2, id1 if id2 is None else rng.choice((id1, id2)))
+            for (id1, name1, id2, name2) in pairings])
+
+
+def benchmarkTieBreaks(num_players, num_matches=100000):
+    """Time tiebreak.tieBreaks() on a synthetic match list (no database)."""
+    rng = numpy.random.RandomState(num_players)
+    player_ids = numpy.arange(1, num_players + 1)
+    player1 = rng.randint(1, num_players + 1, num_matches)
+    player2 = (player1 + rng.randint(1, num_players, num_matches) - 1) \
+        % num_players + 1
+    winner = numpy.where(rng.rand(num_matches) < 0.5, player1, player2)
+    wins = numpy.bincount(winner, minlength=num_players + 1)[1:]
+    matches = (numpy.bincount(player1, minlength=num_players + 1) +
+               numpy.bincount(player2, minlength=num_players + 1))[1:]
+
+    start = time.time()
+    scores = tiebreak.tieBreaks(player_ids, wins, matches,
+                                player1, player2, winner)
+    tiebreak.rankOrder(player_ids, wins, *scores)
+    elapsed = time.time() - start
+
+    print("%d players, %d matches" % (num_players, num_matches))
+    print("  tie-breaks and ranking: %8.3fs" % elapsed)
+
+
+def benchmarkRatings(num_players, num_matches=1000000, repeat=3):
+    """Time rating.rateMatches() on a synthetic match list (no database).
+
+    The matches are played in rounds, each player once per round, and are
+    rated both with rateMatches() and one match at a time in Python.  Each
+    is timed `repeat` times and the fastest run is reported.
+    """
+    rng = numpy.random.RandomState(num_players)
+    player_ids = numpy.arange(1, num_players + 1)
+    rounds = max(num_matches // (num_players // 2), 1)
+    pairs = numpy.concatenate([rng.permutation(player_ids)
+                               for i in range(rounds)]).reshape(-1, 2)
+    player1, player2 = pairs[:, 0], pairs[:, 1]
+    winner = numpy.where(rng.rand(len(pairs)) < 0.5, player1, player2)
+
+    def matchByMatch():
+        ratings = dict((player, rating.INITIAL_RATING)
+                       for player in player_ids.tolist())
+        for a, b, w in zip(player1.tolist(), player2.tolist(),
+                           winner.tolist()):
+            change = rating.ELO_K * ((w == a) - 1.0 / (
+                1.0 + 10.0 ** ((ratings[b] - ratings[a]) / 400.0)))
+            ratings[a] += change
+            ratings[b] -= change
+
+    vectorized = min(
+        measure(rating.rateMatches, player_ids, player1, player2,
+                winner)[1]['seconds'] for i in range(repeat))
+    sequential = min(measure(matchByMatch)[1]['seconds']
+                     for i in range(repeat))
+
+    print("%d players, %d matches in %d rounds"
+          % (num_players, len(pairs), rounds))
+    print("  match by match:  %8.3fs" % sequential)
+    print("  rateMatches:     %8.3fs" % vectorized)
+    print("  speedup:         %8.1fx" % (sequential / vectorized))
+
+
+def benchmarkMemory(num_players, rounds=7):
+    """Time a whole tournament run on the in-memory backend."""
+    memory = tournament_memory
+    memory.deleteMatches()
+    memory.deletePlayers()
+    memory.deleteTournaments()
+    memory.registerPlayers("Player %d" % i for i in range(num_players))
+    t = memory.registerTournament("Benchmark Open")
+    rng = random.Random(num_players)
+
+    start = time.time()
+    for round in range(1, rounds + 1):
+        memory.reportRound(t, round, [
+            (id1, id2, id1 if id2 is None else rng.choice((id1, id2)))
+            for (id1, name1, id2, name2) in memory.swissPairings(t)])
+    memory.playerStandings(t, tiebreaks=True)
+    elapsed = time.time() - start
+
+    print("%d players, %d rounds in memory" % (num_players, rounds))
+    print("  pair, report and rank: %8.3fs  %6.3fs/round"
+          % (elapsed, elapsed / rounds))
+
+
+def setupTournaments(count, field):
+    """Wipe the database and register count tournaments of field entrants.
+
+    Returns the list of the new tournament ids.
+    """
+    tournament.deleteMatches()
+    tournament.deletePlayers()
+    tournament.deleteTournaments()
+    with tournament.connect() as (db, cursor):
+        cursor.execute("INSERT INTO Tournament (description) "
+                       "SELECT 'Kiosk Open ' || g FROM generate_series(1, %s) g "
+                       "RETURNING id", (count,))
+        tournament_ids = sorted(row[0] for row in cursor.fetchall())
+        cursor.execute("INSERT INTO Player (full_name) "
+                       "SELECT 'Player ' || g FROM generate_series(1, %s) g "
+                       "RETURNING id", (count * field,))
+        player_ids = sorted(row[0] for row in cursor.fetchall())
+        cursor.execute("INSERT INTO TournamentPlayer (tournament, player) "
+                       "SELECT t, p FROM unnest(%s::integer[], %s::integer[]) "
+                       "AS e(t, p)",
+                       ([t for t in tournament_ids for i in range(field)],
+                        player_ids))
+    return tournament_ids
+
+
+def playKiosk(t, rounds):
+    """Pair and report a tournament's rounds match by match (sync API)."""
+    for round in range(1, rounds + 1):
+        for id1, name1, id2, name2 in tournament.swissPairings(t):
+            tournament.reportMatch(id1, id2, id1, round, t)
+
+
+def benchmarkConcurrency(num_players, field=16, rounds=4):
+    """Play many small tournaments at once, threaded sync against asyncio.
+
+    num_players are split into tournaments of `field` entrants, all played
+    at the same time: with a thread pool over tournament.py, then as
+    coroutines on one event loop over tournament_async.py (Python 3).
+    """
+    count = max(num_players // field, 1)
+    calls = count * rounds * (1 + field // 2)
+    print("%d tournaments of %d players, %d rounds, %d calls"
+          % (count, field, rounds, calls))
+
+    tournament_ids = setupTournaments(count, field)
+    threads = multiprocessing.pool.ThreadPool(4 * tournament.POOL_MAX_CONN)
+    start = time.time()
+    try:
+        threads.map(lambda t: playKiosk(t, rounds), tournament_ids)
+    finally:
+        threads.close()
+        threads.join()
+    threaded = time.time() - start
+    print("  threaded sync (%d threads, %d connections): %8.3fs  %8.0f calls/s"
+          % (4 * tournament.POOL_MAX_CONN, tournament.POOL_MAX_CONN,
+             threaded, calls / threaded))
+
+    if sys.version_info < (3,):
+        print("  asyncio: requires Python 3")
+        return
+    import tournament_async
+    import tournament_bench_async
+
+    tournament.deleteMatches()
+    concurrent = tournament_bench_async.playKiosks(tournament_ids, rounds)
+    print("  asyncio (%d connections):                %8.3fs  %8.0f calls/s"
+          % (tournament_async.POOL_MAX_CONN, concurrent, calls / concurrent))
+    print("  speedup:                                 %8.1fx"
+          % (threaded / concurrent))
+
+
+def benchmarkCoordinator(num_players, count=200, rounds=4):
+    """Play `count` tournaments at once with coordinator.playRounds().
+
+    num_players are split between the tournaments.  The rounds are played
+    with one worker, then with coordinator.WORKERS, then by two coordinators
+    racing over the same tournaments, whose conflicting rounds are skipped.
+    """
+    field = max(num_players // count, 2)
+    matches = count * rounds * (field // 2)
+    print("%d tournaments of %d players, %d rounds, %d matches"
+          % (count, field, rounds, matches))
+    tournament_ids = setupTournaments(count, field)
+    for label, workers, racers in (("1 worker", 1, 1),
+                                   ("%d workers" % coordinator.WORKERS,
+                                    coordinator.WORKERS, 1),
+                                   ("2 coordinators", coordinator.WORKERS, 2)):
+        tournament.deleteMatches()
+        threads = multiprocessing.pool.ThreadPool(racers)
+        start = time.time()
+        try:
+            played = threads.map(
+                lambda i: coordinator.playRounds(tournament_ids, rounds,
+                                                 workers=workers),
+                range(racers))
+        finally:
+            threads.close()
+            threads.join()
+        elapsed = time.time() - start
+        reported = sum(sum(counts.values()) for counts in played)
+        if reported != count * rounds:
+            raise ValueError("%d rounds reported instead of %d."
+                             % (reported, count * rounds))
+        print("  %-15s %8.3fs  %8.1f rounds/s  %8.0f matches/s"
+              % (label + ':', elapsed, reported / elapsed, matches / elapsed))
+
+
+def benchmarkSchedules(num_players, round_robin_players=1000):
+    """Generate and store elimination and round-robin schedules.
+
+    The brackets seed num_players players; the round robin, whose size
+    grows with the square of the field, at most round_robin_players.
+    """
+    for label, generate, options, field in (
+            ("single elimination", bracket.singleElimination, {},
+             num_players),
+            ("double elimination", bracket.doubleElimination,
+             {'double': True}, num_players),
+            ("round robin", bracket.roundRobin, None,
+             min(num_players, round_robin_players))):
+        t, player_ids = setupTournament(field)
+        tournament.enterTournament(t, player_ids)
+        start = time.time()
+        games = len(generate(numpy.array(player_ids)).round)
+        generated = time.time() - start
+        if options is None:
+            stored = timed(tournament.scheduleRoundRobin, [(t,)])
+        else:
+            stored = timed(lambda: tournament.scheduleElimination(
+                t, **options), [()])
+        print("%-18s %6d players %9d games: generate %8.2fms, store %8.3fs"
+              % (label, field, games, generated * 1000, stored))
+
+
+def benchmarkHTTP(num_players, clients=500, seconds=10.0):
+    """Load-test tournament_server.py with many concurrent clients.
+
+    The server runs in its own process on a free local port.  Each client
+    thread keeps one connection open and asks for the standings of the
+    same tournament as fast as it can for `seconds`; the server's /stats
+    tell how many requests were served by another request's query.
+    """
+    t, player_ids = setupTournament(num_players)
+    tournament.enterTournament(t, player_ids)
+    tournament.reportRound(t, 1, [
+        (id1, id2, id1)
+        for (id1, n1, id2, n2) in tournament.swissPairings(t)])
+    tournament.closePool()
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    server = subprocess.Popen([sys.executable, 'tournament_server.py',
+                               '--host', '127.0.0.1', '--port', str(port)],
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        _waitForServer(port)
+        before = _getJSON(port, '/stats')
+        counts = []
+        deadline = time.time() + seconds
+
+        def client(i):
+            connection = httplib.HTTPConnection('127.0.0.1', port,
+                                                timeout=60)
+            requests = 0
+            while time.time() < deadline:
+                connection.request('GET', '/tournaments/%d/standings' % t)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    raise ValueError("HTTP %d" % response.status)
+                requests += 1
+            connection.close()
+            counts.append(requests)
+
+        threads = [threading.Thread(target=client, args=(i,))
+                   for i in range(clients)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        after = _getJSON(port, '/stats')
+    finally:
+        server.terminate()
+        server.wait()
+    requests = sum(counts)
+    queries = after['calls'] - before['calls']
+    print("%d clients, %d players: %d requests in %.1fs, %.0f requests/s"
+          % (clients, num_players, requests, elapsed, requests / elapsed))
+    print("  %d standings queries, %.1f requests per query"
+          % (queries, requests / float(max(queries, 1))))
+
+
+def _getJSON(port, path):
+    connection = httplib.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        connection.request('GET', path)
+        return json.loads(connection.getresponse().read().decode('utf-8'))
+    finally:
+        connection.close()
+
+
+def _waitForServer(port, timeout=10.0):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return _getJSON(port, '/stats')
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Cursor that counts the statements sent to the server."""
+    queries = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.queries += 1
+        return super(CountingCursor, self).execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        CountingCursor.queries += 1
+        return super(CountingCursor, self).executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        CountingCursor.queries += 1
+        return super(CountingCursor, self).copy_expert(sql, file, size)
+
+
+def measure(fn, *args):
+    """Run fn(*args); return (result, {'seconds': ..., 'queries': ...})."""
+    queries = CountingCursor.queries
+    start = time.time()
+    result = fn(*args)
+    return result, {'seconds': time.time() - start,
+                    'queries': CountingCursor.queries - queries}
+
+
+def perCall(fn, calls):
+    """Measure fn over a list of argument tuples, averaged per call."""
+    result, stats = measure(timed, fn, calls)
+    return dict((key, float(value) / max(len(calls), 1))
+                for key, value in stats.items())
+
+
+def syntheticNames(num_players, rng):
+    """Generate num_players random player names."""
+    first = ["Ann", "Bob", "Cid", "Dee", "Eve", "Fay", "Gus", "Hal", "Ivy"]
+    last = ["Smith", "Jones", "Brown", "Green", "Lopez", "Ng", "Patel", "Kim"]
+    for i in range(num_players):
+        yield "%s %s %d" % (rng.choice(first), rng.choice(last), i)
+
+
+def syntheticResults(pairings, rng):
+    """Decide a round of pairings at random, the bye counting as a win."""
+    return [(id1, id2, id1 if id2 is None else rng.choice((id1, id2)))
+            for (id1, name1, id2, name2) in pairings]
+
+
+def measureTournament(num_players, rounds, sample, seed=0):
+    """Play a synthetic tournament and measure every API call.
+
+    registerPlayer and reportMatch are timed on the first `sample` players
+    and matches (per call averages); the rest are added in bulk.
+    playerStandings, swissPairings and reportRound are timed every round.
+
+    Returns:
+      A dict of metric name to {'seconds': ..., 'queries': ...}.
+    """
+    rng = random.Random(seed)
+    metrics = {}
+    tournament.deleteMatches()
+    tournament.deletePlayers()
+    tournament.deleteTournaments()
+    t = tournament.registerTournament("Synthetic Open")
+
+    names = syntheticNames(num_players, rng)
+    sampled = min(sample, num_players)
+    metrics['registerPlayer'] = perCall(
+        tournament.registerPlayer, [(next(names),) for i in range(sampled)])
+    ids, metrics['registerPlayers'] = measure(tournament.registerPlayers,
+                                              names)
+
+    for round in range(1, rounds + 1):
+        prefix = 'round%d.' % round
+        standings, metrics[prefix + 'playerStandings'] = measure(
+            tournament.playerStandings, t)
+        pairings, metrics[prefix + 'swissPairings'] = measure(
+            tournament.swissPairings, t)
+        results = syntheticResults(pairings, rng)
+        metrics[prefix + 'reportMatch'] = perCall(
+            tournament.reportMatch,
+            [(p1, p2, w, round, t) for p1, p2, w in results[:sample]])
+        elapsed, metrics[prefix + 'reportRound'] = measure(
+            tournament.reportRound, t, round, results[sample:])
+    return metrics
+
+
+def findRegressions(previous, current, threshold, noise=0.001):
+    """Compare two runs' metrics; return the (name, old, new) regressions.
+
+    A metric regresses when it is more than `threshold` (a fraction) slower
+    than in the previous run, ignoring differences below `noise` seconds.
+    """
+    regressions = []
+    for size, metrics in sorted(current.items()):
+        for name, stats in sorted(metrics.items()):
+            old = previous.get(size, {}).get(name)
+            if old is None:
+                continue
+            if (stats['seconds'] > old['seconds'] * (1 + threshold) and
+                    stats['seconds'] - old['seconds'] > noise):
+                regressions.append(("%s/%s" % (size, name), old['seconds'],
+                                    stats['seconds']))
+    return regressions
+
+
+def runSuite(sizes, rounds, sample, history_path, threshold):
+    """Run the benchmark suite, append it to the history file.
+
+    Returns the list of regressions against the previous run.
+    """
+    tournament.CURSOR_FACTORY = CountingCursor
+
+    current = {}
+    for num_players in sizes:
+        metrics = measureTournament(num_players, rounds, sample)
+        current[str(num_players)] = metrics
+        print("%d players" % num_players)
+        for name, stats in sorted(metrics.items()):
+            print("  %-28s %10.4fs %8.1f queries"
+                  % (name, stats['seconds'], stats['queries']))
+
+    history = []
+    if os.path.exists(history_path):
+        with open(history_path) as history_file:
+            history = json.load(history_file)
+    regressions = []
+    if history:
+        regressions = findRegressions(history[-1]['results'], current,
+                                      threshold)
+    history.append({'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'python': platform.python_version(),
+                    'rounds': rounds, 'sample': sample,
+                    'results': current})
+    with open(history_path, 'w') as history_file:
+        json.dump(history, history_file, indent=1, sort_keys=True)
+
+    for name, old, new in regressions:
+        print("REGRESSION %s: %.4fs -> %.4fs (+%.0f%%)"
+              % (name, old, new, 100 * (new - old) / old))
+    return regressions
+
+
+BENCHMARKS = {
+    'pool': benchmarkPool,
+    'round': benchmarkReportRound,
+    'pairing': benchmarkPairing,
+    'tiebreak': benchmarkTieBreaks,
+    'ratings': benchmarkRatings,
+    'memory': benchmarkMemory,
+    'concurrency': benchmarkConcurrency,
+    'coordinator': benchmarkCoordinator,
+    'schedule': benchmarkSchedules,
+    'http': benchmarkHTTP,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmarks", nargs="*",
+                        choices=sorted(BENCHMARKS) + ['suite'],
+                        default=sorted(BENCHMARKS),
+                        help="benchmarks to run (default: all but suite)")
+    parser.add_argument("--players", type=int, default=10000,
+                        help="number of players in the benchmark tournament")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1000, 10000, 100000],
+                        help="suite: tournament sizes to play")
+    parser.add_argument("--rounds", type=int, default=5,
+                        help="suite: rounds per tournament")
+    parser.add_argument("--sample", type=int, default=500,
+                        help="suite: single calls timed per operation")
+    parser.add_argument("--history", default="tournament_bench_history.json",
+                        help="suite: JSON file the results are appended to")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="suite: slowdown (fraction) reported as a "
+                             "regression")
+    args = parser.parse_args()
+    regressions = []
+    for name in args.benchmarks:
+        if name == 'suite':
+            regressions = runSuite(args.sizes, args.rounds, args.sample,
+                                   args.history, args.threshold)
+        else:
+            BENCHMARKS[name](args.players)
+    tournament.closePool()
+    sys.exit(1 if regressions else 0)
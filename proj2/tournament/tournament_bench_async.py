@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+#
+# tournament_bench_async.py -- asyncio part of tournament_bench.py
+#
+# Kept apart so that tournament_bench.py still runs on Python 2.
+#
+
+import asyncio
+import time
+
+import tournament_async
+
+
+async def playKiosk(t, rounds):
+    """Pair and report a tournament's rounds match by match (asyncio API)."""
+    for round in range(1, rounds + 1):
+        for id1, name1, id2, name2 in await tournament_async.swissPairings(t):
+            await tournament_async.reportMatch(id1, id2, id1, round, t)
+
+
+async def _playAll(tournament_ids, rounds):
+    try:
+        await tournament_async.getPool()
+        start = time.time()
+        await asyncio.gather(*[playKiosk(t, rounds) for t in tournament_ids])
+        return time.time() - start
+    finally:
+        await tournament_async.closePool()
+
+
+def playKiosks(tournament_ids, rounds):
+    """Play every tournament concurrently on a new event loop.
+
+    Returns the elapsed wall-clock time in seconds.
+    """
+    return asyncio.run(_playAll(tournament_ids, rounds))
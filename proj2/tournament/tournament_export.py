@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#
+# tournament_export.py -- streaming export of the tournament database
+#
+# Writes the matches, standings or next-round pairings of every tournament
+# (or of one) as CSV or newline-delimited JSON:
+#
+#   python tournament_export.py matches --format ndjson --output season.json
+#
+# Rows are read through a server-side (named) cursor EXPORT_BATCH_SIZE at a
+# time and written as they arrive, so memory use does not depend on the size
+# of the tables.  The row count and rows/second go to stderr.
+#
+
+import argparse
+import csv
+import json
+import sys
+import time
+
+import tournament
+
+# Rows fetched from the server per round trip
+EXPORT_BATCH_SIZE = 10000
+
+# Matches in play order, read along matchRoundIdx
+_MATCHES_SQL = """
+SELECT id, tournament, round, player1, player2, winner FROM Match
+ WHERE %(tournament)s IS NULL OR tournament = %(tournament)s
+ ORDER BY tournament, round, id
+"""
+
+# Standings of each tournament in ranking order, tournament by tournament
+_STANDINGS_SQL = """
+SELECT t.id, s.rank, s.id, s.full_name, s.wins, s.matches, s.opponent_wins
+  FROM (SELECT id FROM Tournament
+         WHERE %(tournament)s IS NULL OR id = %(tournament)s
+         ORDER BY id) t
+ CROSS JOIN LATERAL playerStandings(t.id) WITH ORDINALITY
+       AS s(id, full_name, wins, matches, opponent_wins, rank)
+"""
+
+_TOURNAMENTS_SQL = """
+SELECT id FROM Tournament
+ WHERE %(tournament)s IS NULL OR id = %(tournament)s
+ ORDER BY id
+"""
+
+COLUMNS = {
+    'matches': ('id', 'tournament', 'round', 'player1', 'player2', 'winner'),
+    'standings': ('tournament', 'rank', 'id', 'name', 'wins', 'matches',
+                  'opponent_wins'),
+    'pairings': ('tournament', 'table', 'id1', 'name1', 'id2', 'name2'),
+}
+
+
+def streamQuery(sql, params, batch_size=None):
+    """Yields the rows of a query read through a server-side cursor.
+
+    The rows are fetched batch_size (default EXPORT_BATCH_SIZE) at a time;
+    the pooled connection is held until the generator is exhausted or
+    closed.
+    """
+    with tournament.connect() as (db, cursor):
+        stream = db.cursor(name='tournament_export',
+                           cursor_factory=tournament.CURSOR_FACTORY)
+        stream.itersize = batch_size or EXPORT_BATCH_SIZE
+        try:
+            stream.execute(sql, params)
+            for row in stream:
+                yield row
+        finally:
+            stream.close()
+
+
+def _pairings(t, batch_size):
+    """Yields the next-round pairings of each tournament, one at a time."""
+    for (tournament_id,) in streamQuery(_TOURNAMENTS_SQL, {'tournament': t},
+                                        batch_size):
+        pairings = tournament.swissPairings(tournament_id)
+        for table, pairing in enumerate(pairings, 1):
+            yield (tournament_id, table) + tuple(pairing)
+
+
+def streamRows(kind, t=None, batch_size=None):
+    """Yields the rows of one export, see COLUMNS for their fields.
+
+    Args:
+      kind: 'matches', 'standings' or 'pairings'.  Pairings are computed
+        with tournament.swissPairings(), so only one tournament's pairings
+        are in memory at a time.
+      t: the id of the tournament to export, or None for all of them.
+      batch_size: rows fetched per round trip (default EXPORT_BATCH_SIZE).
+    """
+    params = {'tournament': t}
+    if kind == 'matches':
+        return streamQuery(_MATCHES_SQL, params, batch_size)
+    if kind == 'standings':
+        return streamQuery(_STANDINGS_SQL, params, batch_size)
+    if kind == 'pairings':
+        return _pairings(t, batch_size)
+    raise ValueError("Unknown export %r." % (kind,))
+
+
+def export(kind, out, format='csv', t=None, batch_size=None):
+    """Streams an export to a file object.
+
+    Args:
+      kind: 'matches', 'standings' or 'pairings', see streamRows().
+      out: a text file object to write to.
+      format: 'csv' (with a header line) or 'ndjson' (one JSON object per
+        line).
+      t: the id of the tournament to export, or None for all of them.
+      batch_size: rows fetched per round trip (default EXPORT_BATCH_SIZE).
+
+    Returns:
+      A (rows, seconds) tuple: the number of rows written and the elapsed
+      wall-clock time.
+    """
+    columns = COLUMNS[kind]
+    if format == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        write = writer.writerow
+    elif format == 'ndjson':
+        def write(row):
+            out.write(json.dumps(dict(zip(columns, row)), sort_keys=True))
+            out.write('\n')
+    else:
+        raise ValueError("Unknown format %r." % (format,))
+
+    start = time.time()
+    rows = 0
+    for row in streamRows(kind, t, batch_size):
+        write(row)
+        rows += 1
+    return rows, time.time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Stream tournament matches, standings or pairings as "
+                    "CSV or newline-delimited JSON.")
+    parser.add_argument("kind", choices=sorted(COLUMNS),
+                        help="what to export")
+    parser.add_argument("--format", choices=['csv', 'ndjson'], default='csv',
+                        help="output format")
+    parser.add_argument("--tournament", type=int,
+                        help="export one tournament (default: all)")
+    parser.add_argument("--output", help="output file (default: stdout)")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE,
+                        help="rows fetched per round trip")
+    args = parser.parse_args()
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        rows, elapsed = export(args.kind, out, args.format, args.tournament,
+                               args.batch_size)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        tournament.closePool()
+    sys.stderr.write("%d %s rows in %.2fs: %.0f rows/second\n"
+                     % (rows, args.kind, elapsed, rows / max(elapsed, 1e-9)))
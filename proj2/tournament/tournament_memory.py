@@ -0,0 +1,541 @@
+#!/usr/bin/env python
+#
+# tournament_memory.py -- in-memory Swiss-system tournament engine
+#
+# Implements the tournament.py API without a database, for simulations and
+# live front ends:
+#
+#   import tournament_memory as tournament
+#
+# Players and matches are kept in compact array columns and standings are
+# computed from them with NumPy on demand.  snapshot() saves the state to a
+# file, restore() reads it back and loadIntoDatabase() bulk-loads it into
+# the PostgreSQL tournament database.
+#
+
+import time
+from array import array
+
+import numpy
+
+import rating
+import swiss
+import tiebreak
+
+# Match column value used for the missing player 2 of a bye
+NO_PLAYER = 0
+
+# Number of rows standingsPage() and leaderboard() return by default
+STANDINGS_PAGE_SIZE = 100
+LEADERBOARD_PAGE_SIZE = 100
+
+
+# Typecode of the integer columns: 64 bits, so that _column() can read them
+# as numpy.int64 ('l' is only 32 bits on some platforms, e.g. Windows)
+_INT = 'l' if array('l').itemsize == 8 else 'q'
+
+
+class Tournament(object):
+    """A tournament, its entrants and its matches, one array column per match
+    field."""
+    __slots__ = ('id', 'description', 'player1', 'player2', 'winner', 'round',
+                 'entrants')
+
+    def __init__(self, id, description):
+        self.id = id
+        self.description = description
+        self.entrants = array(_INT)
+        self.clearMatches()
+
+    def clearMatches(self):
+        self.player1 = array(_INT)
+        self.player2 = array(_INT)
+        self.winner = array(_INT)
+        self.round = array(_INT)
+
+    def addMatch(self, player1, player2, winner, round):
+        self.player1.append(player1)
+        self.player2.append(NO_PLAYER if player2 is None else player2)
+        self.winner.append(winner)
+        self.round.append(round)
+
+
+# Player columns: ids are handed out in sequence and never reused, like the
+# SERIAL id of the database, so a player's position is its id minus the id
+# of the first registered player.
+_player_ids = array(_INT)
+_player_names = []
+_player_ratings = array('d')
+_player_games = array(_INT)
+_next_player_id = 1
+
+_tournaments = {}
+_next_tournament_id = 1
+
+
+def _column(values, dtype=numpy.int64):
+    """Returns an array column as a NumPy array (no copy)."""
+    if not values:
+        return numpy.zeros(0, dtype=dtype)
+    return numpy.frombuffer(values, dtype=dtype)
+
+
+def _tournament(tournament):
+    """Returns the Tournament record with the given id."""
+    try:
+        return _tournaments[tournament]
+    except KeyError:
+        raise ValueError("No tournament with id %r." % (tournament,))
+
+
+def _checkPlayers(*players):
+    """Raises ValueError unless every given player id is registered."""
+    first = _player_ids[0] if _player_ids else _next_player_id
+    for player in players:
+        if player is not None and not first <= player < _next_player_id:
+            raise ValueError("No player with id %r." % (player,))
+
+
+def _hasMatches():
+    return any(t.player1 for t in _tournaments.values())
+
+
+def deleteMatches():
+    """Remove all the matches (and with them every player's rating)."""
+    global _player_ratings, _player_games
+    for t in _tournaments.values():
+        t.clearMatches()
+    _player_ratings = array('d', [rating.INITIAL_RATING]) * len(_player_ids)
+    _player_games = array(_INT, [0]) * len(_player_ids)
+
+
+def deleteTourMatches(tournament):
+    """Remove all the match records in a tournament."""
+    _tournament(tournament).clearMatches()
+
+
+def deletePlayers():
+    """Remove all the player records.
+
+    Like the database, this refuses to remove players who played matches.
+    """
+    global _player_ids, _player_names, _player_ratings, _player_games
+    if _hasMatches():
+        raise ValueError("Matches must be deleted before their players.")
+    _player_ids = array(_INT)
+    _player_names = []
+    _player_ratings = array('d')
+    _player_games = array(_INT)
+
+
+def deleteTournaments():
+    """Remove all the tournaments (which must have no matches left)."""
+    if _hasMatches():
+        raise ValueError("Matches must be deleted before their tournaments.")
+    _tournaments.clear()
+
+
+def countPlayers():
+    """Returns the number of players currently registered."""
+    return len(_player_ids)
+
+
+def registerPlayer(name, tournament=None):
+    """Adds a player and returns the id assigned to the player.
+
+    If a tournament is given the player is also entered in it.
+    """
+    global _next_player_id
+    if tournament is not None:
+        _tournament(tournament)
+    player = _next_player_id
+    _next_player_id += 1
+    _player_ids.append(player)
+    _player_names.append(name)
+    _player_ratings.append(rating.INITIAL_RATING)
+    _player_games.append(0)
+    if tournament is not None:
+        enterTournament(tournament, [player])
+    return player
+
+
+def registerPlayers(names, tournament=None):
+    """Adds many players, returns their ids in input order."""
+    return [registerPlayer(name.rstrip('\r\n'), tournament) for name in names]
+
+
+def enterTournament(tournament, players):
+    """Enters registered players in a tournament.
+
+    As in the database, a tournament with entrants only ranks and pairs its
+    entrants and a tournament nobody has entered is open to every player.
+    """
+    t = _tournament(tournament)
+    players = list(players)
+    _checkPlayers(*players)
+    entered = set(t.entrants)
+    for player in players:
+        if player not in entered:
+            entered.add(player)
+            t.entrants.append(player)
+
+
+def registerTournament(description):
+    """Adds a tournament and returns the id assigned to it."""
+    global _next_tournament_id
+    tournament = _next_tournament_id
+    _next_tournament_id += 1
+    _tournaments[tournament] = Tournament(tournament, description)
+    return tournament
+
+
+def _records(t):
+    """Returns (ids, wins, matches, buchholz, sonneborn_berger, omw) arrays.
+
+    All arrays are aligned with the player columns.
+    """
+    ids = _column(_player_ids)
+    n = len(ids)
+    first = ids[0] if n else 0
+    player1 = _column(t.player1)
+    player2 = _column(t.player2)
+    winner = _column(t.winner)
+    played = player2 != NO_PLAYER
+
+    wins = numpy.bincount(winner - first, minlength=n)
+    matches = (numpy.bincount(player1 - first, minlength=n) +
+               numpy.bincount(player2[played] - first, minlength=n))
+    opponent = numpy.where(played, player2, numpy.nan)
+    scores = tiebreak.tieBreaks(ids, wins, matches, player1, opponent, winner)
+    return (ids, wins, matches) + tuple(scores)
+
+
+def playerStandings(tournament, tiebreaks=False):
+    """Returns a list of the players and their win records, sorted by wins.
+
+    Same rows and order as tournament.playerStandings().
+    """
+    t = _tournament(tournament)
+    ids, wins, matches, buchholz, sonneborn_berger, omw = _records(t)
+    if tiebreaks:
+        order = tiebreak.rankOrder(ids, wins, buchholz, sonneborn_berger, omw)
+    else:
+        order = numpy.lexsort((ids, -buchholz, -wins))
+    if t.entrants:
+        order = order[numpy.isin(ids[order], _column(t.entrants))]
+
+    ids, wins, matches = ids.tolist(), wins.tolist(), matches.tolist()
+    buchholz, sonneborn_berger = buchholz.tolist(), sonneborn_berger.tolist()
+    omw = omw.tolist()
+    standings = []
+    for i in order.tolist():
+        row = (ids[i], _player_names[i], wins[i], matches[i])
+        if tiebreaks:
+            row += (buchholz[i], sonneborn_berger[i], omw[i])
+        standings.append(row)
+    return standings
+
+
+def standingsPage(tournament, after=None, limit=STANDINGS_PAGE_SIZE):
+    """Returns one page of a tournament's standings.
+
+    Same rows as tournament.standingsPage(); the standings are ranked in
+    full and sliced.
+    """
+    standings = playerStandings(tournament)
+    start = 0
+    if after is not None:
+        start = next((i + 1 for i, row in enumerate(standings)
+                      if row[0] == after), len(standings))
+    return standings[start:start + limit]
+
+
+def topStandings(tournament, n):
+    """Returns the first n rows of playerStandings()."""
+    return standingsPage(tournament, limit=n)
+
+
+def reportMatch(player1, player2, winner, round, tournament):
+    """Report a single match between two players (player2 None for a bye)."""
+    t = _tournament(tournament)
+    _checkPlayers(player1, player2)
+    if winner is None or winner not in (player1, player2):
+        raise ValueError("Winner %r did not play in match %r vs %r."
+                         % (winner, player1, player2))
+    t.addMatch(player1, player2, winner, round)
+    _rate([player1], [player2], [winner])
+
+
+def _rate(player1, player2, winner):
+    """Applies the Elo updates of matches that have no player in common.
+
+    Byes (player2 None) are skipped, as in the database.
+    """
+    played = [k for k, player in enumerate(player2) if player is not None]
+    if not played:
+        return
+    first = _player_ids[0]
+    a = numpy.array([player1[k] for k in played], dtype=numpy.int64) - first
+    b = numpy.array([player2[k] for k in played], dtype=numpy.int64) - first
+    won = numpy.array([winner[k] == player1[k] for k in played],
+                      dtype=numpy.float64)
+    ratings = _column(_player_ratings, numpy.float64)
+    games = _column(_player_games)
+    change = rating.ELO_K * (won - rating.expectedScore(ratings[a],
+                                                        ratings[b]))
+    ratings[a] += change
+    ratings[b] -= change
+    games[a] += 1
+    games[b] += 1
+
+
+def reportRound(tournament, round, results):
+    """Report every match of a tournament round at once.
+
+    Validates the whole round before recording any of it, like
+    tournament.reportRound().  Returns the elapsed time in seconds.
+    """
+    start = time.time()
+    t = _tournament(tournament)
+    results = list(results)
+    seen = set()
+    for player1, player2, winner in results:
+        _checkPlayers(player1, player2)
+        if winner is None or winner not in (player1, player2):
+            raise ValueError("Winner %r did not play in match %r vs %r."
+                             % (winner, player1, player2))
+        for player in (player1, player2):
+            if player is None:
+                continue
+            if player in seen:
+                raise ValueError("Player %r appears more than once in "
+                                 "round %r." % (player, round))
+            seen.add(player)
+    for player1, player2, winner in results:
+        t.addMatch(player1, player2, winner, round)
+    if results:
+        _rate(*zip(*results))
+    return time.time() - start
+
+
+def rebuildStandings(tournament):
+    """Standings are always computed from the matches, nothing to rebuild."""
+    _tournament(tournament)
+
+
+def checkStandings(tournament):
+    """Standings are always computed from the matches, so always consistent."""
+    _tournament(tournament)
+    return []
+
+
+def playerRatings():
+    """Returns every player's Elo rating, highest first.
+
+    Same rows as tournament.playerRatings().
+    """
+    ratings = _player_ratings.tolist()
+    order = sorted(range(len(ratings)),
+                   key=lambda i: (-ratings[i], _player_ids[i]))
+    return [(_player_ids[i], _player_names[i], ratings[i], _player_games[i])
+            for i in order]
+
+
+def recomputeRatings():
+    """Recompute every player's Elo rating from all the matches.
+
+    The matches are replayed tournament by tournament, each in round order
+    (the order matches were reported across tournaments is not kept).
+    """
+    global _player_ratings, _player_games
+    tournaments = sorted(_tournaments.values(), key=lambda t: t.id)
+    player1, player2, winner = [], [], []
+    for t in tournaments:
+        order = numpy.argsort(_column(t.round), kind='mergesort')
+        player1.extend(_column(t.player1)[order].tolist())
+        player2.extend(_column(t.player2)[order].tolist())
+        winner.extend(_column(t.winner)[order].tolist())
+    player2 = [player or None for player in player2]
+    ratings, games = rating.rateMatches(_column(_player_ids), player1,
+                                        player2, winner)
+    _player_ratings = array('d', ratings.tolist())
+    _player_games = array(_INT, games.tolist())
+
+
+def leaderboard(after=None, limit=LEADERBOARD_PAGE_SIZE):
+    """Returns one page of the lifetime leaderboard across all tournaments.
+
+    Same rows as tournament.leaderboard(), computed from every tournament's
+    matches.
+    """
+    ids = _column(_player_ids)
+    n = len(ids)
+    first = ids[0] if n else 0
+    wins = numpy.zeros(n, dtype=numpy.int64)
+    matches = numpy.zeros(n, dtype=numpy.int64)
+    for t in _tournaments.values():
+        player2 = _column(t.player2)
+        played = player2 != NO_PLAYER
+        wins += numpy.bincount(_column(t.winner) - first, minlength=n)
+        matches += (numpy.bincount(_column(t.player1) - first, minlength=n) +
+                    numpy.bincount(player2[played] - first, minlength=n))
+    order = numpy.lexsort((ids, -wins))
+    order = order[matches[order] > 0].tolist()
+    start = 0
+    if after is not None:
+        start = next((i + 1 for i, player in enumerate(order)
+                      if _player_ids[player] == after), len(order))
+    wins, matches = wins.tolist(), matches.tolist()
+    return [(_player_ids[i], _player_names[i], wins[i], matches[i],
+             float(wins[i]) / matches[i], _player_ratings[i])
+            for i in order[start:start + limit]]
+
+
+def rebuildLeaderboard():
+    """The leaderboard is always computed from the matches, nothing to do."""
+
+
+def matchHistory(tournament):
+    """Returns the MatchHistory (opponents, colors and byes) of a tournament."""
+    t = _tournament(tournament)
+    order = numpy.argsort(_column(t.round), kind='mergesort').tolist()
+    player1, player2 = t.player1, t.player2
+    return swiss.MatchHistory((player1[i], player2[i] or None) for i in order)
+
+
+def swissPairings(tournament):
+    """Returns a list of pairs of players for the next round of a match.
+
+    Same pairing rules and rows as tournament.swissPairings().
+    """
+    standings = playerStandings(tournament)
+    history = matchHistory(tournament)
+    if not (history.opponents or history.byes):
+        # First round: seed by rating, like tournament.swissPairings()
+        first = _player_ids[0] if _player_ids else 0
+        standings = sorted(standings, key=lambda row: (
+            -row[2], -_player_ratings[row[0] - first], row[0]))
+    names = dict((row[0], row[1]) for row in standings)
+    pairs = swiss.pairRound([(row[0], row[2]) for row in standings], history)
+    return [(id1, names[id1], id2, names.get(id2)) for id1, id2 in pairs]
+
+
+def snapshot(path):
+    """Save every player, tournament and match to a NumPy .npz file.
+
+    Names and descriptions are stored as pickled object arrays, so any
+    string round-trips unchanged; only restore() snapshots you trust.
+    """
+    tournaments = sorted(_tournaments.values(), key=lambda t: t.id)
+    match_tournament = numpy.concatenate(
+        [numpy.zeros(0, dtype=numpy.int64)] +
+        [numpy.full(len(t.player1), t.id, dtype=numpy.int64)
+         for t in tournaments])
+
+    def matchColumn(field):
+        # Also used for the entrants column
+        return numpy.concatenate([numpy.zeros(0, dtype=numpy.int64)] +
+                                 [_column(getattr(t, field))
+                                  for t in tournaments])
+
+    numpy.savez_compressed(
+        path,
+        next_ids=numpy.array([_next_player_id, _next_tournament_id]),
+        player_id=_column(_player_ids),
+        player_name=numpy.array(_player_names, dtype=object),
+        player_rating=_column(_player_ratings, numpy.float64),
+        player_games=_column(_player_games),
+        tournament_id=numpy.array([t.id for t in tournaments],
+                                  dtype=numpy.int64),
+        tournament_description=numpy.array(
+            [t.description for t in tournaments], dtype=object),
+        match_tournament=match_tournament,
+        match_player1=matchColumn('player1'),
+        match_player2=matchColumn('player2'),
+        match_winner=matchColumn('winner'),
+        match_round=matchColumn('round'),
+        entrant_tournament=numpy.concatenate(
+            [numpy.zeros(0, dtype=numpy.int64)] +
+            [numpy.full(len(t.entrants), t.id, dtype=numpy.int64)
+             for t in tournaments]),
+        entrant_player=matchColumn('entrants'))
+
+
+def restore(path):
+    """Replace the current state with a snapshot saved by snapshot()."""
+    global _player_ids, _player_names, _next_player_id, _next_tournament_id
+    global _player_ratings, _player_games
+    with numpy.load(path, allow_pickle=True) as data:
+        _next_player_id, _next_tournament_id = data['next_ids'].tolist()
+        _player_ids = array(_INT, data['player_id'].tolist())
+        _player_names = data['player_name'].tolist()
+        _player_ratings = array('d', data['player_rating'].tolist())
+        _player_games = array(_INT, data['player_games'].tolist())
+
+        _tournaments.clear()
+        for tournament, description in zip(
+                data['tournament_id'].tolist(),
+                data['tournament_description'].tolist()):
+            t = Tournament(tournament, description)
+            rows = data['match_tournament'] == tournament
+            for field in ('player1', 'player2', 'winner', 'round'):
+                getattr(t, field).extend(data['match_' + field][rows].tolist())
+            entrants = data['entrant_tournament'] == tournament
+            t.entrants.extend(data['entrant_player'][entrants].tolist())
+            _tournaments[tournament] = t
+
+
+def loadIntoDatabase(path=None):
+    """Bulk-load the current state (or a snapshot file) into PostgreSQL.
+
+    Players and tournaments get new database ids; matches are copied with
+    COPY and logged, the standings of each tournament are rebuilt afterwards
+    and the database ratings and lifetime records are recomputed from its
+    whole match history.  Everything is loaded in one transaction, so a
+    failed load leaves the database as it was.
+
+    Returns:
+      A dict mapping the in-memory tournament ids to their database ids.
+    """
+    import tournament as database
+
+    if path is not None:
+        restore(path)
+    player_ids = _column(_player_ids)
+    tournament_ids = {}
+    with database.connect() as (db, cursor):
+        db_player_ids = numpy.array(
+            [0] + database._registerPlayers(cursor, _player_names, None),
+            dtype=numpy.int64)
+
+        def translate(players):
+            # Position 0 of db_player_ids keeps byes as NULL (NO_PLAYER)
+            positions = numpy.searchsorted(player_ids, players) + 1
+            return db_player_ids[numpy.where(players == NO_PLAYER, 0,
+                                             positions)]
+
+        for t in sorted(_tournaments.values(), key=lambda t: t.id):
+            db_tournament = database._registerTournament(cursor,
+                                                         t.description)
+            tournament_ids[t.id] = db_tournament
+            columns = [translate(_column(t.player1)),
+                       translate(_column(t.player2)),
+                       translate(_column(t.winner)),
+                       _column(t.round)]
+            rows = '\n'.join('%d\t%s\t%d\t%d\t%d' % (p1, p2 or '\\N', w, r,
+                                                     db_tournament)
+                             for p1, p2, w, r in zip(*[c.tolist()
+                                                       for c in columns]))
+            cursor.copy_expert("COPY Match (player1, player2, winner, round, "
+                               "tournament) FROM STDIN",
+                               database.StringIO(rows + '\n' if rows else ''))
+            cursor.execute(database._LOG_MATCHES_SQL, (db_tournament,))
+            cursor.execute(database._REBUILD_STANDINGS_SQL,
+                           {'tournament': db_tournament})
+            if t.entrants:
+                database._enter(cursor, db_tournament,
+                                translate(_column(t.entrants)).tolist())
+        database._recomputeRatings(cursor)
+        database._rebuildLeaderboard(cursor)
+    database.invalidatePairings()
+    return tournament_ids
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+#
+# tournament_server.py -- HTTP/JSON service over tournament.py
+#
+# Serves standings, pairings and match reporting to front ends that should
+# not link tournament.py or open database connections of their own:
+#
+#   python tournament_server.py --port 8000
+#
+#   GET  /tournaments/1/standings[?after=id&limit=k]
+#   GET  /tournaments/1/pairings
+#   POST /tournaments/1/matches  {"player1": 3, "player2": 4, "winner": 3,
+#                                 "round": 2}
+#   POST /tournaments/1/rounds/2 {"results": [[3, 4, 3], [5, null, 5]]}
+#   GET  /stats                  queries made and requests that shared one
+#
+# Every request thread shares the tournament.py connection pool.
+# Identical reads that arrive while one is running wait for its result
+# instead of querying again, so a burst of clients refreshing the same
+# standings costs one query.  A read never joins one that started before
+# the last write this server made to the tournament, so a client always
+# reads its own writes.
+#
+
+import argparse
+import collections
+import json
+import re
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+
+import psycopg2
+
+import tournament
+
+# Connections the server accepts before it has threads to serve them
+LISTEN_BACKLOG = 1024
+
+
+class Coalescer(object):
+    """Runs one call per key at a time and shares its result.
+
+    A caller asking for a key that is already being computed waits for that
+    computation instead of starting another.  Keys belong to a scope (a
+    tournament): bump(scope) after writing to it, and later callers start a
+    new call rather than join one that may have read the data before the
+    write.  Nothing is kept once the call returns.
+
+    Attributes:
+      calls: the number of calls actually made
+      shared: the number of callers served by another caller's call
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._running = {}
+        self._generations = collections.defaultdict(int)
+
+    def bump(self, scope):
+        """Makes later calls in scope start afresh, see the class docs."""
+        with self._lock:
+            self._generations[scope] += 1
+
+    def call(self, scope, key, fn, *args):
+        """Returns fn(*args), or the result of the same key's running call.
+
+        Only a call started in scope since its last bump() is joined.
+        Exceptions are raised in every caller waiting for the call.
+        """
+        with self._lock:
+            key = (scope, self._generations[scope], key)
+            running = self._running.get(key)
+            if running is None:
+                running = self._running[key] = _Call()
+                self.calls += 1
+                owner = True
+            else:
+                self.shared += 1
+                owner = False
+        if not owner:
+            running.done.wait()
+        else:
+            try:
+                running.result = fn(*args)
+            except Exception as e:
+                running.error = e
+            finally:
+                with self._lock:
+                    del self._running[key]
+                running.done.set()
+        if running.error is not None:
+            raise running.error
+        return running.result
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# The coalescer of every read, see GET /stats
+reads = Coalescer()
+
+
+def _standings(t, query):
+    after = query.get('after')
+    limit = query.get('limit')
+    if after is None and limit is None:
+        rows = reads.call(t, 'standings', tournament.playerStandings, t)
+    else:
+        after = int(after) if after is not None else None
+        limit = int(limit) if limit is not None else \
+            tournament.STANDINGS_PAGE_SIZE
+        rows = reads.call(t, ('standings', after, limit),
+                          tournament.standingsPage, t, after, limit)
+    return 200, [{'id': id, 'name': name, 'wins': wins, 'matches': matches}
+                 for (id, name, wins, matches) in rows]
+
+
+def _pairings(t, query):
+    rows = reads.call(t, 'pairings', tournament.swissPairings, t)
+    return 200, [{'id1': id1, 'name1': name1, 'id2': id2, 'name2': name2}
+                 for (id1, name1, id2, name2) in rows]
+
+
+def _stats(query):
+    return 200, {'calls': reads.calls, 'shared': reads.shared}
+
+
+def _reportMatch(t, body):
+    try:
+        tournament.reportMatch(body['player1'], body.get('player2'),
+                               body['winner'], body['round'], t)
+    finally:
+        reads.bump(t)
+    return 201, {}
+
+
+def _reportRound(t, round, body):
+    try:
+        seconds = tournament.reportRound(t, round, [
+            tuple(result) for result in body['results']])
+    finally:
+        reads.bump(t)
+    return 201, {'seconds': seconds}
+
+
+# (method, path pattern, handler); the path's groups are passed as ints
+ROUTES = [
+    ('GET', r'/tournaments/(\d+)/standings', _standings),
+    ('GET', r'/tournaments/(\d+)/pairings', _pairings),
+    ('POST', r'/tournaments/(\d+)/matches', _reportMatch),
+    ('POST', r'/tournaments/(\d+)/rounds/(\d+)', _reportRound),
+    ('GET', r'/stats', _stats),
+]
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Dispatches requests to the ROUTES handlers and writes JSON back."""
+
+    # Keep connections open between requests
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = dict((name, values[-1])
+                     for name, values in parse_qs(url.query).items())
+        self._dispatch('GET', url.path, query)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length).decode('utf-8')
+                              or '{}')
+        except ValueError:
+            return self._send(400, {'error': "The body is not JSON."})
+        if not isinstance(body, dict):
+            return self._send(400, {'error': "The body is not a JSON object."})
+        self._dispatch('POST', urlparse(self.path).path, body)
+
+    def _dispatch(self, method, path, data):
+        allowed = []
+        for route_method, pattern, handler in ROUTES:
+            match = re.match(pattern + '$', path)
+            if match and route_method == method:
+                break
+            if match:
+                allowed.append(route_method)
+        else:
+            if allowed:
+                return self._send(405, {'error': "Method not allowed."},
+                                  [('Allow', ', '.join(allowed))])
+            return self._send(404, {'error': "No such resource."})
+        try:
+            args = [int(group) for group in match.groups()]
+            status, result = handler(*(args + [data]))
+        except (KeyError, TypeError, ValueError,
+                psycopg2.DataError, psycopg2.IntegrityError) as e:
+            # Bad values and ids of players or tournaments that do not
+            # exist are the client's error
+            return self._send(400, {'error': str(e).strip()})
+        except Exception as e:
+            self.log_error("%s %s: %r", method, path, e)
+            return self._send(500, {'error': "Internal error."})
+        self._send(status, result)
+
+    def _send(self, status, result, headers=()):
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_request(self, code='-', size='-'):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    """An HTTPServer with a thread per connection."""
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+
+def serve(host='', port=8000):
+    """Returns a Server listening on (host, port); call serve_forever()."""
+    return Server((host, port), Handler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Serve standings, pairings and match reports as JSON.")
+    parser.add_argument("--host", default='', help="address to listen on")
+    parser.add_argument("--port", type=int, default=8000,
+                        help="port to listen on")
+    args = parser.parse_args()
+    server = serve(args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        tournament.closePool()
@@ -0,0 +1,522 @@
+#!/usr/bin/env python
+#
+# tournament_sqlite.py -- the tournament.py API on an embedded SQLite database
+#
+# Implements the functions of tournament.py on SQLite, for small events and
+# test runs without a PostgreSQL server:
+#
+#   import tournament_sqlite as tournament
+#
+# DATABASE names the database file, ':memory:' (the default) keeps it in
+# memory until closeConnection().  The schema (tournament_sqlite.sql) is
+# created when the database is opened.  Queries are the ones of tournament.py
+# translated to SQLite, and accept the same %s and %(name)s placeholders, so
+# connect() blocks written for tournament.py also run here.
+#
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import rating
+import swiss
+import tournament as database
+
+# Database file, or ':memory:' for a private in-memory database
+DATABASE = ':memory:'
+
+# Oldest SQLite library that runs every query here; checkStandings() needs
+# FULL JOIN, added in 3.39
+MIN_SQLITE_VERSION = (3, 39, 0)
+
+if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+    raise ImportError("tournament_sqlite needs SQLite %s or later, but "
+                      "Python's sqlite3 module uses SQLite %s."
+                      % ('.'.join(map(str, MIN_SQLITE_VERSION)),
+                         sqlite3.sqlite_version))
+
+# Schema applied to every database opened
+SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'tournament_sqlite.sql')
+
+_db = None
+_lock = threading.Lock()
+
+# %s, %(name)s and %% placeholders of psycopg2 queries
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+
+
+def _placeholder(match):
+    if match.group(1):
+        return ':' + match.group(1)
+    return '?' if match.group(0) == '%s' else '%'
+
+
+class _Cursor(object):
+    """A sqlite3 cursor that runs psycopg2-style queries.
+
+    Placeholders are translated to SQLite ones, and a query holding several
+    statements separated by semicolons runs them one after another with the
+    same (named) parameters, like a psycopg2 statement batch.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        for statement in _PLACEHOLDER.sub(_placeholder, sql).split(';'):
+            if statement.strip():
+                self._cursor.execute(statement, params)
+        return self
+
+    def executemany(self, sql, rows):
+        self._cursor.executemany(_PLACEHOLDER.sub(_placeholder, sql), rows)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+
+def getConnection():
+    """Returns the module's database connection, opening it on first use.
+
+    Must be called with _lock held.
+    """
+    global _db
+    if _db is None:
+        db = sqlite3.connect(DATABASE, isolation_level=None,
+                             check_same_thread=False)
+        db.text_factory = str
+        db.execute("PRAGMA foreign_keys = ON")
+        with open(SCHEMA) as schema:
+            db.executescript(schema.read())
+        _db = db
+    return _db
+
+
+def closeConnection():
+    """Close the database connection.
+
+    The next call to connect() opens DATABASE again; an in-memory database
+    starts out empty.
+    """
+    global _db
+    with _lock:
+        if _db is not None:
+            _db.close()
+        _db = None
+
+
+@contextmanager
+def connect():
+    """Run a block in a transaction on the SQLite database.
+
+    Yields a (db, cursor) pair like tournament.connect(), cursor accepting
+    psycopg2-style queries.  The transaction is committed when the block
+    exits normally and rolled back if it raises.  The connection is shared
+    by every thread, one block at a time, so blocks must not be nested.
+    """
+    with _lock:
+        db = getConnection()
+        cursor = _Cursor(db.cursor())
+        cursor.execute("BEGIN")
+        try:
+            yield db, cursor
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            cursor.close()
+
+
+def deleteMatches():
+    """Remove all the matches from the database."""
+    with connect() as (db, cursor):
+        cursor.execute("DELETE FROM Standing; DELETE FROM Rating; "
+                       "DELETE FROM PlayerTotal; DELETE FROM Match")
+
+
+def deleteTourMatches(tournament):
+    """Remove all the match records in a tournament from the database.
+
+    See tournament.deleteTourMatches().
+    """
+    with connect() as (db, cursor):
+        cursor.execute(database._DELETE_TOUR_TOTALS_SQL, (tournament,))
+        cursor.execute("DELETE FROM Standing WHERE tournament = %s",
+                       (tournament,))
+        cursor.execute("DELETE FROM Match WHERE tournament = %s",
+                       (tournament,))
+
+
+def deletePlayers():
+    """Remove all the player records from the database."""
+    with connect() as (db, cursor):
+        cursor.execute("DELETE FROM Player")
+
+
+def deleteTournaments():
+    """Remove all the tournament records from the database."""
+    with connect() as (db, cursor):
+        cursor.execute("DELETE FROM Tournament")
+
+
+def countPlayers():
+    """Returns the number of players currently registered."""
+    with connect() as (db, cursor):
+        cursor.execute("SELECT COUNT(*) FROM Player")
+        return cursor.fetchone()[0]
+
+
+def _enter(cursor, tournament, players):
+    cursor.executemany("INSERT OR IGNORE INTO TournamentPlayer "
+                       "(tournament, player) VALUES (%s, %s)",
+                       [(tournament, player) for player in players])
+
+
+def registerPlayer(name, tournament=None):
+    """Adds a player and returns the id assigned to the player.
+
+    See tournament.registerPlayer().
+    """
+    with connect() as (db, cursor):
+        cursor.execute("INSERT INTO Player (full_name) VALUES (%s)", (name,))
+        player = cursor.lastrowid
+        if tournament is not None:
+            _enter(cursor, tournament, [player])
+        return player
+
+
+def registerPlayers(names, tournament=None):
+    """Adds many players in one transaction, returns their ids in input order.
+
+    names is read one at a time, so a generator or an open file (one name
+    per line) can be passed, see tournament.registerPlayers().
+    """
+    ids = []
+    with connect() as (db, cursor):
+        for name in names:
+            cursor.execute("INSERT INTO Player (full_name) VALUES (%s)",
+                           (name.rstrip('\r\n'),))
+            ids.append(cursor.lastrowid)
+        if tournament is not None:
+            _enter(cursor, tournament, ids)
+    return ids
+
+
+def enterTournament(tournament, players):
+    """Enters registered players in a tournament.
+
+    See tournament.enterTournament().
+    """
+    with connect() as (db, cursor):
+        _enter(cursor, tournament, players)
+
+
+def registerTournament(description):
+    """Adds a tournament and returns the id assigned to it."""
+    with connect() as (db, cursor):
+        cursor.execute("INSERT INTO Tournament (description) VALUES (%s)",
+                       (description,))
+        return cursor.lastrowid
+
+
+# Standings of the tournament's entrants, or of every registered player when
+# nobody has entered the tournament (the playerStandings() function of
+# tournament.sql)
+_STANDINGS_SQL = """
+SELECT p.id, p.full_name, COALESCE(s.wins, 0), COALESCE(s.matches, 0),
+       COALESCE(s.opponent_wins, 0)
+  FROM TournamentPlayer tp
+  JOIN Player p ON p.id = tp.player
+  LEFT JOIN Standing s ON s.tournament = tp.tournament AND s.player = tp.player
+ WHERE tp.tournament = %(tournament)s
+UNION ALL
+SELECT p.id, p.full_name, COALESCE(s.wins, 0), COALESCE(s.matches, 0),
+       COALESCE(s.opponent_wins, 0)
+  FROM Player p
+  LEFT JOIN Standing s ON s.tournament = %(tournament)s AND s.player = p.id
+ WHERE NOT EXISTS (SELECT 1 FROM TournamentPlayer
+                    WHERE tournament = %(tournament)s)
+ ORDER BY 3 DESC, 5 DESC, 1
+"""
+
+
+def playerStandings(tournament, tiebreaks=False):
+    """Returns a list of the players and their win records, sorted by wins.
+
+    Same rows and order as tournament.playerStandings().
+    """
+    with connect() as (db, cursor):
+        cursor.execute(_STANDINGS_SQL, {'tournament': tournament})
+        standings = cursor.fetchall()
+        if not tiebreaks:
+            return [row[:4] for row in standings]
+        cursor.execute(database._MATCHES_SQL, (tournament,))
+        history = cursor.fetchall()
+    return database._rankWithTieBreaks(standings, history)
+
+
+def standingsPage(tournament, after=None, limit=database.STANDINGS_PAGE_SIZE):
+    """Returns one page of a tournament's standings.
+
+    Same rows as tournament.standingsPage(), read along the same index.
+    """
+    with connect() as (db, cursor):
+        return database._standingsPage(cursor, tournament, after, limit)
+
+
+def topStandings(tournament, n):
+    """Returns the first n rows of playerStandings()."""
+    return standingsPage(tournament, limit=n)
+
+
+# Applies one match to Match, Standing and PlayerTotal, statement for
+# statement the updates of tournament._REPORT_MATCH_SQL
+_REPORT_MATCH_SQL = """
+UPDATE Standing AS s SET opponent_wins = s.opponent_wins + pm.games
+  FROM (SELECT opponent, COUNT(*) AS games FROM PlayerMatch
+         WHERE tournament = %(tournament)s AND player = %(winner)s
+         GROUP BY opponent) pm
+ WHERE s.tournament = %(tournament)s AND s.player = pm.opponent;
+
+INSERT INTO Match (player1, player2, winner, round, tournament)
+VALUES (%(player1)s, %(player2)s, %(winner)s, %(round)s, %(tournament)s);
+
+INSERT INTO Standing (tournament, player, wins, matches)
+SELECT %(tournament)s, player,
+       CASE WHEN player = %(winner)s THEN 1 ELSE 0 END, 1
+  FROM (SELECT %(player1)s AS player UNION ALL SELECT %(player2)s)
+ WHERE player IS NOT NULL
+ON CONFLICT (tournament, player) DO UPDATE
+   SET wins = wins + excluded.wins,
+       matches = matches + 1;
+
+UPDATE Standing AS s SET opponent_wins = s.opponent_wins + o.wins
+  FROM Standing o
+ WHERE s.tournament = %(tournament)s AND o.tournament = %(tournament)s
+   AND ((s.player = %(player1)s AND o.player = %(player2)s)
+     OR (s.player = %(player2)s AND o.player = %(player1)s));
+
+INSERT INTO PlayerTotal (player, wins, matches)
+SELECT player, CASE WHEN player = %(winner)s THEN 1 ELSE 0 END, 1
+  FROM (SELECT %(player1)s AS player UNION ALL SELECT %(player2)s)
+ WHERE player IS NOT NULL
+ON CONFLICT (player) DO UPDATE
+   SET wins = wins + excluded.wins,
+       matches = matches + 1
+"""
+
+# The players' ratings before a match
+_MATCH_RATINGS_SQL = """
+SELECT player, rating, games FROM Rating WHERE player IN (%s, %s)
+"""
+
+# Stores a player's rating after a match
+_WRITE_RATING_SQL = """
+INSERT OR REPLACE INTO Rating (player, rating, games) VALUES (%s, %s, %s)
+"""
+
+
+def _report(cursor, player1, player2, winner, round, tournament):
+    """Records a match, its standings and its Elo rating updates."""
+    cursor.execute(_REPORT_MATCH_SQL, database._matchParams(
+        player1, player2, winner, round, tournament))
+    if player2 is None:
+        return
+    cursor.execute(_MATCH_RATINGS_SQL, (player1, player2))
+    before = dict((row[0], row[1:]) for row in cursor.fetchall())
+    (rating1, games1), (rating2, games2) = [
+        before.get(player, (rating.INITIAL_RATING, 0))
+        for player in (player1, player2)]
+    change = rating.ELO_K * (float(winner == player1) -
+                             float(rating.expectedScore(rating1, rating2)))
+    cursor.executemany(_WRITE_RATING_SQL,
+                       [(player1, rating1 + change, games1 + 1),
+                        (player2, rating2 - change, games2 + 1)])
+
+
+def reportMatch(player1, player2, winner, round, tournament):
+    """Report a single match between two players (player2 None for a bye).
+
+    See tournament.reportMatch().
+    """
+    with connect() as (db, cursor):
+        _report(cursor, player1, player2, winner, round, tournament)
+
+
+def reportRound(tournament, round, results):
+    """Report every match of a tournament round at once.
+
+    Validates the whole round before recording any of it, like
+    tournament.reportRound(), then records the matches one after another in
+    a single transaction.  Returns the elapsed time in seconds.
+    """
+    start = time.time()
+    results = list(results)
+    database._roundParams(tournament, round, results)
+    with connect() as (db, cursor):
+        for player1, player2, winner in results:
+            _report(cursor, player1, player2, winner, round, tournament)
+    return time.time() - start
+
+
+# Replaces a tournament's standings with the ones recomputed from its matches
+_REBUILD_STANDINGS_SQL = """
+DELETE FROM Standing WHERE tournament = %(tournament)s;
+
+INSERT INTO Standing (tournament, player, wins, matches, opponent_wins)
+SELECT tournament, player, wins, matches, opponent_wins
+  FROM ComputedStanding WHERE tournament = %(tournament)s
+"""
+
+# Players whose stored standing differs from the recomputed one
+_CHECK_STANDINGS_SQL = """
+SELECT COALESCE(s.player, c.player),
+       s.wins, s.matches, s.opponent_wins,
+       c.wins, c.matches, c.opponent_wins
+  FROM (SELECT * FROM Standing WHERE tournament = %(tournament)s) s
+  FULL JOIN (SELECT * FROM ComputedStanding
+              WHERE tournament = %(tournament)s) c
+    ON c.player = s.player
+ WHERE (s.wins, s.matches, s.opponent_wins)
+       IS NOT (c.wins, c.matches, c.opponent_wins)
+ ORDER BY 1
+"""
+
+
+def rebuildStandings(tournament):
+    """Recompute a tournament's standings from its match history."""
+    with connect() as (db, cursor):
+        cursor.execute(_REBUILD_STANDINGS_SQL, {'tournament': tournament})
+
+
+def checkStandings(tournament):
+    """Compare a tournament's stored standings with its match history.
+
+    Returns the same (id, stored, expected) tuples as
+    tournament.checkStandings().
+    """
+    with connect() as (db, cursor):
+        cursor.execute(_CHECK_STANDINGS_SQL, {'tournament': tournament})
+        return database._standingErrors(cursor.fetchall())
+
+
+def playerRatings():
+    """Returns every player's Elo rating, highest first.
+
+    Same rows as tournament.playerRatings().
+    """
+    with connect() as (db, cursor):
+        cursor.execute(database._PLAYER_RATINGS_SQL,
+                       {'initial_rating': rating.INITIAL_RATING})
+        return cursor.fetchall()
+
+
+def recomputeRatings():
+    """Recompute every player's Elo rating from the whole match history.
+
+    See tournament.recomputeRatings().
+    """
+    with connect() as (db, cursor):
+        cursor.execute("SELECT player1, player2, winner FROM Match "
+                       "ORDER BY id")
+        params = database._ratingParams(cursor.fetchall())
+        cursor.execute("DELETE FROM Rating")
+        cursor.executemany("INSERT INTO Rating (player, rating, games) "
+                           "VALUES (%s, %s, %s)",
+                           zip(params['players'], params['ratings'],
+                               params['games']))
+
+
+def leaderboard(after=None, limit=database.LEADERBOARD_PAGE_SIZE):
+    """Returns one page of the lifetime leaderboard across all tournaments.
+
+    Same rows as tournament.leaderboard().
+    """
+    with connect() as (db, cursor):
+        return database._leaderboard(cursor, after, limit)
+
+
+def rebuildLeaderboard():
+    """Recompute every player's lifetime record from the match history."""
+    with connect() as (db, cursor):
+        cursor.execute(database._REBUILD_TOTALS_SQL)
+
+
+def matchHistory(tournament):
+    """Returns the MatchHistory (opponents, colors and byes) of a tournament."""
+    with connect() as (db, cursor):
+        cursor.execute(database._MATCHES_SQL, (tournament,))
+        return swiss.MatchHistory((player1, player2)
+                                  for player1, player2, winner in cursor)
+
+
+# Ratings used to seed the first round of a tournament, for a JSON list of
+# player ids
+_SEED_RATINGS_SQL = """
+SELECT player, rating FROM Rating
+ WHERE player IN (SELECT value FROM json_each(%s))
+"""
+
+
+def swissPairings(tournament, server=False):
+    """Returns a list of pairs of players for the next round of a match.
+
+    Same pairing rules and rows as tournament.swissPairings().  With server,
+    pairs adjacent players in the standings with the bye rule of the
+    swissPairings() database function of tournament.sql.
+    """
+    standings = playerStandings(tournament)
+    if server:
+        return _adjacentPairings(tournament, standings)
+    history = matchHistory(tournament)
+    ratings = None
+    if not (history.opponents or history.byes):
+        with connect() as (db, cursor):
+            cursor.execute(_SEED_RATINGS_SQL,
+                           (json.dumps([row[0] for row in standings]),))
+            ratings = dict(cursor.fetchall())
+    return database._pairings(standings, history, ratings)
+
+
+def _adjacentPairings(tournament, standings):
+    """Pairs 1st against 2nd, 3rd against 4th... with one bye in an odd field.
+
+    The bye goes to the lowest ranked player without one, or to the last
+    player if everyone has had one, and is returned last.
+    """
+    ranked = [row[:2] for row in standings]
+    bye = None
+    if len(ranked) % 2:
+        with connect() as (db, cursor):
+            cursor.execute("SELECT player1 FROM Match "
+                           "WHERE tournament = %s AND player2 IS NULL",
+                           (tournament,))
+            had_bye = set(row[0] for row in cursor.fetchall())
+        bye = next((player for player in reversed(ranked)
+                    if player[0] not in had_bye), ranked[-1])
+        ranked.remove(bye)
+    pairings = [ranked[i] + ranked[i + 1]
+                for i in range(0, len(ranked) - 1, 2)]
+    if bye is not None:
+        pairings.append(bye + (None, None))
+    return pairings
@@ -0,0 +1,53 @@
+-- Table definitions for the SQLite tournament backend (tournament_sqlite.py).
+--
+-- The same tables, indexes and views as tournament.sql, written for SQLite
+-- 3.39 or later (see MIN_SQLITE_VERSION in tournament_sqlite.py).  tournament_sqlite.py applies this file whenever it opens a
+-- database, so every statement is safe to re-run on an existing database.
+-- The playerStandings and swissPairings database functions are queries in
+-- tournament_sqlite.py instead.
+
+-- Players
+CREATE TABLE IF NOT EXISTS Player (id INTEGER PRIMARY KEY AUTOINCREMENT, full_name VARCHAR(60));
+
+--Tournaments
+CREATE TABLE IF NOT EXISTS Tournament (id INTEGER PRIMARY KEY AUTOINCREMENT, description VARCHAR(200));
+
+--Matches
+CREATE TABLE IF NOT EXISTS Match (id INTEGER PRIMARY KEY AUTOINCREMENT, player1 INTEGER, player2 INTEGER, winner INTEGER, round INTEGER, tournament INTEGER, CONSTRAINT player1FK FOREIGN KEY (player1) REFERENCES Player (id), CONSTRAINT player2FK FOREIGN KEY (player2) REFERENCES Player (id), CONSTRAINT tournamentFK FOREIGN KEY (tournament) REFERENCES Tournament (id));
+CREATE INDEX IF NOT EXISTS matchPlayer1Idx ON Match (tournament, player1, player2, winner);
+CREATE INDEX IF NOT EXISTS matchPlayer2Idx ON Match (tournament, player2, player1, winner);
+CREATE INDEX IF NOT EXISTS matchRoundIdx ON Match (tournament, round, id, player1, player2, winner);
+
+--Tournament entrants (a tournament without entrants is open to every registered player)
+CREATE TABLE IF NOT EXISTS TournamentPlayer (tournament INTEGER, player INTEGER, CONSTRAINT tournamentPlayerPK PRIMARY KEY (tournament, player), CONSTRAINT tournamentPlayerTournamentFK FOREIGN KEY (tournament) REFERENCES Tournament (id) ON DELETE CASCADE, CONSTRAINT tournamentPlayerPlayerFK FOREIGN KEY (player) REFERENCES Player (id) ON DELETE CASCADE);
+CREATE INDEX IF NOT EXISTS tournamentPlayerPlayerIdx ON TournamentPlayer (player);
+
+--Matches from each player's point of view, one row per player per match (a bye has no player2)
+CREATE VIEW IF NOT EXISTS PlayerMatch AS
+  SELECT id AS match, tournament, round, player1 AS player, player2 AS opponent, winner FROM Match
+  UNION ALL
+  SELECT id AS match, tournament, round, player2 AS player, player1 AS opponent, winner FROM Match WHERE player2 IS NOT NULL;
+
+--Standings, maintained by reportMatch (opponent_wins is the sum of the wins of every opponent played)
+CREATE TABLE IF NOT EXISTS Standing (tournament INTEGER, player INTEGER, wins INTEGER NOT NULL DEFAULT 0, matches INTEGER NOT NULL DEFAULT 0, opponent_wins INTEGER NOT NULL DEFAULT 0, CONSTRAINT standingPK PRIMARY KEY (tournament, player), CONSTRAINT standingTournamentFK FOREIGN KEY (tournament) REFERENCES Tournament (id) ON DELETE CASCADE, CONSTRAINT standingPlayerFK FOREIGN KEY (player) REFERENCES Player (id) ON DELETE CASCADE);
+CREATE INDEX IF NOT EXISTS standingRankIdx ON Standing (tournament, wins, opponent_wins, (-player), player, matches);
+CREATE INDEX IF NOT EXISTS standingPlayerIdx ON Standing (player);
+
+--Elo ratings across all tournaments, updated by reportMatch (players without a row have the initial rating)
+CREATE TABLE IF NOT EXISTS Rating (player INTEGER, rating DOUBLE PRECISION NOT NULL, games INTEGER NOT NULL DEFAULT 0, CONSTRAINT ratingPK PRIMARY KEY (player), CONSTRAINT ratingPlayerFK FOREIGN KEY (player) REFERENCES Player (id) ON DELETE CASCADE);
+
+--Lifetime records across all tournaments, maintained by reportMatch for the leaderboard
+CREATE TABLE IF NOT EXISTS PlayerTotal (player INTEGER, wins INTEGER NOT NULL DEFAULT 0, matches INTEGER NOT NULL DEFAULT 0, CONSTRAINT playerTotalPK PRIMARY KEY (player), CONSTRAINT playerTotalPlayerFK FOREIGN KEY (player) REFERENCES Player (id) ON DELETE CASCADE);
+CREATE INDEX IF NOT EXISTS playerTotalRankIdx ON PlayerTotal (wins, (-player), player, matches);
+
+--Standings recomputed from the match history, used to rebuild and check Standing
+CREATE VIEW IF NOT EXISTS PlayerRecord AS
+  SELECT tournament, player, COUNT(*) AS matches, COUNT(*) FILTER (WHERE winner = player) AS wins
+    FROM PlayerMatch GROUP BY tournament, player;
+
+CREATE VIEW IF NOT EXISTS ComputedStanding AS
+  SELECT r.tournament, r.player, r.wins, r.matches, COALESCE(SUM(o.wins), 0) AS opponent_wins
+    FROM PlayerRecord r
+    JOIN PlayerMatch pm ON pm.tournament = r.tournament AND pm.player = r.player
+    LEFT JOIN PlayerRecord o ON o.tournament = pm.tournament AND o.player = pm.opponent
+   GROUP BY r.tournament, r.player, r.wins, r.matches;
@@ -2,7 +2,37 @@
 #
 # Test cases for tournament.py
 
-from tournament import *
+import csv
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import httplib
+import threading
+import time
+from cStringIO import StringIO
+
+import coordinator
+import instrument
+import rating
+import simulate
+import swiss
+import tournament_export
+import tournament_memory
+import tournament_server
+
+# TOURNAMENT_BACKEND=sqlite runs the tests against an in-memory SQLite
+# database (tournament_sqlite.py), skipping the PostgreSQL-only ones
+BACKEND = os.environ.get('TOURNAMENT_BACKEND', 'postgresql')
+if BACKEND == 'sqlite':
+    from tournament_sqlite import *
+    import tournament_sqlite as database
+else:
+    from tournament import *
+    import tournament as database
+    import psycopg2
 
 def testDeleteMatches():
     deleteMatches()
@@ -140,6 +170,1052 @@ def testPairings():
     print "9. After one match, players with one win are paired."
 
 
+def testConnectionPool():
+    deleteMatches()
+    deletePlayers()
+    for i in range(POOL_MAX_CONN * 4):
+        registerPlayer("Player %d" % i)
+    if countPlayers() != POOL_MAX_CONN * 4:
+        raise ValueError("Pooled connections should commit every call.")
+    try:
+        with connect() as (db, cursor):
+            cursor.execute("SELECT no_such_column FROM Player")
+    except psycopg2.ProgrammingError:
+        pass
+    if countPlayers() != POOL_MAX_CONN * 4:
+        raise ValueError("A failed call should not poison the next checkout.")
+    closePool()
+    deletePlayers()
+    if countPlayers() != 0:
+        raise ValueError("connect() should reopen the pool after closePool().")
+
+    # Closing the pool lets the calls holding a connection finish
+    checked_out, release, held, errors = (threading.Event(),
+                                          threading.Event(), [], [])
+
+    def hold():
+        try:
+            with connect() as (db, cursor):
+                held.append(db)
+                checked_out.set()
+                release.wait()
+                cursor.execute("SELECT 1")
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    checked_out.wait()
+    closePool()
+    in_use = not held[0].closed
+    release.set()
+    thread.join()
+    if not in_use or errors or not held[0].closed:
+        raise ValueError("closePool() should close a connection in use only "
+                         "once it is returned: %r" % errors[:1])
+    print "10. Pooled connections are reused and survive failed queries."
+
+
+def testStandingsPerTournament():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    registerPlayer("Gary Kasparov")
+    registerPlayer("Anatoly Karpov")
+    open_ = registerTournament("U.S. Open")
+    masters = registerTournament("Masters")
+    [id1, id2] = [row[0] for row in playerStandings(open_)]
+    reportMatch(id1, id2, id1, 1, open_)
+    reportMatch(id1, id2, id2, 1, masters)
+    reportMatch(id1, id2, id2, 2, masters)
+    standings = playerStandings(masters)
+    if [(i, w, m) for (i, n, w, m) in standings] != [(id2, 2, 2), (id1, 0, 2)]:
+        raise ValueError(
+            "Standings should only count matches in the given tournament.")
+    print "11. Standings only count matches in the requested tournament."
+
+
+def testRebuildStandings():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    for name in ("Ann", "Bob", "Cid", "Dee"):
+        registerPlayer(name)
+    tournament = registerTournament("U.S. Open")
+    [id1, id2, id3, id4] = [row[0] for row in playerStandings(tournament)]
+    reportMatch(id1, id2, id1, 1, tournament)
+    reportMatch(id3, id4, id3, 1, tournament)
+    reportMatch(id1, id3, id1, 2, tournament)
+    reportMatch(id2, id4, id2, 2, tournament)
+    if checkStandings(tournament):
+        raise ValueError("reportMatch() should keep the standings consistent.")
+    with connect() as (db, cursor):
+        cursor.execute("SELECT opponent_wins FROM Standing "
+                       "WHERE tournament = %s AND player = %s",
+                       (tournament, id1))
+        if cursor.fetchone()[0] != 2:
+            raise ValueError("Opponent wins should sum the opponents' wins.")
+        cursor.execute("UPDATE Standing SET wins = 5 "
+                       "WHERE tournament = %s AND player = %s",
+                       (tournament, id4))
+    if [row[0] for row in checkStandings(tournament)] != [id4]:
+        raise ValueError("checkStandings() should report a corrupted row.")
+    rebuildStandings(tournament)
+    if checkStandings(tournament):
+        raise ValueError("rebuildStandings() should repair the standings.")
+    if [row[0] for row in playerStandings(tournament)][:1] != [id1]:
+        raise ValueError("The undefeated player should lead the standings.")
+    print "12. Standings are maintained incrementally and can be rebuilt."
+
+
+def testReportRound():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    for i in range(8):
+        registerPlayer("Player %d" % i)
+    tournament = registerTournament("U.S. Open")
+    ids = [row[0] for row in playerStandings(tournament)]
+    reportRound(tournament, 1, [(ids[i], ids[i + 1], ids[i])
+                                for i in range(0, 8, 2)])
+    pairings = swissPairings(tournament)
+    reportRound(tournament, 2, [(id1, id2, id2)
+                                for (id1, n1, id2, n2) in pairings])
+    if checkStandings(tournament):
+        raise ValueError("reportRound() should keep the standings consistent.")
+    if sum(row[3] for row in playerStandings(tournament)) != 16:
+        raise ValueError("Each player should have two matches recorded.")
+    try:
+        reportRound(tournament, 3, [(ids[0], ids[1], ids[0]),
+                                    (ids[1], ids[2], ids[2])])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("reportRound() should reject a player paired twice.")
+    if sum(row[3] for row in playerStandings(tournament)) != 16:
+        raise ValueError("A rejected round should not record any match.")
+    print "13. A whole round can be reported at once."
+
+
+def testRegisterPlayers():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    first = registerPlayer("Bobby Fischer")
+    names = ["Player %d" % i for i in range(25)] + ['Judit "Tab\tComma," Polgar']
+    ids = registerPlayers(name + "\n" for name in names)
+    if len(ids) != len(names) or len(set(ids)) != len(ids) or first in ids:
+        raise ValueError("registerPlayers() should return one new id per name.")
+    if countPlayers() != len(names) + 1:
+        raise ValueError("registerPlayers() should register every name.")
+    tournament = registerTournament("U.S. Open")
+    registered = dict((i, n) for (i, n, w, m) in playerStandings(tournament))
+    if [registered[i] for i in ids] != names:
+        raise ValueError("registerPlayers() should return ids in input order.")
+    print "14. Players can be registered in bulk."
+
+
+def testPairingsAvoidRematches():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    [id1, id2, id3, id4] = registerPlayers(["Ann", "Bob", "Cid", "Dee"])
+    tournament = registerTournament("U.S. Open")
+    reportMatch(id1, id2, id1, 1, tournament)
+    reportMatch(id3, id4, id3, 1, tournament)
+    reportMatch(id1, id3, id1, 2, tournament)
+    reportMatch(id2, id4, id4, 2, tournament)
+    pairings = swissPairings(tournament)
+    actual_pairs = set(frozenset([pid1, pid2])
+                       for (pid1, pname1, pid2, pname2) in pairings)
+    correct_pairs = set([frozenset([id1, id4]), frozenset([id2, id3])])
+    if actual_pairs != correct_pairs:
+        raise ValueError("swissPairings() should not pair players who "
+                         "have already played each other.")
+
+    # In round 7 of this tournament pairing by score groups leaves a rematch
+    # that a search of the whole field avoids
+    tournament = registerTournament("Late Rounds")
+    ids = registerPlayers(["Player %d" % i for i in range(10)], tournament)
+    for round in range(1, 9):
+        history = matchHistory(tournament)
+        pairings = swissPairings(tournament)
+        if any(history.played(pid1, pid2)
+               for (pid1, pname1, pid2, pname2) in pairings):
+            raise ValueError("swissPairings() should avoid a rematch in "
+                             "round %d, as it can." % round)
+        reportRound(tournament, round, [
+            (pid1, pid2, pid1 if (2 * ids.index(pid1) + ids.index(pid2) +
+                                  round) % 3 else pid2)
+            for (pid1, pname1, pid2, pname2) in pairings])
+    print "15. Players are not paired against opponents they have played."
+
+
+def testPairingsOddField():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    ids = registerPlayers(["Ann", "Bob", "Cid", "Dee", "Eve"])
+    tournament = registerTournament("U.S. Open")
+    byes = set()
+    for round in range(1, 4):
+        pairings = swissPairings(tournament)
+        paired = [i for (id1, n1, id2, n2) in pairings for i in (id1, id2)]
+        if sorted(i for i in paired if i is not None) != sorted(ids):
+            raise ValueError("Each player should appear once in the pairings.")
+        [bye] = [id1 for (id1, n1, id2, n2) in pairings if id2 is None]
+        if bye in byes:
+            raise ValueError("No player should get a second bye.")
+        byes.add(bye)
+        reportRound(tournament, round, [(id1, id2, id1)
+                                        for (id1, n1, id2, n2) in pairings])
+    if checkStandings(tournament):
+        raise ValueError("Byes should keep the standings consistent.")
+    print "16. In an odd field each round gives one bye to a new player."
+
+
+def testTieBreaks():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    [id1, id2, id3, id4] = registerPlayers(["Ann", "Bob", "Cid", "Dee"])
+    tournament = registerTournament("U.S. Open")
+    reportMatch(id1, id2, id1, 1, tournament)
+    reportMatch(id3, id4, id3, 1, tournament)
+    reportMatch(id1, id3, id3, 2, tournament)
+    reportMatch(id2, id4, id2, 2, tournament)
+    standings = playerStandings(tournament, tiebreaks=True)
+    if len(standings[0]) != 7:
+        raise ValueError("Each tie-break row should have seven columns.")
+    expected = [(id3, 2, 1.0, 1.0, 0.417),
+                (id1, 1, 3.0, 1.0, 0.75),
+                (id2, 1, 1.0, 0.0, 0.417),
+                (id4, 0, 3.0, 0.0, 0.75)]
+    actual = [(i, w, b, sb, round(omw, 3))
+              for (i, n, w, m, b, sb, omw) in standings]
+    if actual != expected:
+        raise ValueError("Tie-breaks should be Buchholz, Sonneborn-Berger "
+                         "and OMW%, and order players with equal wins.")
+    print "17. Standings can include Buchholz, Sonneborn-Berger and OMW%."
+
+
+def testMemoryBackend():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    memory = tournament_memory
+    memory.deleteMatches()
+    memory.deletePlayers()
+    memory.deleteTournaments()
+    memory.registerPlayers(["Ann", "Bob", "Cid", "Dee", "Eve"])
+    tournament = memory.registerTournament("U.S. Open")
+    for round in range(1, 4):
+        memory.reportRound(tournament, round, [
+            (id1, id2, id1 if id2 is None or id1 < id2 else id2)
+            for (id1, n1, id2, n2) in memory.swissPairings(tournament)])
+    expected = [row[1:] for row in memory.playerStandings(tournament, True)]
+
+    path = os.path.join(tempfile.mkdtemp(), "snapshot.npz")
+    memory.snapshot(path)
+    memory.deleteMatches()
+    memory.deletePlayers()
+    memory.restore(path)
+    if [row[1:] for row in memory.playerStandings(tournament, True)] != expected:
+        raise ValueError("restore() should bring back the snapshot's state.")
+
+    tournament_ids = memory.loadIntoDatabase()
+    loaded = playerStandings(tournament_ids[tournament], tiebreaks=True)
+    if [row[1:] for row in loaded] != expected:
+        raise ValueError("loadIntoDatabase() should reproduce the in-memory "
+                         "standings in the database.")
+
+    memory.registerPlayer(u"Zo\xeb")
+    memory.registerTournament(u"Coupe d'\xe9t\xe9")
+    memory.snapshot(path)
+    memory.restore(path)
+    if memory.playerStandings(tournament)[-1][1] != u"Zo\xeb" or \
+            memory._tournaments[tournament + 1].description != \
+            u"Coupe d'\xe9t\xe9":
+        raise ValueError("snapshot() should keep non-ASCII names.")
+
+    # A load that fails part way leaves nothing behind
+    players = countPlayers()
+    memory.registerTournament("Bad\x00Open")
+    try:
+        memory.loadIntoDatabase()
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A description with a NUL should not load.")
+    if countPlayers() != players:
+        raise ValueError("loadIntoDatabase() should load in one transaction.")
+    print "18. Tournaments can run in memory and be loaded into the database."
+
+
+def testSimulation():
+    ratings = [2400, 2000, 1800, 1600, 1400, 1200, 1000]
+    top1, place1, elapsed = simulate.simulate(ratings, 60, top=2, workers=1,
+                                              seed=7, batch_size=25)
+    top2, place2, elapsed = simulate.simulate(ratings, 60, top=2, workers=1,
+                                              seed=7, batch_size=25)
+    if top1.tolist() != top2.tolist() or place1.tolist() != place2.tolist():
+        raise ValueError("Simulations with the same seed should agree.")
+    if abs(top1.sum() - 2) > 1e-9 or abs(place1.sum() - 28) > 1e-9:
+        raise ValueError("Each tournament should have one player per place.")
+    if top1[0] < top1[-1]:
+        raise ValueError("The strongest player should finish top more often.")
+
+    # Simulated rounds are paired in the order of swissPairings(): the
+    # first by rating, later ones by wins and opponent wins
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    warmup = registerTournament("Warm-up")
+    ids = sorted(registerPlayers(["Player %d" % i for i in range(9)], warmup))
+    reportRound(warmup, 1, [(id1, id2, max(id1, id2))
+                            for (id1, n1, id2, n2) in swissPairings(warmup)])
+    seeds = dict((row[0], row[2]) for row in playerRatings())
+    t = registerTournament("Simulated")
+    enterTournament(t, ids)
+    ratings = [seeds[id] for id in ids]
+    wins = [0] * len(ids)
+    first, second = [], []
+    for round in range(1, 5):
+        order = simulate.roundOrder(ratings, wins, first, second)
+        expected = swiss.pairRound([(ids[i], wins[i]) for i in order],
+                                   matchHistory(t))
+        pairings = [(id1, id2) for (id1, n1, id2, n2) in swissPairings(t)]
+        if pairings != expected:
+            raise ValueError("Simulated round %d should be paired like "
+                             "swissPairings()." % round)
+        results = [(id1, id2, id1 if id2 is None or (id1 + id2 + round) % 3
+                    else id2) for (id1, id2) in pairings]
+        reportRound(t, round, results)
+        for id1, id2, won in results:
+            if id2 is not None:
+                first.append(ids.index(id1))
+                second.append(ids.index(id2))
+            wins[ids.index(won)] += 1
+    print "19. Tournament outcomes can be simulated reproducibly."
+
+
+def testTournamentEntrants():
+    for backend in (database, tournament_memory):
+        backend.deleteMatches()
+        backend.deletePlayers()
+        backend.deleteTournaments()
+        masters = backend.registerTournament("Masters")
+        open_ = backend.registerTournament("U.S. Open")
+        [id1, id2] = backend.registerPlayers(["Ann", "Bob"], masters)
+        id3 = backend.registerPlayer("Cid", masters)
+        id4 = backend.registerPlayer("Dee")
+        if sorted(row[0] for row in backend.playerStandings(masters)) != \
+                [id1, id2, id3]:
+            raise ValueError("Standings should only list a tournament's "
+                             "entrants.")
+        if len(backend.playerStandings(open_)) != 4:
+            raise ValueError("A tournament without entrants should be open "
+                             "to every player.")
+        backend.enterTournament(masters, [id4, id1])
+        backend.enterTournament(masters, [id4])
+        if len(backend.playerStandings(masters)) != 4 or (
+                backend is tournament_memory and
+                len(backend._tournament(masters).entrants) != 4):
+            raise ValueError("Entering a player twice should list them once.")
+        pairings = backend.swissPairings(masters)
+        if sorted([row[0] for row in pairings] + [row[2] for row in pairings]) \
+                != [id1, id2, id3, id4]:
+            raise ValueError("Every entrant should be paired.")
+    print "20. Tournaments rank and pair only their entrants."
+
+
+def _scannedTables(plan):
+    """Returns the tables read by an executed Seq Scan in a JSON plan."""
+    tables = set()
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Actual Loops"):
+        tables.add(plan["Relation Name"].lower())
+    for child in plan.get("Plans", ()):
+        tables |= _scannedTables(child)
+    return tables
+
+
+def testQueriesUseIndexes():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    # 10,000 players and 1,000 tournaments of 200 entrants, 10 rounds of
+    # 100 matches each: 1,000,000 matches in all
+    with connect() as (db, cursor):
+        cursor.execute("""
+            INSERT INTO Player (full_name)
+              SELECT 'Player ' || g FROM generate_series(1, 10000) g;
+            INSERT INTO Tournament (description)
+              SELECT 'Tournament ' || g FROM generate_series(1, 1000) g;
+            CREATE TEMP TABLE Field AS
+              SELECT t.id AS tournament,
+                     (SELECT min(id) FROM Player) + (t.id % 50) * 200
+                       AS first_player
+                FROM Tournament t;
+            INSERT INTO TournamentPlayer (tournament, player)
+              SELECT tournament, first_player + g
+                FROM Field, generate_series(0, 199) g;
+            INSERT INTO Match (player1, player2, winner, round, tournament)
+              SELECT first_player + k, first_player + (k + 1 + 2 * r) % 200,
+                     first_player + CASE WHEN (k + r) % 3 = 0
+                                         THEN (k + 1 + 2 * r) % 200
+                                         ELSE k END,
+                     r, tournament
+                FROM Field, generate_series(1, 10) r,
+                     generate_series(0, 198, 2) k;
+            DROP TABLE Field;
+            ANALYZE Player;
+            ANALYZE Match;
+            ANALYZE TournamentPlayer;
+            INSERT INTO Standing
+              SELECT tournament, player, wins, matches, opponent_wins
+                FROM ComputedStanding;
+            ANALYZE Standing""")
+        cursor.execute("SELECT count(*), max(tournament), max(player1) "
+                       "FROM Match")
+        count, tournament, player = cursor.fetchone()
+        if count != 1000000:
+            raise ValueError("Expected 1,000,000 generated matches.")
+
+        queries = [
+            ("standings", database._STANDINGS_SQL,
+             {'tournament': tournament}),
+            ("match history", database._MATCHES_SQL, (tournament,)),
+            ("player matches", "SELECT opponent, winner FROM PlayerMatch "
+             "WHERE tournament = %s AND player = %s", (tournament, player)),
+            ("standings page", database._STANDINGS_PAGE_SQL,
+             {'tournament': tournament, 'after': player, 'wins': 5,
+              'opponent_wins': 50, 'limit': 100}),
+        ]
+        for name, sql, args in queries:
+            cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, args)
+            plan = cursor.fetchone()[0]
+            if not isinstance(plan, list):
+                plan = json.loads(plan)
+            scanned = _scannedTables(plan[0]["Plan"]) & set(
+                ["match", "standing", "tournamentplayer"])
+            if scanned:
+                raise ValueError("The %s query should not scan %s "
+                                 "sequentially." % (name,
+                                                    ", ".join(sorted(scanned))))
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    print "21. Standings and pairing queries use indexes at 1M matches."
+
+
+def testConcurrentReports():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    t = registerTournament("U.S. Open")
+    registerPlayers(["Player %d" % i for i in range(64)], t)
+    for round in range(1, 4):
+        threads = [threading.Thread(target=reportMatch,
+                                    args=(id1, id2, id1, round, t))
+                   for (id1, n1, id2, n2) in swissPairings(t)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    if any(row[3] != 3 for row in playerStandings(t)) or checkStandings(t):
+        raise ValueError("Concurrent reports should all be applied to "
+                         "Standing.")
+
+    # Tournaments sharing new players create and update the same Rating rows
+    players = registerPlayers(["Rated %d" % i for i in range(400)])
+    tournaments = [registerTournament("Open %d" % i) for i in range(6)]
+    errors = []
+
+    def play(t, round):
+        shuffled = random.Random(t * round).sample(players, len(players))
+        try:
+            reportRound(t, round, [(id1, id2, id1) for id1, id2 in
+                                   zip(shuffled[0::2], shuffled[1::2])])
+        except Exception as e:
+            errors.append(e)
+
+    for round in range(1, 6):
+        threads = [threading.Thread(target=play, args=(t, round))
+                   for t in tournaments]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    if errors or any(games != 6 * 5 for (id, name, rating, games)
+                     in playerRatings() if id in players):
+        raise ValueError("Rounds of different tournaments should be "
+                         "reported concurrently: %r" % errors[:1])
+    print "22. Matches and rounds can be reported concurrently."
+
+
+def testServerPairings():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    t = registerTournament("U.S. Open")
+    registerPlayers(["Ann", "Bob", "Cid", "Dee", "Eve"], t)
+    byes = []
+    for round in range(1, 4):
+        standings = playerStandings(t)
+        pairings = swissPairings(t, server=True)
+        ranked = [row[0] for row in standings
+                  if row[0] != pairings[-1][0]]
+        if [(id1, id2) for (id1, n1, id2, n2) in pairings[:-1]] != \
+                list(zip(ranked[0::2], ranked[1::2])):
+            raise ValueError("Server pairings should pair adjacent players "
+                             "in the standings.")
+        (bye, name, none, none_name) = pairings[-1]
+        if none is not None or bye in byes:
+            raise ValueError("The bye should go to a player without one.")
+        byes.append(bye)
+        reportRound(t, round, [(id1, id2, id1)
+                               for (id1, n1, id2, n2) in pairings])
+    print "23. Pairings can be computed by the database in one round trip."
+
+
+def testRatings():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    memory = tournament_memory
+    memory.deleteMatches()
+    memory.deletePlayers()
+    memory.deleteTournaments()
+    names = ["Ann", "Bob", "Cid", "Dee", "Eve"]
+    players = registerPlayers(names)
+    memory_players = memory.registerPlayers(names)
+    t = registerTournament("U.S. Open")
+    memory_t = memory.registerTournament("U.S. Open")
+    [a, b, c, d, e] = players
+    rounds = [[(a, b, a), (c, d, d), (e, None, e)],
+              [(a, d, d), (b, e, e), (c, None, c)],
+              [(d, e, d), (a, c, a), (b, None, b)]]
+    reportRound(t, 1, rounds[0])
+    for player1, player2, winner in rounds[1]:
+        reportMatch(player1, player2, winner, 2, t)
+    reportRound(t, 3, rounds[2])
+    offset = memory_players[0] - a
+
+    def shift(player):
+        return None if player is None else player + offset
+    for round, results in enumerate(rounds, 1):
+        memory.reportRound(memory_t, round, [tuple(map(shift, match))
+                                             for match in results])
+
+    history = [match for results in rounds for match in results]
+    expected, games = rating.rateMatches(players, *zip(*history))
+    expected = dict(zip(players, zip(expected.tolist(), games.tolist())))
+    stored = dict((row[0], row[2:]) for row in playerRatings())
+    in_memory = dict((row[0] - offset, row[2:])
+                     for row in memory.playerRatings())
+    recomputeRatings()
+    recomputed = dict((row[0], row[2:]) for row in playerRatings())
+    for ratings in (stored, in_memory, recomputed):
+        for player in players:
+            if ratings[player][1] != expected[player][1] or \
+                    abs(ratings[player][0] - expected[player][0]) > 1e-9:
+                raise ValueError("Ratings should follow each reported match.")
+    if abs(sum(r for r, g in expected.values()) -
+           len(players) * rating.INITIAL_RATING) > 1e-9:
+        raise ValueError("Elo updates should not create rating points.")
+
+    seeded = registerTournament("Masters")
+    enterTournament(seeded, [a, b, c, d])
+    ranked = [row[0] for row in playerRatings() if row[0] != e]
+    pairs = set(frozenset((id1, id2))
+                for (id1, n1, id2, n2) in swissPairings(seeded))
+    if pairs != set([frozenset((ranked[0], ranked[2])),
+                     frozenset((ranked[1], ranked[3]))]):
+        raise ValueError("The first round should be seeded by rating.")
+    print "24. Elo ratings follow reported matches and seed the first round."
+
+
+def testExport():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    t = registerTournament("U.S. Open")
+    other = registerTournament("Masters")
+    players = registerPlayers(["Ann", "Bob", "Cid", "Dee", "Eve"], t)
+    enterTournament(other, players[:2])
+    for round in range(1, 4):
+        reportRound(t, round, [(id1, id2, id1) for (id1, n1, id2, n2)
+                               in swissPairings(t)])
+    reportMatch(players[0], players[1], players[1], 1, other)
+
+    out = StringIO()
+    rows, seconds = tournament_export.export('matches', out, batch_size=2)
+    exported = list(csv.reader(StringIO(out.getvalue())))
+    if exported[0] != list(tournament_export.COLUMNS['matches']):
+        raise ValueError("A CSV export should start with a header line.")
+    if rows != 10 or len(exported) != 11:
+        raise ValueError("Every match should be exported once.")
+    if [row[1] for row in exported[1:]] != [str(t)] * 9 + [str(other)]:
+        raise ValueError("Matches should be exported tournament by "
+                         "tournament.")
+
+    out = StringIO()
+    tournament_export.export('standings', out, 'ndjson', t=t)
+    standings = [json.loads(line) for line in out.getvalue().splitlines()]
+    if [(row['id'], row['wins'], row['rank']) for row in standings] != \
+            [(row[0], row[2], rank) for rank, row
+             in enumerate(playerStandings(t), 1)]:
+        raise ValueError("Exported standings should match playerStandings().")
+
+    pairings = list(tournament_export.streamRows('pairings'))
+    if [row[2:] for row in pairings if row[0] == t] != swissPairings(t):
+        raise ValueError("Exported pairings should match swissPairings().")
+
+    stream = tournament_export.streamRows('matches', batch_size=1)
+    next(stream)
+    with connect() as (db, cursor):
+        cursor.execute("SELECT query FROM pg_stat_activity "
+                       "WHERE query LIKE 'FETCH FORWARD 1 FROM%%'")
+        fetching = cursor.fetchall()
+    stream.close()
+    if len(fetching) != 1:
+        raise ValueError("Exports should fetch through a server-side cursor.")
+    print "25. Matches, standings and pairings can be exported."
+
+
+def testInstrumentation():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    t = registerTournament("U.S. Open")
+    players = registerPlayers(["Player %d" % i for i in range(8)], t)
+    reportRound(t, 1, [(players[i], players[i + 1], players[i])
+                       for i in range(0, 8, 2)])
+    metrics = os.path.join(tempfile.mkdtemp(), "tournament.prom")
+    with instrument.profile(instrument.PrometheusSink(metrics)) as stats:
+        pairings = swissPairings(t)
+        reportRound(t, 2, [(id1, id2, id1)
+                           for (id1, n1, id2, n2) in pairings])
+    calls = stats.calls()
+    if sorted(calls) != ['reportRound', 'swissPairings']:
+        raise ValueError("Queries should be attributed to the calls that "
+                         "issued them.")
+    if calls['swissPairings'][:2] != (3, 1 + 8 + 4):
+        raise ValueError("Pairing should read the cache version, the "
+                         "standings and the history in three queries.")
+    if any(query.seconds < 0 or not query.sql for query in stats.queries):
+        raise ValueError("Each query should record its SQL and latency.")
+    with open(metrics) as prometheus:
+        lines = prometheus.read().splitlines()
+    if 'tournament_queries_total{call="swissPairings"} 3' not in lines:
+        raise ValueError("The Prometheus file should count queries per call.")
+    if database.CURSOR_FACTORY is not None:
+        raise ValueError("profile() should uninstall the instrumented cursor.")
+
+    # Calls holding a connection are not disturbed by profile()
+    checked_out, release, errors = threading.Event(), threading.Event(), []
+
+    def hold():
+        try:
+            with connect() as (db, cursor):
+                checked_out.set()
+                release.wait()
+                cursor.execute("SELECT 1")
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    checked_out.wait()
+    with instrument.profile():
+        countPlayers()
+    release.set()
+    thread.join()
+    if errors:
+        raise ValueError("profile() should not close connections in use: "
+                         "%r" % errors[0])
+
+    # Overlapping blocks, as from two threads, keep recording until the last
+    # one exits
+    first, second = instrument.profile(), instrument.profile()
+    first.__enter__()
+    stats = second.__enter__()
+    first.__exit__(None, None, None)
+    countPlayers()
+    second.__exit__(None, None, None)
+    if 'countPlayers' not in stats.calls() or \
+            database.CURSOR_FACTORY is not None:
+        raise ValueError("Only the last profile() block to exit should "
+                         "uninstall the instrumented cursor.")
+    print "26. Queries can be profiled per call."
+
+
+def testStandingsPages():
+    for backend in (database, tournament_memory):
+        backend.deleteMatches()
+        backend.deletePlayers()
+        backend.deleteTournaments()
+        t = backend.registerTournament("U.S. Open")
+        players = backend.registerPlayers(["Player %d" % i
+                                           for i in range(41)], t)
+        backend.registerPlayer("Spectator")
+        for round in range(1, 4):
+            pairings = backend.swissPairings(t)
+            backend.reportRound(t, round, [
+                (id1, id2, id1 if id2 is None or (id1 + round) % 3 else id2)
+                for (id1, n1, id2, n2) in pairings])
+        backend.enterTournament(t, [backend.registerPlayer("Latecomer")])
+        standings = backend.playerStandings(t)
+        if backend.topStandings(t, 10) != standings[:10]:
+            raise ValueError("topStandings() should return the leaders.")
+        pages = [backend.standingsPage(t, limit=7)]
+        while pages[-1]:
+            pages.append(backend.standingsPage(t, after=pages[-1][-1][0],
+                                               limit=7))
+        if [row for page in pages for row in page] != standings or \
+                len(pages) != 7:
+            raise ValueError("Standings pages should follow one another in "
+                             "ranking order.")
+    print "27. Standings can be read a page at a time."
+
+
+def testLeaderboard():
+    for backend in (database, tournament_memory):
+        backend.deleteMatches()
+        backend.deletePlayers()
+        backend.deleteTournaments()
+        players = backend.registerPlayers(["Player %d" % i
+                                           for i in range(11)])
+        tournaments = [backend.registerTournament("Open %d" % i)
+                       for i in range(3)]
+        for t in tournaments:
+            backend.enterTournament(t, players[t % 3:])
+            backend.reportRound(t, 1, [
+                (id1, id2, id1 if id2 is None or id1 % 2 else id2)
+                for (id1, n1, id2, n2) in backend.swissPairings(t)])
+            for (id1, n1, id2, n2) in backend.swissPairings(t):
+                backend.reportMatch(id1, id2, id1, 2, t)
+        backend.deleteTourMatches(tournaments[1])
+        backend.registerPlayer("Spectator")
+
+        totals = dict((player, [0, 0]) for player in players)
+        for t in tournaments:
+            for (player, name, wins, matches) in backend.playerStandings(t):
+                totals[player][0] += wins
+                totals[player][1] += matches
+        expected = sorted(((-wins, player, matches)
+                           for player, (wins, matches) in totals.items()
+                           if matches), key=lambda row: row[:2])
+        ratings = dict((row[0], row[2]) for row in backend.playerRatings())
+        pages = [backend.leaderboard(limit=4)]
+        while pages[-1]:
+            pages.append(backend.leaderboard(after=pages[-1][-1][0], limit=4))
+        rows = [row for page in pages for row in page]
+        if [(-wins, player, matches)
+                for (player, name, wins, matches, rate, r) in rows] != \
+                expected:
+            raise ValueError("The leaderboard should rank lifetime wins "
+                             "across tournaments.")
+        if any(rate != float(wins) / matches or r != ratings[player]
+               for (player, name, wins, matches, rate, r) in rows):
+            raise ValueError("The leaderboard should show win rates and "
+                             "ratings.")
+        backend.rebuildLeaderboard()
+        if backend.leaderboard(limit=len(players)) != rows:
+            raise ValueError("Lifetime records should match the history.")
+    print "28. The lifetime leaderboard spans every tournament."
+
+
+def testEventLog():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    t = registerTournament("U.S. Open")
+    registerPlayers(["Player %d" % i for i in range(12)], t)
+    registerPlayer("Spectator")
+    history = [None]
+    for round in range(1, 10):
+        results = [(id1, id2, id1 if (id1 + round) % 3 else id2)
+                   for (id1, n1, id2, n2) in swissPairings(t)]
+        if round % 2:
+            reportRound(t, round, results)
+        else:
+            for (id1, id2, winner) in results:
+                reportMatch(id1, id2, winner, round, t)
+        history.append(playerStandings(t))
+    for round in [9] + range(1, 10):
+        if standingsAt(t, round) != history[round]:
+            raise ValueError("Standings replayed from the log should match "
+                             "the standings after round %d." % round)
+
+    events = tournamentEvents(t)
+    if [row[1] for row in events if row[1] != 'delete'] != \
+            ['enter'] * 12 + ['report'] * 54:
+        raise ValueError("Entries and matches should be logged.")
+    before = events[-1][0]
+    match, player1, player2, winner = [
+        row[3:7] for row in events if row[1] == 'report' and row[2] == 3][0]
+    try:
+        correctMatch(match, registerPlayer("Stranger"))
+        raise ValueError("A winner must have played in the match.")
+    except ValueError as e:
+        if "did not play" not in str(e):
+            raise
+    correctMatch(match, player1 if winner == player2 else player2)
+    corrected = playerStandings(t)
+    if checkStandings(t) or corrected == history[9]:
+        raise ValueError("A correction should update the standings.")
+    if standingsAt(t, 9) != corrected or standingsAt(t, 2) != history[2]:
+        raise ValueError("Replay should apply corrections to later rounds "
+                         "only.")
+    if standingsAt(t, 9, event=before) != history[9]:
+        raise ValueError("Replay should stop at the given event.")
+
+    last = tournamentEvents(t)[-1][0]
+    deleteTourMatches(t)
+    if standingsAt(t, 9, event=last) != corrected or \
+            [row[3] for row in standingsAt(t, 9)] != [0] * 12:
+        raise ValueError("Deleted matches should stay in the log.")
+    print "29. Standings can be replayed from the event log."
+
+
+def testCoordinator():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournaments = [registerTournament("Side Event %d" % i) for i in range(6)]
+    for t in tournaments:
+        registerPlayers(["Player %d" % i for i in range(8)], t)
+    round, pairings = pairRound(tournaments[0])
+    if round != 1 or pairings != swissPairings(tournaments[0]):
+        raise ValueError("pairRound() should pair the next round.")
+
+    played = []
+    threads = [threading.Thread(target=lambda: played.append(
+        coordinator.playRounds(tournaments, 3, workers=3)))
+        for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for t in tournaments:
+        if played[0][t] + played[1][t] != 3 or lastRound(t) != 3:
+            raise ValueError("Each round should be reported exactly once.")
+        if [row[3] for row in playerStandings(t)] != [3] * 8 or \
+                checkStandings(t):
+            raise ValueError("Coordinated rounds should leave consistent "
+                             "standings.")
+
+    t = tournaments[0]
+    for call in (lambda: pairRound(t, 3),
+                 lambda: reportNextRound(t, 3, [
+                     (id1, id2, id1) for (id1, n1, id2, n2) in pairings])):
+        try:
+            call()
+            raise ValueError("A round can only be paired and reported once.")
+        except RoundConflict:
+            pass
+    print "30. Many tournaments can be played by concurrent coordinators."
+
+
+def testPairingsCache():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    tournaments = [registerTournament("Side Event %d" % i) for i in range(3)]
+    for t in tournaments:
+        registerPlayers(["Player %d" % i for i in range(8)], t)
+    t = tournaments[0]
+    pairings = swissPairings(t)
+    with instrument.profile() as stats:
+        if swissPairings(t) != pairings:
+            raise ValueError("Cached pairings should not change.")
+    if len(stats.queries) != 1:
+        raise ValueError("Cached pairings should only check the version.")
+
+    reportMatch(pairings[0][0], pairings[0][2], pairings[0][0], 1, t)
+    cached = swissPairings(t)
+    with connect() as (db, cursor):
+        cursor.execute(database._REPORT_MATCH_SQL, database._matchParams(
+            pairings[1][0], pairings[1][2], pairings[1][0], 1, t))
+    size = database.PAIRINGS_CACHE_SIZE
+    database.PAIRINGS_CACHE_SIZE = 0
+    try:
+        fresh = swissPairings(t)
+    finally:
+        database.PAIRINGS_CACHE_SIZE = size
+    if swissPairings(t) != fresh or fresh == cached or cached == pairings:
+        raise ValueError("Reports, even from other processes, should "
+                         "invalidate cached pairings.")
+
+    database.PAIRINGS_CACHE_SIZE = 2
+    try:
+        for t in tournaments:
+            swissPairings(t)
+        if [key[0] for key in database._pairings_cache] != tournaments[1:]:
+            raise ValueError("The least recently used pairings should be "
+                             "evicted.")
+    finally:
+        database.PAIRINGS_CACHE_SIZE = size
+    deleteTourMatches(tournaments[1])
+    if [key[0] for key in database._pairings_cache] != tournaments[2:]:
+        raise ValueError("deleteTourMatches() should drop cached pairings.")
+
+    deleteMatches()
+    t = tournaments[2]
+    swissPairings(t)
+    with connect() as (db, cursor):
+        cursor.execute(database._DELETE_PLAYERS_SQL)
+    if swissPairings(t):
+        raise ValueError("Deleting players, even from other processes, "
+                         "should invalidate cached pairings.")
+    print "31. Pairings are cached per round and invalidated by reports."
+
+
+def testSchedules():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    t = registerTournament("Round Robin")
+    registerPlayers(["Player %d" % i for i in range(7)], t)
+    if scheduleRoundRobin(t) != 28:
+        raise ValueError("A round robin of 7 should have 7 rounds of 4.")
+    for round in range(1, 8):
+        reportRound(t, round, [(id1, id2, id1)
+                               for (id1, n1, id2, n2) in roundFixtures(t)])
+    history = matchHistory(t)
+    if roundFixtures(t) or any(
+            len(history.opponents[row[0]]) != 6 or row[3] != 7
+            for row in playerStandings(t)):
+        raise ValueError("Everyone should meet everyone else once.")
+
+    t = registerTournament("Swiss and Knock-out")
+    registerPlayers(["Player %d" % i for i in range(8)], t)
+    reportRound(t, 1, [(id1, id2, id1)
+                       for (id1, n1, id2, n2) in swissPairings(t)])
+    seeds = [row[0] for row in playerStandings(t)][:6]
+    if scheduleElimination(t, double=True, top=6) != 14:
+        raise ValueError("A double elimination of 6 should have 14 games.")
+    round = 1
+    while True:
+        fixtures = roundFixtures(t)
+        if not fixtures:
+            break
+        round += 1
+        reportRound(t, round, [
+            (id1, id2, id1 if id2 is None or
+             seeds.index(id1) < seeds.index(id2) else id2)
+            for (id1, n1, id2, n2) in fixtures])
+    with connect() as (db, cursor):
+        cursor.execute("SELECT loser, COUNT(*) FROM (SELECT CASE winner "
+                       "WHEN player1 THEN player2 ELSE player1 END AS loser "
+                       "FROM Match WHERE tournament = %s AND round > 1 "
+                       "AND player2 IS NOT NULL) m GROUP BY loser", (t,))
+        losses = dict(cursor.fetchall())
+    if sorted(losses) != sorted(seeds[1:]) or set(losses.values()) != \
+            set([2]):
+        raise ValueError("Everyone but the top seed should lose twice.")
+    print "32. Round-robin and elimination schedules can be played."
+
+
+def testHTTPService():
+    deleteMatches()
+    deletePlayers()
+    deleteTournaments()
+    t = registerTournament("Web Open")
+    registerPlayers(["Ann", "Bob", "Cid", "Dee"], t)
+    server = tournament_server.serve('127.0.0.1', 0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    def request(method, path, body=None):
+        connection = httplib.HTTPConnection(*server.server_address)
+        try:
+            connection.request(method, path,
+                               None if body is None else json.dumps(body))
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    try:
+        status, pairings = request('GET', '/tournaments/%d/pairings' % t)
+        results = [[p['id1'], p['id2'], p['id1']] for p in pairings]
+        if request('POST', '/tournaments/%d/rounds/1' % t,
+                   {'results': results[:1]})[0] != 201 or \
+                request('POST', '/tournaments/%d/matches' % t,
+                        {'player1': results[1][0], 'player2': results[1][1],
+                         'winner': results[1][2], 'round': 1})[0] != 201:
+            raise ValueError("Reports should be accepted with 201.")
+        status, standings = request('GET', '/tournaments/%d/standings' % t)
+        if status != 200 or [
+                (s['id'], s['name'], s['wins'], s['matches'])
+                for s in standings] != playerStandings(t):
+            raise ValueError("GET standings should return playerStandings.")
+        if request('GET', '/tournaments/%d/standings?limit=2' % t)[1] != \
+                standings[:2]:
+            raise ValueError("limit should return the first page.")
+        if request('POST', '/tournaments/%d/matches' % t, {})[0] != 400 or \
+                request('GET', '/tournaments/%d/scores' % t)[0] != 404:
+            raise ValueError("Bad requests should get 400 and 404.")
+        if request('POST', '/tournaments/%d/rounds/2' % t, results)[0] != 400:
+            raise ValueError("A body that is not an object should get 400.")
+        if request('POST', '/tournaments/%d/matches' % t,
+                   {'player1': results[0][0], 'player2': -1, 'winner': -1,
+                    'round': 2})[0] != 400 or \
+                request('POST', '/tournaments/%d/matches' % t,
+                        {'player1': results[0][0], 'player2': results[1][0],
+                         'winner': results[0][0], 'round': 2 ** 40})[0] != 400:
+            raise ValueError("Unknown players and out of range values "
+                             "should get 400.")
+        if request('GET', '/tournaments/%d/matches' % t)[0] != 405:
+            raise ValueError("A known path with the wrong method should "
+                             "get 405.")
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+    reads = tournament_server.Coalescer()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        time.sleep(0.2)
+        return [1]
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        reads.call(t, 'key', slow))) for i in range(5)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:3]:
+        thread.start()
+    reads.bump(t)
+    for thread in threads[3:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if results != [[1]] * 5 or (reads.calls, reads.shared) != (2, 3):
+        raise ValueError("Identical calls in flight should share one call, "
+                         "unless it started before a write.")
+    print "33. The HTTP service serves JSON and coalesces identical reads."
+
+
+def testWithoutPsycopg2():
+    # sys.modules entries of None make the import fail, as when psycopg2 is
+    # not installed
+    script = ("import sys; sys.modules['psycopg2'] = None; "
+              "import tournament_sqlite, tournament_memory; "
+              "tournament_sqlite.registerPlayer('Ann'); "
+              "assert tournament_sqlite.countPlayers() == 1")
+    if subprocess.call([sys.executable, '-c', script],
+                       cwd=os.path.dirname(os.path.abspath(__file__))):
+        raise ValueError("The SQLite and in-memory backends should import "
+                         "and run without psycopg2.")
+    print "34. The SQLite and in-memory backends run without psycopg2."
+
+
 if __name__ == '__main__':
      testDeleteMatches()
      testDeleteTourMatches()
@@ -150,6 +1226,36 @@ if __name__ == '__main__':
      testStandingsBeforeMatches()
      testReportMatches()
      testPairings()
+     if BACKEND == 'postgresql':
+         testConnectionPool()
+     testStandingsPerTournament()
+     testRebuildStandings()
+     testReportRound()
+     testRegisterPlayers()
+     testPairingsAvoidRematches()
+     testPairingsOddField()
+     testTieBreaks()
+     if BACKEND == 'postgresql':
+         testMemoryBackend()
+     testSimulation()
+     testTournamentEntrants()
+     if BACKEND == 'postgresql':
+         testQueriesUseIndexes()
+     testConcurrentReports()
+     testServerPairings()
+     testRatings()
+     if BACKEND == 'postgresql':
+         testExport()
+         testInstrumentation()
+     testStandingsPages()
+     testLeaderboard()
+     if BACKEND == 'postgresql':
+         testEventLog()
+         testCoordinator()
+         testPairingsCache()
+         testSchedules()
+         testHTTPService()
+     testWithoutPsycopg2()
      print "Success!  All tests pass!"
 
 
@@ -0,0 +1,89 @@
+#
+# file: project_bench.py
+# author: lyn.evans
+# date: 09.07.15
+#
+# Concurrency benchmark of the catalog's read pages and JSON endpoints.
+# Each thread sends requests through its own Flask test client, so every
+# request gets its own scoped session and pooled connection just as under
+# a threaded server.  Run it against a populated database (db_populate.py):
+#
+#   python project_bench.py --threads 1 2 4 8 16 32 --requests 200
+#
+import argparse
+import threading
+import time
+from project import app, db_engine, session
+from db_setup import Era, Composer
+
+
+# Paths requested in turn by every thread
+def benchPaths():
+    era = session.query(Era).first()
+    composer = session.query(Composer).filter_by(era=era).first()
+    session.remove()
+    return ['/',
+            '/era/%s/composers' % era.name,
+            '/era/%s/%s' % (era.name, composer.name),
+            '/era/list/JSON',
+            '/era/%d/list/JSON' % era.id,
+            '/era/%d/composer/%d/JSON' % (era.id, composer.id)]
+
+
+# Run `requests` requests on each of `threads` threads, return requests/sec
+def runThreads(paths, threads, requests):
+    errors = []
+
+    def worker():
+        client = app.test_client()
+        for i in xrange(requests):
+            response = client.get(paths[i % len(paths)])
+            if response.status_code != 200 or \
+                    response.data == 'Error occurred':
+                errors.append(paths[i % len(paths)])
+
+    workers = [threading.Thread(target=worker) for x in xrange(threads)]
+    start = time.time()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.time() - start
+    if errors:
+        raise ValueError("%d requests failed, e.g. %s"
+                         % (len(errors), errors[0]))
+    return threads * requests / elapsed
+
+
+# A failed commit must not leave the next request's session unusable
+def checkIsolation():
+    client = app.test_client()
+    with app.test_request_context():
+        session.add(Composer(name=None))
+        try:
+            session.commit()
+        except Exception:
+            pass
+    response = client.get('/era/list/JSON')
+    if response.status_code != 200:
+        raise ValueError("A failed transaction leaked into the next request")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Measure catalog requests/sec at several thread counts.")
+    parser.add_argument("--threads", type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests sent by each thread")
+    args = parser.parse_args()
+
+    app.secret_key = 'project_bench'
+    checkIsolation()
+    paths = benchPaths()
+    for threads in args.threads:
+        rate = runThreads(paths, threads, args.requests)
+        print "%3d threads: %8.1f requests/sec  (%s)" % (
+            threads, rate, db_engine.pool.status())
+    if db_engine.pool.checkedout():
+        raise ValueError("Connections were not returned to the pool")